@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Connection Matrix Benchmark
+Compares load time and peak memory of the step2 JSON against the compact
+int16 matrix, on the real station set and on one scaled up by --scale (every
+station replaced by that many copies, connected like the original).
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from connection_matrix import load_connection_matrix, matrix_connections, save_connection_matrix
+
+
+def scale_connection_times(connection_times: Dict, scale: int) -> Dict:
+    """Replace every station by `scale` copies; each copy pair of a connection keeps its minutes."""
+    if scale == 1:
+        return connection_times
+    scaled = {}
+    for from_canton, targets in connection_times.items():
+        scaled[from_canton] = {}
+        for to_canton, conn_data in targets.items():
+            connections = [
+                {'from_station': f"{conn['from_station']} #{a}", 'to_station': f"{conn['to_station']} #{b}",
+                 'minutes': conn['minutes']}
+                for conn in conn_data.get('connections', [])
+                for a in range(scale) for b in range(scale)
+            ]
+            scaled[from_canton][to_canton] = {'connections': connections,
+                                              'shortest': connections[0] if connections else None}
+    return scaled
+
+
+def measure(load: Callable[[], Dict]) -> Dict:
+    """Load once untraced for wall time, once traced for peak Python memory."""
+    start = time.perf_counter()
+    connections = load()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 2 ** 20, 'connections': len(connections)}
+
+
+def load_json(path: str) -> Dict:
+    """JSON path: parse the nested matrix and collect its station pairs."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    connections = {}
+    for targets in data.values():
+        for conn_data in targets.values():
+            for conn in conn_data.get('connections', []):
+                connections[(conn['from_station'], conn['to_station'])] = conn['minutes']
+    return connections
+
+
+def load_matrix(path: str) -> Dict:
+    """Matrix path: memory-map the .npy file and collect its station pairs."""
+    _, stations, _, matrix = load_connection_matrix(path)
+    return matrix_connections(stations, matrix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the step2 JSON against the compact matrix")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--scale", type=int, action="append", help="Station set multiplier(s) (default: 1 and 10)")
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        connection_times = json.load(f)
+
+    print(f"{'Scale':>5} | {'Format':^6} | {'File MB':>8} | {'Load (s)':>8} | {'Peak MB':>8} | Connections")
+    print("-" * 70)
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scale or [1, 10]:
+            json_file = os.path.join(tmp, f"times_{scale}.json")
+            matrix_file = os.path.join(tmp, f"matrix_{scale}.npy")
+            scaled = scale_connection_times(connection_times, scale)
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(scaled, f, indent=2, ensure_ascii=False)
+            save_connection_matrix(scaled, matrix_file)
+            del scaled
+
+            for name, path, load in [("JSON", json_file, load_json), ("npy", matrix_file, load_matrix)]:
+                result = measure(lambda: load(path))
+                size = os.path.getsize(path)
+                if name == "npy":
+                    size += os.path.getsize(os.path.splitext(path)[0] + "_stations.json")
+                print(f"{scale:>5} | {name:^6} | {size / 2 ** 20:>8.2f} | {result['seconds']:>8.3f} | "
+                      f"{result['peak_mb']:>8.1f} | {result['connections']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Route Evaluation Benchmark
+Times the step3 routes (both directions) for every start minute of a window on
+the local timetable graph, once leg by leg with TimetableGraph.route_arrival and
+once with the vectorized BatchRouteEvaluator, and checks that both agree.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from timetable import BatchRouteEvaluator, ConnectionTimetable, TimetableGraph, time_to_minutes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch route evaluation against the per-route loop")
+    parser.add_argument("--routes", default="output_step3/top_27_canton_routes.json")
+    parser.add_argument("--timetable", default="output_step2/swiss_canton_connection_timetable.json",
+                        help="Departure/arrival sidecar written by step2")
+    parser.add_argument("--window", default="04:00-10:00", help="Start times HH:MM-HH:MM, one per minute")
+    parser.add_argument("--repeat", type=int, default=1, help="Copies of the route list, for larger batches")
+    args = parser.parse_args()
+
+    with open(args.routes, 'r', encoding='utf-8') as f:
+        rankings = json.load(f)['rankings']
+    routes = [ranking['combined_path'] for ranking in rankings]
+    routes = (routes + [route[::-1] for route in routes]) * args.repeat
+
+    window_start, window_end = (time_to_minutes(t) for t in args.window.split("-"))
+    starts = np.arange(window_start, window_end + 1)
+
+    graph = TimetableGraph.from_timetable(ConnectionTimetable.load(args.timetable))
+    print(f"{len(routes)} routes x {len(starts)} start times = {len(routes) * len(starts)} evaluations, "
+          f"{len(graph.edges)} timetable edges")
+
+    start = time.perf_counter()
+    loop_arrival = np.array([
+        [graph.route_arrival([graph.station_id.get(st, -1) for st in route], int(t)) or -1 for t in starts]
+        for route in routes
+    ])
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    evaluator = BatchRouteEvaluator(graph)
+    setup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    _, batch_arrival = evaluator.evaluate(routes, starts)
+    batch_seconds = time.perf_counter() - start
+
+    print(f"{'Method':^10} | {'Time (s)':>8} | {'Evaluations/s':>13}")
+    print("-" * 40)
+    for name, seconds in [("loop", loop_seconds), ("batch", batch_seconds)]:
+        print(f"{name:^10} | {seconds:>8.3f} | {len(routes) * len(starts) / seconds:>13.0f}")
+    print(f"Batch setup: {setup_seconds:.3f}s, reachable: {(batch_arrival >= 0).sum()}, "
+          f"identical to the loop: {np.array_equal(loop_arrival, batch_arrival)}")
+
+
+if __name__ == "__main__":
+    main()
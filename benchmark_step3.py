@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Step 3 Search Benchmark
+Measures wall time, peak traced memory and peak RSS of find_top_k_paths for
+each region/split point, one search at a time. With --baseline it measures the
+search as it was before labels and parent pointers: A* whose open list holds
+tuples carrying a copy of the whole path.
+"""
+
+import argparse
+import contextlib
+import heapq
+import io
+import resource
+import time
+import tracemalloc
+
+from typing import Dict, List
+
+from step3_find_shortest_routes import DEFAULT_GRAPH_FILE, SwissCantonRegionalPathFinder
+
+
+def path_copy_top_k_paths(finder: SwissCantonRegionalPathFinder, region: set, start_station: str,
+                          k: int = 3) -> List[Dict]:
+    """
+    Baseline: the best tour per end station for the K first end stations, by A* over
+    (station, mask) states keyed by name, pushing (priority, time, station, mask, path)
+    with a new path list per push. Same bound and results as find_top_k_paths.
+    """
+    region_canton_ids = sorted(finder.canton_to_id[c] for c in region if c in finder.canton_to_id)
+    region_mask = sum(1 << i for i in region_canton_ids)
+
+    def bound(station: str, mask: int) -> int:
+        unvisited = [i for i in region_canton_ids if not mask & (1 << i)]
+        if not unvisited:
+            return 0
+        times = finder.time_to_canton[finder.station_index[station]]
+        return max(sum(finder.min_entry_time[c] for c in unvisited), max(times[c] for c in unvisited))
+
+    def canton_bit(station: str) -> int:
+        canton = finder.station_to_canton[station]
+        return 1 << finder.canton_to_id[canton] if canton in region else 0
+
+    stats = {'expanded': 0, 'pushed': 1, 'beam': False}
+    finder.last_search_stats = stats
+    mask = canton_bit(start_station)
+    best_time = {(start_station, mask): 0}
+    pq = [(bound(start_station, mask), 0, start_station, mask, [start_station])]
+    best_by_end = {}
+
+    while pq:
+        _, current_time, current_station, current_mask, path = heapq.heappop(pq)
+        if best_time[(current_station, current_mask)] < current_time:
+            continue
+        if current_mask == region_mask:
+            if current_station not in best_by_end:
+                best_by_end[current_station] = {
+                    'stations': path,
+                    'cantons': [finder.station_to_canton[st] for st in path],
+                    'time': current_time,
+                    'end_station': current_station
+                }
+                if len(best_by_end) == k:
+                    break
+            continue
+
+        stats['expanded'] += 1
+        for next_station, travel_time in finder.neighbors[current_station]:
+            next_mask = current_mask | canton_bit(next_station)
+            next_time = current_time + travel_time
+            next_state = (next_station, next_mask)
+            if next_state not in best_time or best_time[next_state] > next_time:
+                best_time[next_state] = next_time
+                heapq.heappush(pq, (next_time + bound(next_station, next_mask), next_time, next_station,
+                                    next_mask, path + [next_station]))
+                stats['pushed'] += 1
+
+    return list(best_by_end.values())
+
+
+def measure(finder: SwissCantonRegionalPathFinder, region: set, split_point: str, k: int,
+            baseline: bool = False) -> dict:
+    """Run one search twice: untraced for wall time, traced for peak Python memory."""
+    if baseline:
+        def search():
+            return path_copy_top_k_paths(finder, region, split_point, k)
+    else:
+        def search():
+            return finder.find_top_k_paths(region, split_point, k)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        solutions = search()
+        elapsed = time.perf_counter() - start
+        stats = dict(finder.last_search_stats)
+
+        tracemalloc.start()
+        search()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'seconds': elapsed,
+        'peak_mb': peak / 2 ** 20,
+        'times': [sol['time'] for sol in solutions],
+        'expanded': stats['expanded'],
+        'pushed': stats['pushed'],
+        'gap': stats['optimality_gap'] if stats['beam'] else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the step3 region searches")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--split", action="append", help="Split point(s) to benchmark (default: all)")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Memory per search before it continues as a beam search")
+    parser.add_argument("--beam-width", type=int, default=10000)
+    parser.add_argument("--baseline", action="store_true",
+                        help="Measure the path-copy search find_top_k_paths replaced instead")
+    args = parser.parse_args()
+    if args.baseline and args.memory_budget is not None:
+        parser.error("--memory-budget applies to find_top_k_paths only")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    if args.memory_budget is not None:
+        finder.memory_budget = int(args.memory_budget * 2 ** 20)
+    finder.beam_width = args.beam_width
+
+    print(f"{'Split':^10} | {'Region':^6} | {'Time (s)':>8} | {'Peak MB':>8} | "
+          f"{'Expanded':>9} | {'Pushed':>9} | {'Gap':>4} | Best times")
+    print("-" * 80)
+
+    for split_point in args.split or finder.split_points:
+        for name, region in [("West", finder.west_cantons), ("East", finder.east_cantons)]:
+            result = measure(finder, region, split_point, args.k, args.baseline)
+            print(f"{split_point:^10} | {name:^6} | {result['seconds']:>8.2f} | {result['peak_mb']:>8.1f} | "
+                  f"{result['expanded']:>9} | {result['pushed']:>9} | "
+                  f"{'-' if result['gap'] is None else result['gap']:>4} | {result['times']}")
+
+    # ru_maxrss is in kilobytes on Linux
+    print(f"\nPeak RSS of this process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
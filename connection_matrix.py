@@ -0,0 +1,100 @@
+"""
+Compact form of the step2 connection matrix
+Stores the station-to-station minutes as a dense int16 .npy matrix (memory-
+mappable, no JSON parse) next to a small station dictionary, instead of the
+nested canton-to-canton JSON that holds every pair once per direction.
+"""
+
+import argparse
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+DEFAULT_MATRIX_FILE = "swiss_canton_connection_matrix.npy"
+
+# Matrix entry of station pairs without a connection
+NO_CONNECTION = -1
+
+
+def stations_file(matrix_file: str) -> str:
+    """Station dictionary written next to `matrix_file`."""
+    return os.path.splitext(matrix_file)[0] + "_stations.json"
+
+
+def iter_connections(connection_times: Dict) -> Iterator[Tuple[str, str, str, str, int]]:
+    """(from canton, to canton, from station, to station, minutes) of every connection in the step2 JSON."""
+    for from_canton, targets in connection_times.items():
+        for to_canton, conn_data in targets.items():
+            for conn in conn_data.get('connections', []):
+                yield from_canton, to_canton, conn['from_station'], conn['to_station'], conn['minutes']
+
+
+def save_connection_matrix(connection_times: Dict, matrix_file: str = DEFAULT_MATRIX_FILE):
+    """
+    Write the step2 matrix as an int16 station-by-station .npy file plus its station
+    dictionary (cantons, and the station names with their canton index).
+    """
+    station_to_canton = {}
+    for from_canton, to_canton, from_st, to_st, _ in iter_connections(connection_times):
+        station_to_canton[from_st] = from_canton
+        station_to_canton[to_st] = to_canton
+
+    cantons = sorted(connection_times)
+    canton_id = {canton: i for i, canton in enumerate(cantons)}
+    stations = sorted(station_to_canton)
+    index = {station: i for i, station in enumerate(stations)}
+
+    matrix = np.full((len(stations), len(stations)), NO_CONNECTION, dtype=np.int16)
+    for _, _, from_st, to_st, minutes in iter_connections(connection_times):
+        if not 0 <= minutes <= np.iinfo(np.int16).max:
+            raise ValueError(f"{from_st} -> {to_st}: {minutes} minutes does not fit the int16 matrix")
+        matrix[index[from_st], index[to_st]] = minutes
+
+    np.save(matrix_file, matrix)
+    with open(stations_file(matrix_file), 'w', encoding='utf-8') as f:
+        json.dump({
+            'cantons': cantons,
+            'stations': stations,
+            'station_canton': [canton_id[station_to_canton[st]] for st in stations]
+        }, f, ensure_ascii=False)
+
+
+def load_connection_matrix(matrix_file: str = DEFAULT_MATRIX_FILE,
+                           mmap: bool = True) -> Tuple[List[str], List[str], List[int], np.ndarray]:
+    """
+    Read a matrix written by save_connection_matrix. Returns the cantons, the
+    stations, the canton index of every station and the minutes matrix (memory-
+    mapped read-only unless `mmap` is False; NO_CONNECTION where there is none).
+    """
+    with open(stations_file(matrix_file), 'r', encoding='utf-8') as f:
+        dictionary = json.load(f)
+    matrix = np.load(matrix_file, mmap_mode='r' if mmap else None)
+    return dictionary['cantons'], dictionary['stations'], dictionary['station_canton'], matrix
+
+
+def matrix_connections(stations: List[str], matrix: np.ndarray) -> Dict[Tuple[str, str], int]:
+    """(from station, to station) -> minutes of every connection in the matrix."""
+    rows, cols = np.nonzero(matrix != NO_CONNECTION)
+    minutes = matrix[rows, cols].tolist()
+    return {(stations[i], stations[j]): m for i, j, m in zip(rows.tolist(), cols.tolist(), minutes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the step2 connection JSON to the compact matrix format")
+    parser.add_argument("input", nargs="?", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--output", default="output_step2/" + DEFAULT_MATRIX_FILE)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        connection_times = json.load(f)
+    save_connection_matrix(connection_times, args.output)
+
+    _, stations, _, matrix = load_connection_matrix(args.output)
+    print(f"{len(stations)} stations, {int((matrix != NO_CONNECTION).sum())} connections saved to "
+          f"'{args.output}' and '{stations_file(args.output)}'")
+
+
+if __name__ == "__main__":
+    main()
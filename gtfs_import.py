@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+GTFS Static Feed Importer
+Streams a GTFS zip (stops, trips, calendar, stop_times) into a compact binary
+timetable for one service date that can be memory-mapped by later steps.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from step1_define_stations import swiss_canton_stations
+from timetable import TimetableGraph
+
+CONNECTION_DTYPE = np.dtype([
+    ('dep', '<i4'),    # minutes since midnight of the service date
+    ('arr', '<i4'),
+    ('from', '<i4'),   # stop index
+    ('to', '<i4'),
+    ('trip', '<i4'),   # trip index, so a seated passenger stays on board
+])
+
+CONNECTIONS_FILE = "connections.npy"
+STOPS_FILE = "stops.json"
+
+
+def read_table(feed: zipfile.ZipFile, name: str) -> Iterator[Dict[str, str]]:
+    """Stream the rows of one GTFS table; yields nothing if the table is absent."""
+    if name not in feed.namelist():
+        return
+    with feed.open(name) as raw:
+        yield from csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+
+
+def gtfs_time_to_minutes(value: str) -> int:
+    """Convert a GTFS 'HH:MM:SS' time (hours may exceed 24) to minutes."""
+    hours, minutes, _ = value.strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def active_service_ids(feed: zipfile.ZipFile, date: str) -> Set[str]:
+    """Service ids running on `date` according to calendar.txt and calendar_dates.txt."""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    gtfs_date = day.strftime("%Y%m%d")
+    weekday = day.strftime("%A").lower()
+
+    services = set()
+    for row in read_table(feed, 'calendar.txt'):
+        if row['start_date'] <= gtfs_date <= row['end_date'] and row[weekday] == '1':
+            services.add(row['service_id'])
+
+    for row in read_table(feed, 'calendar_dates.txt'):
+        if row['date'] != gtfs_date:
+            continue
+        if row['exception_type'] == '1':
+            services.add(row['service_id'])
+        elif row['exception_type'] == '2':
+            services.discard(row['service_id'])
+
+    return services
+
+
+def load_stops(feed: zipfile.ZipFile) -> Tuple[Dict[str, int], List[str]]:
+    """
+    Map every stop_id to a stop index. Platforms are collapsed onto their parent
+    station so that changing platform is a transfer at the same stop.
+    """
+    rows = list(read_table(feed, 'stops.txt'))
+    parent_of = {row['stop_id']: row.get('parent_station') or '' for row in rows}
+    names = {row['stop_id']: row['stop_name'] for row in rows}
+
+    stop_index = {}
+    stop_names = []
+    for stop_id in names:
+        root = stop_id
+        while parent_of.get(root) and parent_of[root] in names:
+            root = parent_of[root]
+        if root not in stop_index:
+            stop_index[root] = len(stop_names)
+            stop_names.append(names[root])
+        stop_index[stop_id] = stop_index[root]
+
+    return stop_index, stop_names
+
+
+def match_canton_stations(stop_names: List[str],
+                          aliases: Optional[Dict[str, str]] = None) -> Dict[str, int]:
+    """Map the step1 canton station names to stop indices by (aliased) stop name."""
+    aliases = aliases or {}
+    by_name = {}
+    for i, name in enumerate(stop_names):
+        by_name.setdefault(name.casefold(), i)
+
+    matched = {}
+    for stations in swiss_canton_stations.values():
+        for station in stations:
+            name = aliases.get(station, station).casefold()
+            if name in by_name:
+                matched[station] = by_name[name]
+    return matched
+
+
+def stream_connections(feed: zipfile.ZipFile, trip_ids: Dict[str, int], stop_index: Dict[str, int],
+                       stats: Optional[Dict] = None) -> Iterator[Tuple[int, int, int, int, int]]:
+    """
+    Stream stop_times.txt and yield one elementary connection per pair of
+    consecutive stops of every selected trip. Rows are expected to be grouped
+    by trip, as published feeds are. Rows whose stop is missing from stops.txt
+    are skipped and counted in stats['unknown_stop_rows'].
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault('unknown_stop_rows', 0)
+
+    def trip_connections(trip: int, stops: List[Tuple[int, int, int, int]]):
+        stops.sort()
+        for (_, _, departure, from_stop), (_, arrival, _, to_stop) in zip(stops, stops[1:]):
+            if from_stop != to_stop:
+                yield departure, arrival, from_stop, to_stop, trip
+
+    current_trip = None
+    stops = []
+    with feed.open('stop_times.txt') as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+        header = next(reader)
+        col = {name: i for i, name in enumerate(header)}
+        trip_col, seq_col = col['trip_id'], col['stop_sequence']
+        arr_col, dep_col, stop_col = col['arrival_time'], col['departure_time'], col['stop_id']
+
+        for row in reader:
+            trip_id = row[trip_col]
+            if trip_id != current_trip:
+                if current_trip in trip_ids:
+                    yield from trip_connections(trip_ids[current_trip], stops)
+                current_trip = trip_id
+                stops = []
+            if trip_id not in trip_ids or not row[dep_col] or not row[arr_col]:
+                continue
+            if row[stop_col] not in stop_index:
+                stats['unknown_stop_rows'] += 1
+                continue
+            stops.append((int(row[seq_col]), gtfs_time_to_minutes(row[arr_col]),
+                          gtfs_time_to_minutes(row[dep_col]), stop_index[row[stop_col]]))
+
+        if current_trip in trip_ids:
+            yield from trip_connections(trip_ids[current_trip], stops)
+
+
+def import_gtfs(feed_path: str, date: str, output_dir: str,
+                aliases: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Build the binary timetable for `date` from a GTFS zip into `output_dir`.
+    Returns the stop metadata that is also written to stops.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with zipfile.ZipFile(feed_path) as feed:
+        services = active_service_ids(feed, date)
+
+        trip_ids = {}
+        for row in read_table(feed, 'trips.txt'):
+            if row['service_id'] in services:
+                trip_ids[row['trip_id']] = len(trip_ids)
+
+        stop_index, stop_names = load_stops(feed)
+
+        stats = {}
+        connections = np.fromiter(stream_connections(feed, trip_ids, stop_index, stats), dtype=CONNECTION_DTYPE)
+
+    connections.sort(order=['dep', 'arr'])
+    np.save(os.path.join(output_dir, CONNECTIONS_FILE), connections)
+
+    canton_stations = match_canton_stations(stop_names, aliases)
+    metadata = {
+        'date': date,
+        'feed': os.path.basename(feed_path),
+        'trips': len(trip_ids),
+        'connections': int(len(connections)),
+        'unknown_stop_rows': stats['unknown_stop_rows'],
+        'stops': stop_names,
+        'canton_stations': canton_stations
+    }
+    with open(os.path.join(output_dir, STOPS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+
+    return metadata
+
+
+def load_gtfs_timetable(timetable_dir: str) -> TimetableGraph:
+    """
+    Open an imported timetable as a TimetableGraph; the connection columns stay
+    memory-mapped. Legs between canton stations use per-edge tables, built by one
+    profile scan per target station the first time it is asked for.
+    """
+    with open(os.path.join(timetable_dir, STOPS_FILE), 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    connections = np.load(os.path.join(timetable_dir, CONNECTIONS_FILE), mmap_mode='r')
+
+    graph = TimetableGraph(metadata['date'])
+    graph.stations = list(metadata['stops'])
+    for i, name in enumerate(graph.stations):
+        graph.station_id.setdefault(name, i)
+    # The step1 names win over GTFS names where they differ
+    for station, i in metadata['canton_stations'].items():
+        graph.station_id[station] = i
+
+    graph.conn_dep = connections['dep']
+    graph.conn_arr = connections['arr']
+    graph.conn_from = connections['from']
+    graph.conn_to = connections['to']
+    graph.conn_trip = connections['trip']
+    graph.profile_stations = set(metadata['canton_stations'].values())
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a GTFS static feed into a binary timetable")
+    parser.add_argument("feed", help="GTFS zip file")
+    parser.add_argument("--date", default="2025-06-17", help="Service date (YYYY-MM-DD)")
+    parser.add_argument("--output", default="gtfs_timetable", help="Output directory")
+    parser.add_argument("--aliases", help="JSON file mapping step1 station names to GTFS stop names")
+    args = parser.parse_args()
+
+    aliases = None
+    if args.aliases:
+        with open(args.aliases, 'r', encoding='utf-8') as f:
+            aliases = json.load(f)
+
+    start_time = datetime.now()
+    metadata = import_gtfs(args.feed, args.date, args.output, aliases)
+    elapsed = (datetime.now() - start_time).total_seconds()
+
+    print(f"Imported {metadata['connections']} connections from {metadata['trips']} trips "
+          f"on {args.date} in {elapsed:.1f} seconds")
+    print(f"Stops: {len(metadata['stops'])}, matched canton stations: {len(metadata['canton_stations'])}")
+    if metadata['unknown_stop_rows']:
+        print(f"WARNING: skipped {metadata['unknown_stop_rows']} stop_times rows whose stop is not in stops.txt")
+
+    all_stations = [s for stations in swiss_canton_stations.values() for s in stations]
+    missing = [s for s in all_stations if s not in metadata['canton_stations']]
+    if missing:
+        print(f"WARNING: no GTFS stop found for: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
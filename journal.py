@@ -0,0 +1,99 @@
+"""
+Append-only JSON Lines journal
+Long-running steps write one record per finished unit of work instead of
+re-serializing everything collected so far. Records are flushed and fsynced in
+batches, and a restarted run reads the journal back to skip finished work.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List
+
+
+class Journal:
+    def __init__(self, path: str, batch_size: int = 16):
+        """
+        Open `path` for appending. Every `batch_size` appended records are flushed
+        to disk with fsync; `sync` and `close` flush the rest.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0
+        # Cut a record left incomplete by an interrupted run, so appends start on a fresh line
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(self._complete_length(f))
+        self.file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _complete_length(f) -> int:
+        """Byte length of the leading complete, parseable lines of `f`."""
+        length = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                json.loads(line)
+            except ValueError:
+                break
+            length += len(line)
+        return length
+
+    @staticmethod
+    def read(path: str) -> List[Dict]:
+        """
+        All complete records of the journal at `path` (none if it does not exist).
+        A last line cut short by an interrupted write is ignored.
+        """
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return records
+
+    def records(self) -> Iterator[Dict]:
+        """Records written so far, including the ones not yet synced."""
+        self.file.flush()
+        return iter(self.read(self.path))
+
+    def append(self, record: Dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.sync()
+
+    def sync(self):
+        if self.pending:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def fingerprint(paths: List[str]) -> str:
+    """
+    Short content hash of the files at `paths` (a missing file counts as absent),
+    stored in records to tell which inputs they were made from.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            digest.update(b'missing\0')
+            continue
+        file_digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_digest.update(chunk)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()[:16]
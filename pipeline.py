@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Incremental Pipeline
+Brings step2 -> step3 -> step4 up to date after a change to the step1 stations
+or to single connection times, recomputing only what the change touches:
+- step2: only station pairs that are new, refreshed, overridden or failed are fetched
+- step3: a region search is re-run only if a changed edge can affect its results
+- step4: only routes that are new, contain a changed leg or were timed with
+  another engine, start time or departures for their legs are re-timed
+Results of the previous run are kept in a state file; what was recomputed is
+printed and written to pipeline_report.json.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from step1_define_stations import swiss_canton_stations
+from step2_find_shortest_distances import (QUERY_DATE, QUERY_TIME, assemble_connection_times,
+                                           fetch_all_connections, station_pair_jobs)
+from step3_find_shortest_routes import DEFAULT_GRAPH_FILE, SwissCantonRegionalPathFinder
+from step4_find_actual_times_of_routes import SBBRouteCalculator
+from timetable import DEFAULT_TIMETABLE_FILE, ConnectionTimetable, TimetableGraph
+from transport_api import DEFAULT_CACHE_FILE, ResponseCache, TransportClient
+
+DEFAULT_STATE_FILE = "pipeline_state.json"
+STEP2_FILE = "output_step2/swiss_canton_connection_times.json"
+STEP2_TIMETABLE_FILE = os.path.join("output_step2", DEFAULT_TIMETABLE_FILE)
+STEP3_FILE = "output_step3/top_27_canton_routes.json"
+STEP4_FILE = "sbb_routes_final.json"
+
+Edge = Tuple[str, str]
+
+
+def pair_key(from_station: str, to_station: str) -> str:
+    """State file key of a station pair."""
+    return f"{from_station}|{to_station}"
+
+
+def matrix_edges(connection_times: Dict) -> Dict[Edge, int]:
+    """Directed (from, to) -> minutes of every connection in a step2 matrix."""
+    edges = {}
+    for targets in connection_times.values():
+        for data in targets.values():
+            for conn in data.get('connections', []):
+                edges[(conn['from_station'], conn['to_station'])] = conn['minutes']
+    return edges
+
+
+def path_edges(stations: List[str]) -> Set[Edge]:
+    """Consecutive (from, to) legs of a station sequence."""
+    return set(zip(stations, stations[1:]))
+
+
+def route_inputs(calculator: SBBRouteCalculator, stations: List[str], graph_digest: Optional[str] = None) -> str:
+    """
+    Short hash of what a step4 route result was timed with: the date, start time
+    and engine, and the departures the sidecar (and the local graph) hold for
+    its legs. A leg the graph has no direct edge for is answered by a scan of
+    the whole graph, so then `graph_digest` (the graph's digest()) counts.
+    """
+    legs = []
+    for leg in zip(stations, stations[1:]):
+        entry = [list(leg)]
+        if calculator.timetable is not None:
+            departures, arrivals = calculator.timetable.pairs.get(leg, ([], []))
+            entry.append([calculator.timetable.query_time, list(departures), list(arrivals)])
+        graph = calculator.graph
+        if graph is not None:
+            edge = tuple(graph.station_id.get(station) for station in leg)
+            if edge in graph.edges:
+                entry.append([[list(column) for column in graph.edges[edge]], graph.edge_window.get(edge)])
+            else:
+                entry.append(graph_digest)
+        legs.append(entry)
+    run = [calculator.date, calculator.start_time, calculator.engine, legs]
+    return hashlib.sha256(json.dumps(run, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+class IncrementalPipeline:
+    def __init__(self, state_file: str = DEFAULT_STATE_FILE):
+        """Load the state of the previous run, or start empty."""
+        self.state_file = state_file
+        if os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'pairs': {}, 'searches': {}, 'routes': {}}
+        self.report = {}
+
+    def save_state(self):
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+
+    def seed_from_outputs(self):
+        """Take the station pairs of existing step2 outputs as already fetched (first run only)."""
+        if self.state['pairs'] or not os.path.exists(STEP2_FILE):
+            return
+        with open(STEP2_FILE, 'r', encoding='utf-8') as f:
+            edges = matrix_edges(json.load(f))
+        timetable = ConnectionTimetable.load(STEP2_TIMETABLE_FILE) if os.path.exists(STEP2_TIMETABLE_FILE) else None
+
+        for from_station, to_station in station_pair_jobs():
+            minutes = edges.get((from_station, to_station))
+            if minutes is None:
+                continue
+            times = []
+            if timetable is not None and (from_station, to_station) in timetable.pairs:
+                departures, arrivals = timetable.pairs[(from_station, to_station)]
+                times = [list(t) for t in zip(departures, arrivals)]
+            self.state['pairs'][pair_key(from_station, to_station)] = {'minutes': minutes, 'times': times,
+                                                                       'failed': False}
+        print(f"Seeded {len(self.state['pairs'])} station pairs from {STEP2_FILE}")
+
+    def update_step2(self, client: TransportClient, workers: int, refresh: Set[Edge],
+                     overrides: Dict[Edge, int]) -> Dict[Edge, Tuple[Optional[int], Optional[int]]]:
+        """
+        Fetch the station pairs that are new in step1, in `refresh`, or whose last
+        fetch failed (a pair the API has no connection for is not asked again),
+        apply the minute `overrides`, and rewrite the step2 outputs if anything changed.
+        Returns the changed directed edges as (from, to) -> (old minutes, new minutes).
+        """
+        jobs = station_pair_jobs()
+        job_set = set(jobs)
+        pairs = self.state['pairs']
+
+        def job_direction(edge: Edge) -> Edge:
+            return edge if edge in job_set else (edge[1], edge[0])
+
+        def failed(job: Edge) -> bool:
+            # States written before failures were marked only have minutes: retry those once
+            entry = pairs.get(pair_key(*job))
+            return entry is None or entry.get('failed', entry['minutes'] is None)
+
+        refresh = {job_direction(edge) for edge in refresh}
+        overrides = {job_direction(edge): minutes for edge, minutes in overrides.items()}
+        to_fetch = [job for job in jobs if job not in overrides and (job in refresh or failed(job))]
+        retries = sum(pair_key(*job) in pairs for job in to_fetch if job not in refresh)
+
+        print(f"Step2: fetching {len(to_fetch)} of {len(jobs)} station pairs ({retries} failed before)")
+        fetched = fetch_all_connections(to_fetch, workers, client) if to_fetch else {}
+        for job, (minutes, times) in fetched.items():
+            pairs[pair_key(*job)] = {'minutes': minutes, 'times': [list(t) for t in times or []],
+                                     'failed': times is None}
+        for job, minutes in overrides.items():
+            entry = pairs.setdefault(pair_key(*job), {'times': []})
+            entry['minutes'] = minutes
+            entry['failed'] = False
+
+        # Pairs of stations that are no longer in step1 drop out here
+        stations = {st for members in swiss_canton_stations.values() for st in members}
+        removed = [key for key in pairs if not set(key.split('|')) <= stations]
+        for key in removed:
+            del pairs[key]
+
+        timetable = ConnectionTimetable(QUERY_DATE, QUERY_TIME)
+        matrix = assemble_connection_times(
+            {job: (pairs[pair_key(*job)]['minutes'], [tuple(t) for t in pairs[pair_key(*job)]['times']])
+             for job in jobs},
+            timetable
+        )
+
+        old_edges = {}
+        if os.path.exists(STEP2_FILE):
+            with open(STEP2_FILE, 'r', encoding='utf-8') as f:
+                old_edges = matrix_edges(json.load(f))
+        new_edges = matrix_edges(matrix)
+        changed = {
+            edge: (old_edges.get(edge), new_edges.get(edge))
+            for edge in set(old_edges) | set(new_edges)
+            if old_edges.get(edge) != new_edges.get(edge)
+        }
+
+        if changed or not os.path.exists(STEP2_FILE):
+            with open(STEP2_FILE, 'w', encoding='utf-8') as f:
+                json.dump(matrix, f, indent=2, ensure_ascii=False)
+            timetable.save(STEP2_TIMETABLE_FILE)
+
+        self.report['step2'] = {
+            'fetched_pairs': [list(job) for job in to_fetch],
+            'overridden_pairs': [[*job, minutes] for job, minutes in overrides.items()],
+            'removed_pairs': [key.split('|') for key in removed],
+            'changed_edges': [[*edge, old, new] for edge, (old, new) in sorted(changed.items())]
+        }
+        print(f"Step2: {len(changed)} directed edges changed, {len(removed)} pairs removed")
+        return changed
+
+    def search_is_valid(self, finder: SwissCantonRegionalPathFinder, split_point: str, solutions: List[Dict],
+                        changed: Dict[Edge, Tuple[Optional[int], Optional[int]]], k: int = 3) -> bool:
+        """
+        Whether the stored top-k solutions of a search from `split_point` still hold.
+        A slower or removed edge only matters if one of the solutions uses it; a
+        faster or new edge only if it can be reached from the split point within
+        the k-th best time.
+        """
+        used = set()
+        for solution in solutions:
+            used |= path_edges(solution['stations'])
+        start = finder.station_index.get(split_point)
+        if start is None:
+            return False
+        worst = max((solution['time'] for solution in solutions), default=None)
+
+        for edge, (old, new) in changed.items():
+            if old is not None and (new is None or new > old) and edge in used:
+                return False
+            if new is not None and (old is None or new < old):
+                if len(solutions) < k:
+                    return False
+                from_id = finder.station_index.get(edge[0])
+                if from_id is not None and finder.station_distance[start][from_id] + new <= worst:
+                    return False
+        return True
+
+    def update_step3(self, changed: Dict[Edge, Tuple[Optional[int], Optional[int]]], workers: int):
+        """Re-run only the region searches the changed edges can affect, then rebuild the ranking."""
+        finder = SwissCantonRegionalPathFinder(STEP2_FILE, DEFAULT_GRAPH_FILE)
+
+        known = {}
+        for split_point in finder.split_points:
+            for region_name in ('west', 'east'):
+                stored = self.state['searches'].get(pair_key(split_point, region_name))
+                if stored is not None and self.search_is_valid(finder, split_point, stored, changed):
+                    known[(split_point, region_name)] = stored
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            finder.find_all_combinations(workers, known)
+        os.replace('top_27_canton_routes.json', STEP3_FILE)
+
+        rerun = [key for key in finder.region_solutions if key not in known]
+        for (split_point, region_name), solutions in finder.region_solutions.items():
+            self.state['searches'][pair_key(split_point, region_name)] = solutions
+
+        self.report['step3'] = {
+            'rerun_searches': [list(key) for key in rerun],
+            'reused_searches': [list(key) for key in known]
+        }
+        print(f"Step3: re-ran {len(rerun)} of {len(finder.region_solutions)} region searches "
+              f"({', '.join(f'{sp}/{region}' for sp, region in rerun) or 'none'})")
+
+    def update_step4(self, calculator: SBBRouteCalculator, changed_legs: Set[Edge]):
+        """
+        Re-time only the routes that are new, contain a changed leg, or were timed
+        with other inputs (see route_inputs), then rewrite the report.
+        """
+        routes = self.state['routes']
+        retimed = []
+        reused = 0
+        results = []
+        graph_digest = calculator.graph.digest() if calculator.graph is not None else None
+
+        for ranking in sorted(calculator.data['rankings'], key=lambda x: x['total_time']):
+            fixed_path = calculator.fix_combined_path(ranking)
+            route_name = f"Route_{ranking['rank']}_Split_{ranking['split_point']}"
+            for direction, stations in [("forward", fixed_path), ("reverse", fixed_path[::-1])]:
+                key = '|'.join(stations)
+                inputs = route_inputs(calculator, stations, graph_digest)
+                stored = routes.get(key)
+                if stored is None or stored.get('inputs') != inputs or path_edges(stations) & changed_legs:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = calculator.calculate_route_time(stations, f"{route_name}_{direction.title()}",
+                                                                 direction)
+                    routes[key] = {'inputs': inputs, 'result': result}
+                    retimed.append(result['route_name'])
+                else:
+                    result = stored['result']
+                    reused += 1
+                result = dict(result, route_name=f"{route_name}_{direction.title()}", direction=direction,
+                              original_rank=ranking['rank'], split_point=ranking['split_point'],
+                              original_time=ranking['total_time'])
+                results.append(result)
+
+        # Routes that dropped out of the ranking are forgotten
+        current = {'|'.join(result['stations']) for result in results}
+        for key in [key for key in routes if key not in current]:
+            del routes[key]
+
+        calculator.results = results
+        with contextlib.redirect_stdout(io.StringIO()):
+            calculator.save_results(STEP4_FILE)
+
+        self.report['step4'] = {'retimed_routes': retimed, 'reused_routes': reused}
+        print(f"Step4: re-timed {len(retimed)} of {len(results)} routes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the step2-step4 outputs up to date, recomputing only what changed")
+    parser.add_argument("--state", default=DEFAULT_STATE_FILE)
+    parser.add_argument("--refresh-pair", nargs=2, action="append", default=[], metavar=("FROM", "TO"),
+                        help="Fetch this station pair again")
+    parser.add_argument("--refresh-station", action="append", default=[],
+                        help="Fetch every pair of this station again")
+    parser.add_argument("--override", nargs=3, action="append", default=[], metavar=("FROM", "TO", "MINUTES"),
+                        help="Set the minutes of a station pair without fetching it")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent step2 requests")
+    parser.add_argument("--search-workers", type=int, default=1, help="Processes for the step3 region searches")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Response cache file (SQLite)")
+    parser.add_argument("--no-cache", action="store_true", help="Always query the API")
+    parser.add_argument("--offline", action="store_true", help="Serve queries from the cache only")
+    parser.add_argument("--engine", choices=["api", "local"], default="api",
+                        help="How step4 times legs: the API, or offline from the sidecar and cached responses")
+    parser.add_argument("--skip-step4", action="store_true")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    client = TransportClient(pool_size=max(1, args.workers), cache=cache, offline=args.offline)
+
+    refresh = {tuple(pair) for pair in args.refresh_pair}
+    for station in args.refresh_station:
+        refresh |= {job for job in station_pair_jobs() if station in job}
+    overrides = {(from_station, to_station): int(minutes) for from_station, to_station, minutes in args.override}
+
+    pipeline = IncrementalPipeline(args.state)
+    pipeline.seed_from_outputs()
+    start = datetime.now()
+    timings = {}
+
+    changed = pipeline.update_step2(client, args.workers, refresh, overrides)
+    timings['step2'] = (datetime.now() - start).total_seconds()
+
+    pipeline.update_step3(changed, args.search_workers)
+    timings['step3'] = (datetime.now() - start).total_seconds() - timings['step2']
+
+    if not args.skip_step4:
+        # Refreshed pairs may have new departures even where the minimum did not change
+        changed_legs = set(changed) | refresh | {(to_st, from_st) for from_st, to_st in refresh}
+        timetable = ConnectionTimetable.load(STEP2_TIMETABLE_FILE) if os.path.exists(STEP2_TIMETABLE_FILE) else None
+        graph = None
+        if args.engine == "local":
+            graph = TimetableGraph(QUERY_DATE)
+            if timetable is not None:
+                graph.add_timetable(timetable)
+            if cache is not None:
+                graph.add_cached_responses(cache)
+            graph.finalize()
+        calculator = SBBRouteCalculator(STEP3_FILE, client, timetable, graph)
+        pipeline.update_step4(calculator, changed_legs)
+        timings['step4'] = (datetime.now() - start).total_seconds() - timings['step2'] - timings['step3']
+
+    pipeline.save_state()
+    pipeline.report['seconds'] = {step: round(seconds, 2) for step, seconds in timings.items()}
+    pipeline.report['timestamp'] = datetime.now().isoformat()
+    with open('pipeline_report.json', 'w', encoding='utf-8') as f:
+        json.dump(pipeline.report, f, indent=2, ensure_ascii=False)
+
+    print(f"\nAPI requests: {client.request_count}")
+    print("Times: " + ", ".join(f"{step} {seconds:.1f}s" for step, seconds in timings.items()))
+    print("Report saved to 'pipeline_report.json'")
+
+
+if __name__ == "__main__":
+    main()
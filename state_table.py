@@ -0,0 +1,80 @@
+"""
+Compact state table for the step3 searches
+Open-addressing hash table from packed (station id << shift | mask) keys to
+small ints, held in two flat arrays (12 bytes per slot) instead of a dict of
+boxed ints, and capped at a byte budget.
+"""
+
+from array import array
+
+# Packed state keys are never negative
+EMPTY = -1
+
+# Fibonacci hashing multiplier (2^64 / golden ratio)
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+class StateTable:
+    def __init__(self, max_bytes: int, capacity: int = 1 << 12):
+        """
+        Empty table of `capacity` slots (a power of two), doubled whenever it gets
+        three quarters full as long as it stays within `max_bytes`. Once it cannot
+        grow, new keys are not stored and `full` is set; existing keys still update.
+        """
+        self.max_bytes = max_bytes
+        self.full = False
+        self.size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        self.bits = capacity.bit_length() - 1
+        self.keys = array('q', [EMPTY]) * capacity
+        self.values = array('i', [0]) * capacity
+
+    def _slot(self, key: int) -> int:
+        """Slot holding `key`, or the empty slot where it belongs (linear probing)."""
+        keys = self.keys
+        slot_mask = len(keys) - 1
+        slot = ((key * HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+        while keys[slot] != key and keys[slot] != EMPTY:
+            slot = (slot + 1) & slot_mask
+        return slot
+
+    def get(self, key: int, default=None):
+        slot = self._slot(key)
+        return self.values[slot] if self.keys[slot] == key else default
+
+    def __contains__(self, key: int) -> bool:
+        return self.keys[self._slot(key)] == key
+
+    def __setitem__(self, key: int, value: int):
+        slot = self._slot(key)
+        if self.keys[slot] != key:
+            if (self.size + 1) * 4 > len(self.keys) * 3:
+                if not self._grow():
+                    self.full = True
+                    return
+                slot = self._slot(key)
+            self.keys[slot] = key
+            self.size += 1
+        self.values[slot] = value
+
+    def _grow(self) -> bool:
+        capacity = 2 * len(self.keys)
+        if capacity * (self.keys.itemsize + self.values.itemsize) > self.max_bytes:
+            return False
+        keys, values = self.keys, self.values
+        self._allocate(capacity)
+        for key, value in zip(keys, values):
+            if key != EMPTY:
+                slot = self._slot(key)
+                self.keys[slot] = key
+                self.values[slot] = value
+        return True
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.keys) * (self.keys.itemsize + self.values.itemsize)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Station Selection
+Prunes the stations per canton to a smaller set that provably keeps the optimal
+tour cost, so later step2 crawls query fewer pairs and step3 searches a smaller
+state space. A station is dropped when no shortest path between the remaining
+stations needs it and another station of its canton is at least as close to and
+from every remaining station.
+"""
+
+import argparse
+import json
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from step1_define_stations import neighbors
+from step3_exact_solver import ExactTourSolver
+from step3_find_shortest_routes import (DEFAULT_GRAPH_FILE, INFINITY, SwissCantonRegionalPathFinder,
+                                        all_pairs_shortest_times)
+
+
+class StationSelector:
+    def __init__(self, finder: SwissCantonRegionalPathFinder):
+        self.finder = finder
+        self.station_count = len(finder.station_list)
+        self.canton_of = np.array(finder.station_canton_id)
+        self.sources = np.repeat(np.arange(self.station_count), np.diff(finder.csr_offsets))
+        self.targets = finder.csr_targets
+        self.weights = finder.csr_weights
+
+    def shortest_times(self, alive: np.ndarray) -> np.ndarray:
+        """All-pairs shortest times using only the connections between `alive` stations."""
+        keep = alive[self.sources] & alive[self.targets]
+        counts = np.bincount(self.sources[keep], minlength=self.station_count)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return all_pairs_shortest_times(offsets, self.targets[keep].tolist(), self.weights[keep].tolist())[0]
+
+    def select(self, protected: Optional[Set[str]] = None) -> List[str]:
+        """
+        Greedily drop stations, each time recomputing the shortest times. Station v
+        goes if (1) the times between all other remaining stations are the same
+        without it, and (2) a remaining station u of its canton has d(x, u) <= d(x, v)
+        and d(u, x) <= d(v, x) for every other remaining station x. Written as a
+        chain of shortest paths between the stations where it first enters a canton,
+        any tour through v then maps to one through u that is no longer and visits
+        the same cantons, so the optimal tour cost stays the same.
+        Stations in `protected` (the split points by default) are always kept.
+        Returns the kept stations; the dropped ones are in self.removed.
+        """
+        finder = self.finder
+        if protected is None:
+            protected = set(finder.split_points)
+        alive = np.ones(self.station_count, dtype=bool)
+        dist = self.shortest_times(alive)
+
+        # Least central stations first: largest total time to and from the others
+        reachable = np.where(dist < INFINITY, dist, 0)
+        order = np.argsort(-(reachable.sum(axis=0) + reachable.sum(axis=1)), kind='stable')
+
+        self.removed = []
+        for v in order.tolist():
+            if finder.station_list[v] in protected:
+                continue
+            others = alive.copy()
+            others[v] = False
+            same_canton = np.flatnonzero(others & (self.canton_of == self.canton_of[v]))
+            if not len(same_canton):
+                continue
+
+            dominating = [u for u in same_canton.tolist()
+                          if (dist[others, u] <= dist[others, v]).all() and (dist[u, others] <= dist[v, others]).all()]
+            if not dominating:
+                continue
+
+            reduced = self.shortest_times(others)
+            if not (reduced[np.ix_(others, others)] == dist[np.ix_(others, others)]).all():
+                continue
+
+            alive = others
+            dist = reduced
+            self.removed.append(finder.station_list[v])
+
+        return [station for i, station in enumerate(finder.station_list) if alive[i]]
+
+    def stations_by_canton(self, stations: List[str]) -> Dict[str, List[str]]:
+        """Stations grouped per canton, in the form of step1's swiss_canton_stations."""
+        by_canton = {canton: [] for canton in self.finder.cantons}
+        for station in stations:
+            by_canton[self.finder.station_to_canton[station]].append(station)
+        return by_canton
+
+    def restricted_weights(self, stations: List[str]) -> List[int]:
+        """CSR weights of the finder with every connection touching a dropped station removed."""
+        alive = np.zeros(self.station_count, dtype=bool)
+        alive[[self.finder.station_index[st] for st in stations]] = True
+        keep = alive[self.sources] & alive[self.targets]
+        return np.where(keep, self.weights, INFINITY).tolist()
+
+
+def step2_queries(stations_by_canton: Dict[str, List[str]]) -> int:
+    """Station pairs step2 queries for a station set (each neighboring canton pair once)."""
+    pairs = {tuple(sorted((canton, neighbor))) for canton, neighbor_list in neighbors.items()
+             for neighbor in neighbor_list}
+    return sum(len(stations_by_canton.get(a, [])) * len(stations_by_canton.get(b, [])) for a, b in pairs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune stations that no optimal tour needs")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--protect", action="append", default=[],
+                        help="Station to keep in any case (repeatable; the split points are always kept)")
+    parser.add_argument("--output", default="selected_stations.json")
+    parser.add_argument("--verify", action="store_true",
+                        help="Solve the exact tour on both station sets and compare the optimum")
+    args = parser.parse_args()
+
+    print("Station Selection")
+    print("=" * 80)
+
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    selector = StationSelector(finder)
+    kept = selector.select(set(finder.split_points) | set(args.protect))
+
+    before = selector.stations_by_canton(finder.station_list)
+    after = selector.stations_by_canton(kept)
+    print(f"\nKept {len(kept)} of {len(finder.station_list)} stations, removed {len(selector.removed)}:")
+    for station in sorted(selector.removed):
+        print(f"  {station} ({finder.station_to_canton[station]})")
+    print(f"step2 queries: {step2_queries(before)} -> {step2_queries(after)}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(after, f, indent=2, ensure_ascii=False)
+    print(f"Saved to '{args.output}'")
+
+    if args.verify:
+        full = ExactTourSolver(finder).solve(closure=True)
+        reduced = ExactTourSolver(finder, selector.restricted_weights(kept)).solve(start_stations=kept, closure=True)
+        print(f"\nOptimal tour: {full['time']} min on all stations, "
+              f"{reduced['time'] if reduced else None} min on the selected stations")
+
+
+if __name__ == "__main__":
+    main()
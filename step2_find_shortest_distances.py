@@ -1,9 +1,33 @@
-import requests
+import argparse
 import json
-from typing import Dict, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 from step1_define_stations import neighbors, swiss_canton_stations
+from transport_api import DEFAULT_CACHE_FILE, CacheMissError, ResponseCache, TransportClient
+from timetable import (DEFAULT_TIMETABLE_FILE, ConnectionTimetable, extract_connection_times, minutes_to_time,
+                       time_to_minutes)
+from journal import Journal
+from connection_matrix import DEFAULT_MATRIX_FILE, save_connection_matrix
 from datetime import datetime
 
+QUERY_DATE = '2025-06-17'  # Tuesday
+QUERY_TIME = '08:00'
+
+# Append-only log of fetched station pairs, reloaded by --resume
+DEFAULT_CHECKPOINT_FILE = 'swiss_canton_connection_times_checkpoint.jsonl'
+
+# Shared pooled client used when no explicit client is passed in
+default_client = None
+
+
+def get_default_client() -> TransportClient:
+    """Lazily create the module-wide transport client."""
+    global default_client
+    if default_client is None:
+        default_client = TransportClient()
+    return default_client
+
 
 def duration_to_minutes(duration_str: str) -> int:
     """Convert duration string format '00d00:39:00' to minutes."""
@@ -15,21 +39,28 @@ def duration_to_minutes(duration_str: str) -> int:
     minutes = int(parts[1])
     return days * 24 * 60 + hours * 60 + minutes
 
-def fetch_connection(from_station: str, to_station: str) -> Optional[int]:
-    """Fetch the shortest connection time between two stations."""
-    url = f"http://transport.opendata.ch/v1/connections"
+def fetch_connection_details(from_station: str, to_station: str,
+                             client: Optional[TransportClient] = None) -> Tuple[Optional[int], Optional[List[Tuple[int, int]]]]:
+    """
+    Fetch the shortest connection time between two stations together with the
+    (departure, arrival) minutes of every connection in the response. A pair
+    without a connection gives (None, []); a failed request gives (None, None),
+    so the caller can fetch it again. A query missing from the cache in offline
+    mode raises CacheMissError.
+    """
+    if client is None:
+        client = get_default_client()
+
     params = {
         'from': from_station,
         'to': to_station,
         'limit': 16,  # Maximum limit according to API docs
-        'time': '08:00',  # Tuesday morning at 8:00
-        'date': '2025-06-17'
+        'time': QUERY_TIME,  # Tuesday morning at 8:00
+        'date': QUERY_DATE
     }
     
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = client.get_connections(params)
         
         if data.get('connections'):
             # Find the shortest duration
@@ -40,18 +71,202 @@ def fetch_connection(from_station: str, to_station: str) -> Optional[int]:
                 if minutes < shortest_minutes:
                     shortest_minutes = minutes
             
-            return shortest_minutes if shortest_minutes != float('inf') else None
+            # Keep the timetable too, step4 answers time-dependent lookups from it
+            times = extract_connection_times(data, QUERY_DATE)
+            
+            return (shortest_minutes if shortest_minutes != float('inf') else None), times
         
-        return None
+        return None, []
+    except CacheMissError:
+        raise
     except Exception as e:
         print(f"Error fetching {from_station} to {to_station}: {e}")
-        return None
+        return None, None
 
-def create_comprehensive_connection_times() -> Dict[str, Dict[str, Dict[str, any]]]:
+def fetch_connection(from_station: str, to_station: str,
+                     client: Optional[TransportClient] = None) -> Optional[int]:
+    """Fetch the shortest connection time between two stations."""
+    return fetch_connection_details(from_station, to_station, client)[0]
+
+def fetch_departures(from_station: str, to_station: str, window_start: str, window_end: str,
+                     client: Optional[TransportClient] = None) -> List[Tuple[int, int]]:
+    """
+    (departure, arrival) minutes of the connections from one station to another
+    leaving from `window_start` until `window_end` (HH:MM), paging through the
+    API 16 connections at a time from just after the last departure returned.
+    Raises CacheMissError for a page missing from the cache in offline mode.
+    """
+    if client is None:
+        client = get_default_client()
+    
+    end = min(time_to_minutes(window_end), 24 * 60 - 1)
+    query = time_to_minutes(window_start)
+    times = set()
+    while query <= end:
+        params = {
+            'from': from_station,
+            'to': to_station,
+            'limit': 16,
+            'time': minutes_to_time(query),
+            'date': QUERY_DATE
+        }
+        try:
+            page = extract_connection_times(client.get_connections(params), QUERY_DATE)
+        except CacheMissError:
+            raise
+        except Exception as e:
+            print(f"Error fetching departures {from_station} to {to_station} at {params['time']}: {e}")
+            break
+        if not page:
+            break
+        times.update(page)
+        next_query = max(departure for departure, _ in page) + 1
+        if next_query <= query:
+            break
+        query = next_query
+    return sorted(times)
+
+def fetch_timetable(jobs: List[Tuple[str, str]], window_start: str, window_end: str, max_workers: int = 8,
+                    client: Optional[TransportClient] = None) -> ConnectionTimetable:
+    """
+    Departures of both directions of every station pair in `jobs` over the window,
+    for the sidecar step4 reads (its legs run both ways from its start time).
+    """
+    timetable = ConnectionTimetable(QUERY_DATE, window_start)
+    directed = [job for from_station, to_station in jobs
+                for job in ((from_station, to_station), (to_station, from_station))]
+    print(f"Fetching departures {window_start}-{window_end} for {len(directed)} directed station pairs")
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(fetch_departures, from_station, to_station, window_start, window_end, client): job
+            for job in directed for from_station, to_station in [job]
+        }
+        for count, future in enumerate(as_completed(futures), 1):
+            times = future.result()
+            if times:
+                timetable.add_pair(*futures[future], times)
+            if count % 100 == 0 or count == len(directed):
+                print(f"  [{count}/{len(directed)}] directed pairs fetched")
+    return timetable
+
+def load_stations(path: str) -> Dict[str, List[str]]:
+    """Stations per canton from a JSON file in the form of step1's swiss_canton_stations."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def station_pair_jobs(stations: Optional[Dict[str, List[str]]] = None) -> List[Tuple[str, str]]:
+    """
+    List every station pair to fetch, in the order the matrix is assembled.
+    `stations` (per canton) defaults to step1's swiss_canton_stations.
+    """
+    if stations is None:
+        stations = swiss_canton_stations
+    jobs = []
+    processed_pairs = set()
+    
+    for canton, neighbor_list in neighbors.items():
+        for neighbor in neighbor_list:
+            pair_id = tuple(sorted([canton, neighbor]))
+            if pair_id in processed_pairs:
+                continue
+            processed_pairs.add(pair_id)
+            
+            for from_station in stations.get(canton, []):
+                for to_station in stations.get(neighbor, []):
+                    jobs.append((from_station, to_station))
+    
+    return jobs
+
+def load_checkpoint(path: str, jobs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[Optional[int], List]]:
+    """
+    Fetched (minutes, times) per job from the checkpoint log at `path`, for the
+    current query date and time. A pair logged in the other direction than its
+    job (the neighbor order in step1 changed) is reused with its minimum
+    mirrored, as in the matrix; its departures are dropped since they only hold
+    for the logged direction.
+    """
+    logged = {}
+    for record in Journal.read(path):
+        if record['date'] == QUERY_DATE and record['time'] == QUERY_TIME:
+            logged[(record['from'], record['to'])] = (record['minutes'], [tuple(t) for t in record['times']])
+    
+    fetched = {}
+    for from_station, to_station in jobs:
+        if (from_station, to_station) in logged:
+            fetched[(from_station, to_station)] = logged[(from_station, to_station)]
+        elif (to_station, from_station) in logged:
+            fetched[(from_station, to_station)] = (logged[(to_station, from_station)][0], [])
+    return fetched
+
+def fetch_all_connections(jobs: List[Tuple[str, str]], max_workers: int = 8,
+                          client: Optional[TransportClient] = None,
+                          checkpoint: Optional[Journal] = None) -> Dict[Tuple[str, str], Tuple[Optional[int], List]]:
+    """
+    Fetch all station pairs on a thread pool sharing one rate-limited client.
+    Returns (shortest minutes, [(departure, arrival), ...]) per pair, with None
+    instead of the list for a failed request (see fetch_connection_details).
+    Answered pairs, with or without a connection, are appended to `checkpoint`
+    as they complete; failed ones are fetched again on resume.
+    """
+    if client is None:
+        client = get_default_client()
+    
+    results = {}
+    total = len(jobs)
+    
+    def report(count: int, from_station: str, to_station: str, connection_time: Optional[int]):
+        times = results[(from_station, to_station)][1]
+        if checkpoint is not None and times is not None:
+            checkpoint.append({'date': QUERY_DATE, 'time': QUERY_TIME, 'from': from_station, 'to': to_station,
+                               'minutes': connection_time, 'times': times})
+        progress = count / total * 100
+        print(f"  [{count}/{total}] ({progress:.1f}%) {from_station} -> {to_station}", end="")
+        if connection_time is not None:
+            print(f" -> {connection_time} min ({connection_time // 60}h {connection_time % 60}min)")
+        elif times is None:
+            print(f" -> Fetch failed")
+        else:
+            print(f" -> No connection found")
+    
+    if max_workers <= 1:
+        for count, (from_station, to_station) in enumerate(jobs, 1):
+            results[(from_station, to_station)] = fetch_connection_details(from_station, to_station, client)
+            report(count, from_station, to_station, results[(from_station, to_station)][0])
+        return results
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch_connection_details, from_station, to_station, client): (from_station, to_station)
+            for from_station, to_station in jobs
+        }
+        for count, future in enumerate(as_completed(futures), 1):
+            from_station, to_station = futures[future]
+            results[(from_station, to_station)] = future.result()
+            report(count, from_station, to_station, results[(from_station, to_station)][0])
+    
+    return results
+
+def create_comprehensive_connection_times(max_workers: int = 8,
+                                          client: Optional[TransportClient] = None,
+                                          timetable: Optional[ConnectionTimetable] = None,
+                                          checkpoint_file: Optional[str] = None,
+                                          resume: bool = False,
+                                          stations: Optional[Dict[str, List[str]]] = None) -> Dict[str, Dict[str, Dict[str, any]]]:
     """
     Create a comprehensive dictionary of connection times between all station 
     combinations of neighboring cantons.
     
+    Each station pair is queried in one direction only and the minimum is
+    mirrored to the reverse direction. If `timetable` is given, the departure
+    list of every queried direction is recorded in it as well; reverse
+    directions are left out because their departures are not symmetric (see
+    fetch_timetable for a sidecar covering both directions).
+    
+    Fetched pairs are logged to `checkpoint_file` as they complete. With
+    `resume` the pairs already in it are not fetched again; otherwise it is
+    started over. `stations` (per canton) defaults to step1's swiss_canton_stations.
+    
     Structure:
     {
         "Canton1": {
@@ -73,28 +288,51 @@ def create_comprehensive_connection_times() -> Dict[str, Dict[str, Dict[str, any
         }
     }
     """
-    connection_times = {}
-    processed_pairs = set()
-    
-    # Calculate total number of connections to fetch
-    total_connections = 0
-    for canton, neighbor_list in neighbors.items():
-        for neighbor in neighbor_list:
-            pair_id = tuple(sorted([canton, neighbor]))
-            if pair_id not in processed_pairs:
-                from_stations = swiss_canton_stations.get(canton, [])
-                to_stations = swiss_canton_stations.get(neighbor, [])
-                total_connections += len(from_stations) * len(to_stations)
-                processed_pairs.add(pair_id)
+    jobs = station_pair_jobs(stations)
+    total_connections = len(jobs)
     
-    processed_pairs.clear()
-    connection_count = 0
+    fetched = {}
+    checkpoint = None
+    if checkpoint_file is not None:
+        if resume:
+            fetched = load_checkpoint(checkpoint_file, jobs)
+            print(f"Resuming: {len(fetched)} of {total_connections} pairs in '{checkpoint_file}'")
+        elif os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        checkpoint = Journal(checkpoint_file)
+    missing = [job for job in jobs if job not in fetched]
     
-    print(f"Total connections to fetch: {total_connections}")
-    print(f"Estimated time: {total_connections * 0.5 / 60:.1f} minutes\n")
+    print(f"Total connections to fetch: {len(missing)}")
+    print(f"Fetching with {max_workers} worker(s)\n")
     
     start_time = datetime.now()
     
+    # Fetch everything up front; the matrix is then assembled in the original
+    # order so the JSON output is identical to the sequential crawl
+    try:
+        fetched.update(fetch_all_connections(missing, max_workers, client, checkpoint))
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    connection_times = assemble_connection_times(fetched, timetable, stations)
+    
+    elapsed_time = (datetime.now() - start_time).total_seconds() / 60
+    print(f"\n\nCompleted in {elapsed_time:.1f} minutes")
+    
+    return connection_times
+
+def assemble_connection_times(fetched: Dict[Tuple[str, str], Tuple[Optional[int], List]],
+                              timetable: Optional[ConnectionTimetable] = None,
+                              stations: Optional[Dict[str, List[str]]] = None) -> Dict[str, Dict[str, Dict[str, any]]]:
+    """
+    Build the canton-to-canton matrix from fetched (minutes, times) per station
+    pair, as returned by fetch_all_connections for station_pair_jobs(stations).
+    """
+    if stations is None:
+        stations = swiss_canton_stations
+    connection_times = {}
+    processed_pairs = set()
+    
     for canton, neighbor_list in neighbors.items():
         if canton not in connection_times:
             connection_times[canton] = {}
@@ -125,28 +363,23 @@ def create_comprehensive_connection_times() -> Dict[str, Dict[str, Dict[str, any
                 continue
             
             # Get all station combinations
-            from_stations = swiss_canton_stations.get(canton, [])
-            to_stations = swiss_canton_stations.get(neighbor, [])
+            from_stations = stations.get(canton, [])
+            to_stations = stations.get(neighbor, [])
             
             if not from_stations or not to_stations:
                 print(f"Missing stations for canton: {canton if not from_stations else neighbor}")
                 continue
             
-            print(f"\n{canton} <-> {neighbor} ({len(from_stations)} x {len(to_stations)} = {len(from_stations) * len(to_stations)} connections)")
-            
             connections = []
             shortest_connection = None
             shortest_time = float('inf')
             
             for from_station in from_stations:
                 for to_station in to_stations:
-                    connection_count += 1
-                    progress = connection_count / total_connections * 100
-                    
-                    print(f"  [{connection_count}/{total_connections}] ({progress:.1f}%) {from_station} -> {to_station}", end="")
+                    connection_time, times = fetched[(from_station, to_station)]
                     
-                    # Fetch connection time
-                    connection_time = fetch_connection(from_station, to_station)
+                    if timetable is not None and times:
+                        timetable.add_pair(from_station, to_station, times)
                     
                     if connection_time is not None:
                         connections.append({
@@ -163,12 +396,6 @@ def create_comprehensive_connection_times() -> Dict[str, Dict[str, Dict[str, any
                                 "to_station": to_station,
                                 "minutes": connection_time
                             }
-                        
-                        print(f" -> {connection_time} min ({connection_time // 60}h {connection_time % 60}min)")
-                    else:
-                        print(f" -> No connection found")
-                    
-
             
             # Store the data
             if connections:
@@ -201,9 +428,6 @@ def create_comprehensive_connection_times() -> Dict[str, Dict[str, Dict[str, any
             
             processed_pairs.add(pair_id)
     
-    elapsed_time = (datetime.now() - start_time).total_seconds() / 60
-    print(f"\n\nCompleted in {elapsed_time:.1f} minutes")
-    
     return connection_times
 
 def save_summary_json(connection_times: Dict, filename: str = "swiss_canton_connection_times_summary.json"):
@@ -225,10 +449,43 @@ def save_summary_json(connection_times: Dict, filename: str = "swiss_canton_conn
     print(f"Summary saved to '{filename}'")
 
 def main():
+    parser = argparse.ArgumentParser(description="Fetch connection times between neighboring Swiss cantons")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent requests (1 = sequential)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum requests per second")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Response cache file (SQLite)")
+    parser.add_argument("--no-cache", action="store_true", help="Always query the API")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Cache entry lifetime in hours")
+    parser.add_argument("--offline", action="store_true", help="Serve queries from the cache only")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_FILE, help="Log of fetched station pairs (JSON Lines)")
+    parser.add_argument("--resume", action="store_true", help="Fetch only the pairs missing from the checkpoint log")
+    parser.add_argument("--timetable-window", metavar="HH:MM-HH:MM", default=None,
+                        help="Record the departure sidecar in both directions over this window (e.g. 04:00-23:59, "
+                             "step4's day) instead of the queried direction from 08:00 only; pages through the API")
+    parser.add_argument("--stations", default=None,
+                        help="Stations per canton to crawl, e.g. selected_stations.json from station_selection.py "
+                             "(default: step1's swiss_canton_stations)")
+    args = parser.parse_args()
+    
     print("Fetching comprehensive connection times between neighboring Swiss cantons...")
     print("This will fetch ALL possible station combinations between neighbors.\n")
     
-    connection_times = create_comprehensive_connection_times()
+    cache = None
+    if not args.no_cache:
+        ttl = args.cache_ttl * 3600 if args.cache_ttl is not None else None
+        cache = ResponseCache(args.cache, ttl=ttl)
+    
+    client = TransportClient(rate=args.rate, burst=max(1, int(args.rate)), pool_size=max(1, args.workers),
+                             cache=cache, offline=args.offline)
+    stations = load_stations(args.stations) if args.stations else None
+    timetable = ConnectionTimetable(QUERY_DATE, QUERY_TIME)
+    connection_times = create_comprehensive_connection_times(args.workers, client, timetable,
+                                                             args.checkpoint, args.resume, stations)
+    if args.timetable_window:
+        window_start, window_end = args.timetable_window.split("-")
+        timetable = fetch_timetable(station_pair_jobs(stations), window_start, window_end, args.workers, client)
+    print(f"API requests: {client.request_count} ({client.retry_count} retries)")
+    if cache is not None:
+        print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
     
     # Save full data
     with open('swiss_canton_connection_times_cheat.json', 'w', encoding='utf-8') as f:
@@ -236,6 +493,16 @@ def main():
     
     print("\nFull data saved to 'swiss_canton_connection_times_comprehensive.json'")
     
+    # Compact station matrix, loaded by step3 without a JSON parse (--input *.npy)
+    matrix_file = os.path.join("output_step2", DEFAULT_MATRIX_FILE)
+    os.makedirs("output_step2", exist_ok=True)
+    save_connection_matrix(connection_times, matrix_file)
+    print(f"Station matrix saved to '{matrix_file}'")
+    
+    # Save departure/arrival sidecar for step4
+    timetable.save(DEFAULT_TIMETABLE_FILE)
+    print(f"Timetable for {len(timetable.pairs)} station pairs saved to '{DEFAULT_TIMETABLE_FILE}'")
+    
     # Save summary version
     save_summary_json(connection_times)
     
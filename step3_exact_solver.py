@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Exact Swiss Canton Tour Solver
+Finds the provably optimal tour through all 26 cantons under the step2 static
+connection times, without the East/West split, using A* over
+(station, visited canton mask) states.
+"""
+
+import argparse
+import heapq
+import json
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from step3_find_shortest_routes import (DEFAULT_GRAPH_FILE, INFINITY, SwissCantonRegionalPathFinder,
+                                        all_pairs_shortest_times, canton_time_matrices, metric_closure_moves,
+                                        shortest_path)
+
+
+class ExactTourSolver:
+    def __init__(self, finder: SwissCantonRegionalPathFinder, weights: Optional[List[int]] = None):
+        """
+        Prepare integer-indexed graph data and lower-bound tables from a path finder.
+        `weights` replaces the step2 minutes of the finder's CSR edges (INFINITY drops an edge).
+        """
+        self.finder = finder
+        self.cantons = finder.cantons
+        self.full_mask = (1 << len(self.cantons)) - 1
+
+        self.stations = finder.station_list
+        self.station_id = finder.station_index
+        self.station_canton = finder.station_canton_id
+        self.canton_bit = finder.station_canton_bit.tolist()
+
+        self.offsets = finder.csr_offsets.tolist()
+        self.targets = finder.csr_targets.tolist()
+        self.weights = finder.csr_weights.tolist() if weights is None else list(weights)
+
+        self.canton_stations = [[] for _ in self.cantons]
+        for i, c in enumerate(self.station_canton):
+            self.canton_stations[c].append(i)
+
+        # Lower-bound tables from the metric closure (the finder's, unless the weights differ)
+        if weights is None:
+            self.predecessor = finder.station_predecessor
+            self.distance = finder.station_distance
+            to_canton, canton_time = finder.time_to_canton, finder.canton_time
+        else:
+            distance, self.predecessor = all_pairs_shortest_times(self.offsets, self.targets, self.weights)
+            self.distance = distance.tolist()
+            to_canton, canton_time, _ = canton_time_matrices(distance, self.station_canton, len(self.cantons))
+            to_canton = to_canton.tolist()
+        self.station_to_canton_time = to_canton
+        # Symmetric canton-to-canton minimum, the edge weights of the MST bound
+        self.canton_distance = np.minimum(canton_time, canton_time.T).tolist()
+        # Per station, (time, canton bit) sorted by time: the nearest and farthest
+        # unvisited canton are then found by scanning from either end
+        self.canton_order = [
+            sorted((row[c], 1 << c) for c in range(len(self.cantons)))
+            for row in self.station_to_canton_time
+        ]
+        self.mst_cache = {}
+        self.closure_moves = None
+
+    def build_closure_moves(self) -> List[List[tuple]]:
+        """Moves of the metric closure, (station, shortest time, canton mask of the path) per station."""
+        if self.closure_moves is None:
+            self.closure_moves = metric_closure_moves(self.distance, self.predecessor, self.canton_bit)
+        return self.closure_moves
+
+    def minimum_spanning_tree(self, mask: int) -> int:
+        """Weight of the MST over the cantons in `mask` (Prim), memoized per mask."""
+        cached = self.mst_cache.get(mask)
+        if cached is not None:
+            return cached
+
+        nodes = [c for c in range(len(self.cantons)) if mask >> c & 1]
+        total = 0
+        if len(nodes) > 1:
+            root_row = self.canton_distance[nodes[0]]
+            frontier = {c: root_row[c] for c in nodes[1:]}
+            while frontier:
+                c = min(frontier, key=frontier.get)
+                total += frontier.pop(c)
+                row = self.canton_distance[c]
+                for other in frontier:
+                    if row[other] < frontier[other]:
+                        frontier[other] = row[other]
+
+        self.mst_cache[mask] = total
+        return total
+
+    def lower_bound(self, station: int, mask: int) -> int:
+        """
+        Admissible bound on the time still needed from `station` once the cantons
+        in `mask` are visited: reaching the nearest unvisited canton plus an MST
+        over all unvisited ones, and at least the distance to the farthest one.
+        """
+        unvisited = self.full_mask & ~mask
+        if not unvisited:
+            return 0
+
+        order = self.canton_order[station]
+        nearest = next(time for time, bit in order if unvisited & bit)
+        farthest = next(time for time, bit in reversed(order) if unvisited & bit)
+        return max(nearest + self.minimum_spanning_tree(unvisited), farthest)
+
+    def solve(self, upper_bound: Optional[int] = None, start_stations: Optional[List[str]] = None,
+              dominance: bool = True, closure: bool = False) -> Optional[Dict]:
+        """
+        Find the optimal tour visiting all cantons, starting anywhere (or at one of
+        `start_stations`). States whose bound exceeds `upper_bound` are pruned; if
+        no tour fits within it, None is returned.
+        With `closure`, every move goes along a shortest path straight to a station
+        of an unvisited canton instead of over a single connection. An optimal tour
+        is such a chain between the stations where it first enters a canton, so the
+        result is the same with far fewer expansions.
+        """
+        start = datetime.now()
+        shift = len(self.cantons)
+        canton_bit = self.canton_bit
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.weights
+        closure_moves = self.build_closure_moves() if closure else None
+        lower_bound = self.lower_bound
+        limit = upper_bound if upper_bound is not None else INFINITY
+
+        # Array-backed labels; `index` maps a packed (station << shift | mask) key to its best label
+        label_station = array('i')
+        label_mask = array('q')
+        label_g = array('i')
+        label_parent = array('i')
+        index = {}
+
+        stats = {'expanded': 0, 'pushed': 0, 'dominated': 0, 'pruned_by_bound': 0, 'improved': 0}
+
+        def add_label(station: int, mask: int, g: int, parent: int) -> int:
+            label_station.append(station)
+            label_mask.append(mask)
+            label_g.append(g)
+            label_parent.append(parent)
+            label = len(label_g) - 1
+            index[(station << shift) | mask] = label
+            return label
+
+        # Heap entries are (f, -g, label): ties on f go to the deeper state first
+        pq = []
+        names = start_stations if start_stations is not None else self.stations
+        for name in names:
+            station = self.station_id[name]
+            mask = canton_bit[station]
+            f = lower_bound(station, mask)
+            if f > limit:
+                stats['pruned_by_bound'] += 1
+                continue
+            heapq.heappush(pq, (f, 0, add_label(station, mask, 0, -1)))
+            stats['pushed'] += 1
+        root_bound = pq[0][0] if pq else None
+
+        goal = None
+        while pq:
+            f, _, label = heapq.heappop(pq)
+            station = label_station[label]
+            mask = label_mask[label]
+            key = (station << shift) | mask
+            if index[key] != label:
+                continue
+            g = label_g[label]
+
+            if mask == self.full_mask:
+                goal = label
+                break
+
+            # Dominated if the same station was reached no later with one more canton visited
+            if dominance:
+                unvisited = self.full_mask & ~mask
+                dominated = False
+                while unvisited:
+                    bit = unvisited & -unvisited
+                    unvisited ^= bit
+                    other = index.get(key | bit)
+                    if other is not None and label_g[other] <= g:
+                        dominated = True
+                        break
+                if dominated:
+                    stats['dominated'] += 1
+                    continue
+
+            stats['expanded'] += 1
+            if closure:
+                moves = [(next_station, time, path_mask) for next_station, time, path_mask in closure_moves[station]
+                         if not mask & canton_bit[next_station]]
+            else:
+                moves = [(targets[edge], weights[edge], canton_bit[targets[edge]])
+                         for edge in range(offsets[station], offsets[station + 1])]
+            for next_station, time, path_mask in moves:
+                next_mask = mask | path_mask
+                next_g = g + time
+                existing = index.get((next_station << shift) | next_mask)
+                if existing is not None and label_g[existing] <= next_g:
+                    continue
+
+                next_f = next_g + lower_bound(next_station, next_mask)
+                if next_f > limit:
+                    stats['pruned_by_bound'] += 1
+                    continue
+
+                if existing is not None:
+                    stats['improved'] += 1
+                heapq.heappush(pq, (next_f, -next_g, add_label(next_station, next_mask, next_g, label)))
+                stats['pushed'] += 1
+
+        stats['labels'] = len(label_g)
+        stats['root_lower_bound'] = root_bound
+        stats['seconds'] = round((datetime.now() - start).total_seconds(), 2)
+        self.last_search_stats = stats
+
+        if goal is None:
+            return None
+
+        station_ids = []
+        label = goal
+        while label != -1:
+            station_ids.append(label_station[label])
+            label = label_parent[label]
+        station_ids.reverse()
+        if closure:
+            # Expand every closure move into its shortest path
+            expanded = station_ids[:1]
+            for a, b in zip(station_ids, station_ids[1:]):
+                expanded.extend(shortest_path(self.predecessor, a, b)[1:])
+            station_ids = expanded
+        path = [self.stations[s] for s in station_ids]
+
+        return {
+            'stations': path,
+            'cantons': [self.finder.station_to_canton[st] for st in path],
+            'time': label_g[goal],
+            'start_station': path[0],
+            'end_station': path[-1],
+            'stats': stats
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provably optimal tour through all 26 cantons")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--upper-bound", type=int, default=None,
+                        help="Prune states whose lower bound exceeds this many minutes (e.g. a known tour)")
+    parser.add_argument("--start", action="append", help="Restrict start station (repeatable)")
+    parser.add_argument("--no-dominance", action="store_true", help="Disable dominance pruning")
+    parser.add_argument("--closure", action="store_true",
+                        help="Search the metric closure: move along shortest paths to unvisited cantons")
+    args = parser.parse_args()
+
+    print("Exact Swiss Canton Tour Solver")
+    print("=" * 80)
+
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    solver = ExactTourSolver(finder)
+    result = solver.solve(args.upper_bound, args.start, not args.no_dominance, args.closure)
+
+    stats = solver.last_search_stats
+    print(f"\nExpanded: {stats['expanded']}, pushed: {stats['pushed']}, dominated: {stats['dominated']}, "
+          f"pruned by bound: {stats['pruned_by_bound']}, improved: {stats['improved']}")
+    print(f"Labels stored: {stats['labels']}, root lower bound: {stats['root_lower_bound']} min, "
+          f"time: {stats['seconds']}s")
+
+    if result is None:
+        print(f"\nNo tour within {args.upper_bound} minutes")
+        return
+
+    print(f"\nOptimal tour: {result['time']} minutes ({result['time'] // 60}h {result['time'] % 60}min)")
+    print(f"  {result['start_station']} -> {result['end_station']} ({len(result['stations'])} stations)")
+    print(f"  {' -> '.join(result['stations'])}")
+
+    result['timestamp'] = datetime.now().isoformat()
+    with open('optimal_canton_tour.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print("\nSaved to 'optimal_canton_tour.json'")
+
+
+if __name__ == "__main__":
+    main()
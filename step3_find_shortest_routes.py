@@ -1,16 +1,186 @@
+import argparse
+import contextlib
+import io
 import json
-from typing import List, Tuple, Set, Dict
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, List, Tuple, Set, Dict, Optional
 from collections import defaultdict
 import heapq
+from array import array
+from itertools import islice
 from datetime import datetime
 
+import numpy as np
+
+from connection_matrix import load_connection_matrix, matrix_connections, stations_file
+from state_table import StateTable
+
+INFINITY = 10 ** 9
+DEFAULT_GRAPH_FILE = 'output_step2/swiss_canton_connection_graph.npz'
+
+
+def all_pairs_shortest_times(offsets: List[int], targets: List[int],
+                             weights: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    All-pairs shortest travel times over a CSR graph of integer station ids
+    (Floyd-Warshall, one vectorized relaxation per intermediate station), and the
+    predecessor table: predecessor[i, j] is the station before j on a shortest
+    path from i, -1 if j is i or unreachable. Unreachable pairs stay at INFINITY.
+    """
+    station_count = len(offsets) - 1
+    sources = np.repeat(np.arange(station_count), np.diff(offsets))
+    targets = np.asarray(targets, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+
+    dist = np.full((station_count, station_count), INFINITY, dtype=np.int64)
+    predecessor = np.full((station_count, station_count), -1, dtype=np.int32)
+    # Parallel edges: write the slowest first so the fastest one is kept
+    order = np.argsort(-weights, kind='stable')
+    dist[sources[order], targets[order]] = np.minimum(weights[order], INFINITY)
+    predecessor[sources[order], targets[order]] = sources[order]
+    predecessor[dist >= INFINITY] = -1
+    diagonal = np.arange(station_count)
+    dist[diagonal, diagonal] = 0
+    predecessor[diagonal, diagonal] = -1
+
+    for k in range(station_count):
+        via = dist[:, k, None] + dist[k]
+        better = via < dist
+        if better.any():
+            dist[better] = via[better]
+            predecessor[better] = np.broadcast_to(predecessor[k], dist.shape)[better]
+
+    return dist, predecessor
+
+
+def shortest_time_matrix(offsets: List[int], targets: List[int], weights: List[int]) -> List[List[int]]:
+    """All-pairs shortest travel times over a CSR graph of integer station ids, as nested lists."""
+    return all_pairs_shortest_times(offsets, targets, weights)[0].tolist()
+
+
+def shortest_path(predecessor: np.ndarray, source: int, target: int) -> List[int]:
+    """Station ids of a shortest path from `source` to `target` (empty if unreachable)."""
+    path = [target]
+    while target != source:
+        target = int(predecessor[source, target])
+        if target == -1:
+            return []
+        path.append(target)
+    return path[::-1]
+
+
+def metric_closure_moves(distance: List[List[int]], predecessor: np.ndarray,
+                         canton_bit: List[int]) -> List[List[Tuple[int, int, int]]]:
+    """
+    Moves of the metric closure: from every station straight to every station it
+    can reach, as (station, shortest time, canton bits of the stations on that path).
+    """
+    moves = []
+    for source, row in enumerate(distance):
+        path_mask = {source: canton_bit[source]}
+        station_moves = []
+        # Predecessors are nearer than the station itself, so their masks are known
+        for target in sorted(range(len(row)), key=row.__getitem__):
+            if target == source or row[target] >= INFINITY:
+                continue
+            path_mask[target] = path_mask[int(predecessor[source][target])] | canton_bit[target]
+            station_moves.append((target, row[target], path_mask[target]))
+        moves.append(station_moves)
+    return moves
+
+
+def edit_distance(a: List[str], b: List[str]) -> int:
+    """Levenshtein distance between two station sequences."""
+    previous = list(range(len(b) + 1))
+    for i, station in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (station != other)))
+        previous = current
+    return previous[-1]
+
+
+def canton_time_matrices(dist: np.ndarray, station_canton: List[int],
+                         canton_count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reduce station-to-station times to cantons. Returns the shortest time from
+    every station to any station of each canton (stations x cantons), the
+    shortest time between any stations of two cantons (cantons x cantons), and
+    for the latter the (from station, to station) pair that attains it, whose
+    path follows from the station predecessor table (-1 if none).
+    """
+    station_canton = np.asarray(station_canton)
+    station_count = len(station_canton)
+    to_canton = np.full((station_count, canton_count), INFINITY, dtype=np.int64)
+    to_canton_station = np.full((station_count, canton_count), -1, dtype=np.int64)
+    for c in range(canton_count):
+        members = np.flatnonzero(station_canton == c)
+        if len(members):
+            nearest = dist[:, members].argmin(axis=1)
+            to_canton[:, c] = dist[np.arange(station_count), members[nearest]]
+            to_canton_station[:, c] = members[nearest]
+
+    canton_time = np.full((canton_count, canton_count), INFINITY, dtype=np.int64)
+    canton_link = np.full((canton_count, canton_count, 2), -1, dtype=np.int64)
+    for c in range(canton_count):
+        members = np.flatnonzero(station_canton == c)
+        if len(members):
+            nearest = to_canton[members].argmin(axis=0)
+            canton_time[c] = to_canton[members[nearest], np.arange(canton_count)]
+            canton_link[c, :, 0] = members[nearest]
+            canton_link[c, :, 1] = to_canton_station[members[nearest], np.arange(canton_count)]
+    canton_link[canton_time >= INFINITY] = -1
+
+    return to_canton, canton_time, canton_link
+
+
+# Path finder used by search worker processes: inherited copy-on-write when the
+# pool forks, pickled once per worker under other start methods
+_worker_finder = None
+
+
+def _init_search_worker(finder: 'SwissCantonRegionalPathFinder'):
+    global _worker_finder
+    _worker_finder = finder
+
+
+def _run_search_worker(region_name: str, split_point: str, k: int) -> Tuple[List[Dict], Dict]:
+    """Run one region search in a worker; returns the solutions and the search stats."""
+    finder = _worker_finder
+    region = finder.west_cantons if region_name == 'west' else finder.east_cantons
+    with contextlib.redirect_stdout(io.StringIO()):
+        solutions = finder.find_top_k_paths(region, split_point, k)
+    return solutions, finder.last_search_stats
+
+
 class SwissCantonRegionalPathFinder:
-    def __init__(self, comprehensive_file: str):
-        """Initialize with comprehensive connection times from JSON file."""
-        with open(comprehensive_file, 'r', encoding='utf-8') as f:
-            self.data = json.load(f)
+    def __init__(self, comprehensive_file: str, graph_file: Optional[str] = None):
+        """
+        Initialize with comprehensive connection times from JSON file, or from the
+        compact .npy matrix written by step2 (see connection_matrix). If `graph_file`
+        is given, the graph is loaded from that binary file when it was built from this
+        input (same path, size and modification time, also of the station dictionary
+        of a .npy matrix), and written to it otherwise.
+        """
+        # Build the graph
+        self.connections = {}  # (from_station, to_station) -> minutes
+        self.station_to_canton = {}  # station -> canton
+        self.canton_to_stations = defaultdict(set)  # canton -> set of stations
+        
+        graph_is_current = graph_file is not None and self._graph_matches(graph_file, comprehensive_file)
+        if graph_is_current:
+            self._load_graph(graph_file)
+            print(f"Loaded graph from {graph_file}")
+        elif comprehensive_file.endswith('.npy'):
+            self._read_matrix(comprehensive_file)
+        else:
+            with open(comprehensive_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.cantons = sorted(list(data.keys()))
+            self._read_connections(data)
         
-        self.cantons = sorted(list(self.data.keys()))
         self.canton_to_id = {canton: i for i, canton in enumerate(self.cantons)}
         
         # Define regions - Solothurn is now only in west
@@ -29,18 +199,50 @@ class SwissCantonRegionalPathFinder:
         # Define possible split points
         self.split_points = ["Olten", "Zofingen", "Aarau"]
         
-        # Build the graph
-        self.connections = {}  # (from_station, to_station) -> minutes
-        self.station_to_canton = {}  # station -> canton
-        self.canton_to_stations = defaultdict(set)  # canton -> set of stations
+        # Minimum station edits between the top K solutions of a region search
+        self.min_edit_distance = 0
+        
+        # Memory budget of a region search in bytes (None: unbounded), and the open
+        # list width it is cut to once the budget is reached
+        self.memory_budget = None
+        self.beam_width = 10000
+        self.closure_moves = None
         
         self._build_graph()
+        self._build_lower_bounds()
         
-    def _build_graph(self):
-        """Build connection graph and station mappings."""
-        for from_canton in self.data:
-            for to_canton in self.data[from_canton]:
-                conn_data = self.data[from_canton][to_canton]
+        if graph_file is not None and not graph_is_current:
+            self.save_graph(graph_file, comprehensive_file)
+    
+    @staticmethod
+    def _source_stamp(source_file: str) -> List:
+        """
+        Absolute path, size and modification time (ns) identifying an input file,
+        followed by those of its station dictionary for a .npy matrix.
+        """
+        paths = [source_file, stations_file(source_file)] if source_file.endswith('.npy') else [source_file]
+        stamp = []
+        for path in paths:
+            stat = os.stat(path)
+            stamp += [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+        return stamp
+    
+    @classmethod
+    def _graph_matches(cls, graph_file: str, source_file: str) -> bool:
+        """Whether `graph_file` exists and was built from `source_file` as it is now."""
+        if not os.path.exists(graph_file):
+            return False
+        with np.load(graph_file) as graph:
+            if 'source' not in graph.files:
+                return False
+            stored = json.loads(str(graph['source']))
+        return stored == cls._source_stamp(source_file)
+    
+    def _read_connections(self, data: Dict):
+        """Read station connections and canton memberships from the parsed JSON."""
+        for from_canton in data:
+            for to_canton in data[from_canton]:
+                conn_data = data[from_canton][to_canton]
                 if 'connections' in conn_data:
                     for conn in conn_data['connections']:
                         from_st = conn['from_station']
@@ -52,12 +254,40 @@ class SwissCantonRegionalPathFinder:
                         self.station_to_canton[to_st] = to_canton
                         self.canton_to_stations[from_canton].add(from_st)
                         self.canton_to_stations[to_canton].add(to_st)
-        
-        # Build adjacency list
+    
+    def _read_matrix(self, matrix_file: str):
+        """Read station connections and canton memberships from a compact step2 matrix."""
+        self.cantons, stations, station_canton, matrix = load_connection_matrix(matrix_file)
+        self.connections = matrix_connections(stations, matrix)
+        for station, canton_id in zip(stations, station_canton):
+            self.station_to_canton[station] = self.cantons[canton_id]
+            self.canton_to_stations[self.cantons[canton_id]].add(station)
+    
+    def _build_graph(self):
+        """Build the adjacency list and its integer-indexed CSR form."""
         self.neighbors = defaultdict(list)
         for (from_st, to_st), minutes in self.connections.items():
             self.neighbors[from_st].append((to_st, minutes))
         
+        # Integer-indexed view used by the searches: interned station ids, the
+        # canton bit of every station, and the edges in compressed sparse row
+        # form (edges of station i are csr_targets[csr_offsets[i]:csr_offsets[i + 1]])
+        self.station_list = sorted(self.station_to_canton)
+        self.station_index = {station: i for i, station in enumerate(self.station_list)}
+        self.station_canton_id = [self.canton_to_id[self.station_to_canton[st]] for st in self.station_list]
+        self.station_canton_bit = np.array([1 << c for c in self.station_canton_id], dtype=np.int64)
+        
+        self.csr_offsets = np.zeros(len(self.station_list) + 1, dtype=np.int32)
+        targets = []
+        weights = []
+        for i, station in enumerate(self.station_list):
+            for to_st, minutes in self.neighbors[station]:
+                targets.append(self.station_index[to_st])
+                weights.append(minutes)
+            self.csr_offsets[i + 1] = len(targets)
+        self.csr_targets = np.array(targets, dtype=np.int32)
+        self.csr_weights = np.array(weights, dtype=np.int32)
+        
         print(f"Built graph with {len(self.canton_to_stations)} cantons")
         print(f"Total stations: {len(self.station_to_canton)}")
         print(f"Total connections: {len(self.connections)}")
@@ -69,94 +299,584 @@ class SwissCantonRegionalPathFinder:
             else:
                 print(f"{sp} is in canton: {self.station_to_canton[sp]}")
     
+    def save_graph(self, graph_file: str, source_file: Optional[str] = None):
+        """
+        Write the CSR graph, station names and canton names to a binary .npz file,
+        stamped with the input file it was built from.
+        """
+        source = self._source_stamp(source_file) if source_file is not None else None
+        np.savez(
+            graph_file,
+            source=np.array(json.dumps(source, ensure_ascii=False)),
+            cantons=np.array(self.cantons),
+            stations=np.array(self.station_list),
+            station_canton=np.array(self.station_canton_id, dtype=np.int32),
+            offsets=self.csr_offsets,
+            targets=self.csr_targets,
+            weights=self.csr_weights
+        )
+    
+    def _load_graph(self, graph_file: str):
+        """Restore the connection maps from a file written by save_graph."""
+        with np.load(graph_file) as graph:
+            self.cantons = graph['cantons'].tolist()
+            stations = graph['stations'].tolist()
+            station_canton = graph['station_canton'].tolist()
+            offsets = graph['offsets'].tolist()
+            targets = graph['targets'].tolist()
+            weights = graph['weights'].tolist()
+        
+        for i, station in enumerate(stations):
+            canton = self.cantons[station_canton[i]]
+            self.station_to_canton[station] = canton
+            self.canton_to_stations[canton].add(station)
+            for e in range(offsets[i], offsets[i + 1]):
+                self.connections[(station, stations[targets[e]])] = weights[e]
+    
+    def _build_lower_bounds(self):
+        """Precompute shortest times from every station to every canton for the A* heuristic."""
+        distance, self.station_predecessor = all_pairs_shortest_times(
+            self.csr_offsets, self.csr_targets.tolist(), self.csr_weights.tolist())
+        self.station_distance = distance.tolist()
+        
+        # station id -> [shortest time to any station of canton i], and canton -> canton
+        # times with the station pair attaining each
+        to_canton, self.canton_time, self.canton_link = canton_time_matrices(
+            distance, self.station_canton_id, len(self.cantons))
+        self.time_to_canton = to_canton.tolist()
+        
+        # (time, canton bit) per station, farthest canton first
+        self.farthest_first = [
+            sorted(((t, 1 << c) for c, t in enumerate(times)), reverse=True)
+            for times in self.time_to_canton
+        ]
+        
+        # Cheapest connection entering each canton
+        self.min_entry_time = [INFINITY] * len(self.cantons)
+        for (from_st, to_st), minutes in self.connections.items():
+            canton_id = self.canton_to_id[self.station_to_canton[to_st]]
+            if minutes < self.min_entry_time[canton_id]:
+                self.min_entry_time[canton_id] = minutes
+        self.entry_sum_cache = {}  # unvisited mask -> sum of cheapest entries
+    
+    def remaining_time_bound(self, station: int, unvisited: int) -> int:
+        """
+        Consistent lower bound on the time needed from station id `station` to visit the
+        cantons in the `unvisited` mask: each one has to be entered at least once (sum of
+        cheapest entries), and the farthest one has to be reached.
+        """
+        if not unvisited:
+            return 0
+        
+        entry_sum = self.entry_sum_cache.get(unvisited)
+        if entry_sum is None:
+            entry_sum = sum(t for c, t in enumerate(self.min_entry_time) if unvisited >> c & 1)
+            self.entry_sum_cache[unvisited] = entry_sum
+        
+        farthest = next(t for t, bit in self.farthest_first[station] if unvisited & bit)
+        return max(entry_sum, farthest)
+    
     def find_top_k_paths(self, region: Set[str], start_station: str, k: int = 3) -> List[Dict]:
         """
-        Find top K shortest paths visiting all cantons in a specific region.
-        Simply collects all complete solutions found during search.
+        Find top K shortest paths visiting all cantons in a specific region,
+        each ending at a different station (and at least self.min_edit_distance
+        station edits apart).
+        A* with a consistent lower bound on the remaining time: complete states are
+        settled in order of time, so the search stops once K end stations are found.
+        Counts are kept in self.last_search_stats.
+        """
+        if start_station not in self.station_index:
+            print(f"Error: {start_station} not found in station list")
+            return []
+        
+        tours = self.iter_region_tours(region, start_station, True, self.min_edit_distance)
+        solutions = list(islice(tours, k))
+        stats = self.last_search_stats
+        print(f"  Search stats: {stats['expanded']} expanded, {stats['pushed']} pushed, {stats['seconds']}s")
+        if stats['beam']:
+            print(f"  Memory budget reached: beam search, {stats['dropped']} states dropped, "
+                  f"best solution at most {stats['optimality_gap']} min above the optimum")
+        return solutions
+    
+    def iter_region_tours(self, region: Set[str], start_station: str, distinct_end: bool = False,
+                          min_edit_distance: int = 0) -> Iterator[Dict]:
+        """
+        Generate the tours visiting all cantons in `region` from `start_station` in
+        order of time, computing only as far as the caller consumes. A tour ends
+        where the region is complete.
+        
+        With `distinct_end`, only the best tour per end station is generated: every
+        (station, mask) state is settled once, as a complete state is settled in
+        order of time. Otherwise a second tour may end at the same station as the
+        first: a state's j-th cheapest walk can only be part of the j-th or a later
+        tour, so while j tours have been completed each state is expanded at most
+        j + 1 times and further walks wait until another tour completes.
+        With `min_edit_distance`, only tours at least that many station edits away
+        from every tour generated before are yielded.
+        
+        With self.memory_budget set, the state table is a compact StateTable and
+        the search continues as a beam search of width self.beam_width as soon as
+        the table cannot store a new state, or once the table, labels and open list
+        reach the budget (the beam search adds memory
+        in proportion to the width). The bound of a dropped entry
+        is a lower bound on every tour through it, so stats['optimality_gap'] is how
+        far the best tour may be above the optimum.
+        Counts are kept in self.last_search_stats.
         """
         # Create mask for region cantons
-        region_canton_ids = {self.canton_to_id[c] for c in region if c in self.canton_to_id}
-        region_mask = sum(1 << i for i in region_canton_ids)
+        region_mask = sum(1 << self.canton_to_id[c] for c in region if c in self.canton_to_id)
+        
+        # Canton bit each station contributes to the region mask (0 outside the region)
+        region_bit = (self.station_canton_bit & region_mask).tolist()
+        # Plain int lists of the CSR arrays: indexing them is cheaper than numpy scalars
+        offsets = self.csr_offsets.tolist()
+        targets = self.csr_targets.tolist()
+        weights = self.csr_weights.tolist()
+        shift = len(self.cantons)
         
-        # Priority queue: (priority, time, station, mask, path)
+        bound = self.remaining_time_bound
+        
+        # Search labels live in flat arrays; a path is only rebuilt from the
+        # parent pointers once it completes the region
+        label_station = array('i')
+        label_mask = array('q')
+        label_parent = array('i')
+        
+        def add_label(station: int, mask: int, parent: int) -> int:
+            label_station.append(station)
+            label_mask.append(mask)
+            label_parent.append(parent)
+            return len(label_station) - 1
+        
+        # Labels of beam search moves along a shortest path rather than one connection
+        jumps = set()
+        
+        def rebuild_path(label: int) -> List[str]:
+            path = []
+            while label != -1:
+                parent = label_parent[label]
+                if label in jumps:
+                    path.extend(reversed(shortest_path(self.station_predecessor, label_station[parent],
+                                                       label_station[label])[1:]))
+                else:
+                    path.append(label_station[label])
+                label = parent
+            return [self.station_list[station] for station in reversed(path)]
+        
+        # Priority queue of single ints packing (time + bound, time, label),
+        # which orders like the tuple but costs a fraction of its memory
         pq = []
+        label_bits = 32
+        time_bits = 20
         
-        # Best time to reach each state
-        best_time = {}
+        # Best time per state, keyed by station id << shift | mask (distinct_end);
+        # otherwise the expansions per state and the walks waiting for another tour.
+        # Only the table the mode uses is allocated
+        budget = self.memory_budget
+        state_table = {} if budget is None else StateTable(budget // 2)
+        best_time = state_table if distinct_end else None
+        expansions = None if distinct_end else state_table
+        waiting = {}
+        min_dropped = INFINITY
         
-        # Store ALL complete solutions found
-        complete_solutions = []
+        ends = set()
+        yielded = []
+        yielded_paths = set()
+        stats = {'expanded': 0, 'pushed': 0, 'deferred': 0, 'tours': 0,
+                 'beam': False, 'dropped': 0, 'optimality_gap': 0}
+        self.last_search_stats = stats
+        search_start = datetime.now()
         
-        # Initialize with start station
-        if start_station not in self.station_to_canton:
-            print(f"Error: {start_station} not found in station list")
-            return []
+        def update_stats():
+            stats['labels'] = len(label_station)
+            stats['seconds'] = round((datetime.now() - search_start).total_seconds(), 2)
+        
+        update_stats()
+        if start_station not in self.station_index:
+            return
+        
+        start = self.station_index[start_station]
+        mask = region_bit[start]
+        if distinct_end:
+            best_time[(start << shift) | mask] = 0
+        priority = bound(start, region_mask & ~mask)
+        heapq.heappush(pq, (priority << (time_bits + label_bits)) | add_label(start, mask, -1))
+        stats['pushed'] += 1
         
-        start_canton = self.station_to_canton[start_station]
-        canton_id = self.canton_to_id[start_canton]
-        mask = 1 << canton_id if start_canton in region else 0
-        state = (start_station, mask)
-        best_time[state] = 0
-        priority = -bin(mask).count('1') * 10000 + 0
-        heapq.heappush(pq, (priority, 0, start_station, mask, [start_station]))
+        label_mask_bits = (1 << label_bits) - 1
+        time_mask_bits = (1 << time_bits) - 1
+        
+        def complete(label: int, current_time: int) -> Optional[Dict]:
+            """Tour ending at complete label `label`, unless a diversity constraint rejects it."""
+            end_station = self.station_list[label_station[label]]
+            if distinct_end and end_station in ends:
+                return None
+            path = rebuild_path(label)
+            if tuple(path) in yielded_paths:
+                return None
+            if min_edit_distance and any(edit_distance(path, other) < min_edit_distance for other in yielded):
+                return None
+            ends.add(end_station)
+            yielded.append(path)
+            yielded_paths.add(tuple(path))
+            if not yielded[1:]:
+                stats['optimality_gap'] = current_time - min(current_time, min_dropped)
+            update_stats()
+            return {
+                'stations': path,
+                'cantons': [self.station_to_canton[st] for st in path],
+                'time': current_time,
+                'end_station': end_station
+            }
         
         while pq:
-            priority, current_time, current_station, current_mask, path = heapq.heappop(pq)
+            entry = heapq.heappop(pq)
+            label = entry & label_mask_bits
+            current_time = (entry >> label_bits) & time_mask_bits
+            current_station = label_station[label]
+            current_mask = label_mask[label]
+            state = (current_station << shift) | current_mask
             
-            # Skip if we've found a better path to this state
-            state = (current_station, current_mask)
-            if state in best_time and best_time[state] < current_time:
+            if distinct_end:
+                # Skip if we've found a better path to this state
+                if best_time.get(state, current_time) < current_time:
+                    continue
+            elif expansions.get(state, 0) > stats['tours']:
+                heapq.heappush(waiting.setdefault(state, []), entry)
+                stats['deferred'] += 1
                 continue
             
             # Check if we've visited all cantons in the region
-            if (current_mask & region_mask) == region_mask:
-                # Add this complete solution
-                complete_solutions.append({
-                    'stations': path,
-                    'cantons': [self.station_to_canton[st] for st in path],
-                    'time': current_time,
-                    'end_station': current_station
-                })
+            if current_mask == region_mask:
+                stats['tours'] += 1
+                # One more tour completed: every state may be expanded once more
+                for waiting_state in list(waiting):
+                    heapq.heappush(pq, heapq.heappop(waiting[waiting_state]))
+                    if not waiting[waiting_state]:
+                        del waiting[waiting_state]
+                
+                tour = complete(label, current_time)
+                if tour is not None:
+                    yield tour
                 continue
             
+            if not distinct_end:
+                expansions[state] = expansions.get(state, 0) + 1
+            stats['expanded'] += 1
+            
             # Explore neighbors
-            for next_station, travel_time in self.neighbors[current_station]:
-                next_canton = self.station_to_canton[next_station]
-                next_canton_id = self.canton_to_id[next_canton]
+            for edge in range(offsets[current_station], offsets[current_station + 1]):
+                next_station = targets[edge]
+                next_mask = current_mask | region_bit[next_station]
+                next_time = current_time + weights[edge]
+                next_state = (next_station << shift) | next_mask
                 
-                # Only set bit if canton is in our target region
-                if next_canton in region:
-                    next_mask = current_mask | (1 << next_canton_id)
-                else:
-                    next_mask = current_mask
+                if distinct_end:
+                    if best_time.get(next_state, INFINITY) <= next_time:
+                        continue
+                    best_time[next_state] = next_time
+                next_priority = next_time + bound(next_station, region_mask & ~next_mask)
+                next_label = add_label(next_station, next_mask, label)
+                heapq.heappush(pq, (((next_priority << time_bits) | next_time) << label_bits) | next_label)
+                stats['pushed'] += 1
+            
+            if budget is not None:
+                # A state the full table could not store would be expanded again, so
+                # switch right after the inserts of this expansion; the entries pushed
+                # meanwhile carry over to the beam search. Labels take 16 bytes, an
+                # open list entry about 44 (int plus list slot)
+                if state_table.full or (stats['expanded'] % 1024 == 0 and
+                                        state_table.nbytes + 16 * len(label_station) + 44 * len(pq) > budget):
+                    stats['beam'] = True
+                    break
+        
+        if stats['beam']:
+            # Beam search from the open list over metric closure moves: each layer moves
+            # every entry along a shortest path straight to a station of an unvisited
+            # region canton (which loses no optimal tour, see ExactTourSolver), so
+            # there are at most as many layers as region cantons. A move enters no
+            # other unvisited canton on the way: otherwise stopping at that station
+            # first would reach the same walk again in a later layer. Each layer keeps the
+            # beam_width entries with the lowest bound; a tour is final once no
+            # remaining entry's bound is below it.
+            if self.closure_moves is None:
+                self.closure_moves = metric_closure_moves(self.station_distance, self.station_predecessor,
+                                                          self.station_canton_bit.tolist())
+            found = []
+            frontier = sorted(pq + [entry for entries in waiting.values() for entry in entries])
+            while frontier:
+                if len(frontier) > self.beam_width:
+                    min_dropped = min(min_dropped, frontier[self.beam_width] >> (time_bits + label_bits))
+                    stats['dropped'] += len(frontier) - self.beam_width
+                    del frontier[self.beam_width:]
+                
+                layer = {}  # state -> cheapest entry reaching it in this layer
+                for entry in frontier:
+                    label = entry & label_mask_bits
+                    current_time = (entry >> label_bits) & time_mask_bits
+                    current_mask = label_mask[label]
+                    if current_mask == region_mask:
+                        heapq.heappush(found, entry)
+                        continue
+                    stats['expanded'] += 1
+                    for next_station, minutes, path_mask in self.closure_moves[label_station[label]]:
+                        entered = path_mask & region_mask & ~current_mask
+                        if not entered or entered != region_bit[next_station]:
+                            continue
+                        next_mask = current_mask | entered
+                        next_time = current_time + minutes
+                        next_priority = next_time + bound(next_station, region_mask & ~next_mask)
+                        next_entry = ((next_priority << time_bits) | next_time) << label_bits
+                        next_state = (next_station << shift) | next_mask
+                        existing = layer.get(next_state)
+                        if existing is None or next_entry < existing[0]:
+                            layer[next_state] = (next_entry, label)
+                    if len(layer) > 4 * self.beam_width:
+                        # Keep the layer itself within a few beam widths
+                        kept = sorted(layer.items(), key=lambda item: item[1][0])
+                        min_dropped = min(min_dropped, kept[2 * self.beam_width][1][0] >> (time_bits + label_bits))
+                        stats['dropped'] += len(kept) - 2 * self.beam_width
+                        layer = dict(kept[:2 * self.beam_width])
+                
+                frontier = []
+                for next_state, (next_entry, parent) in layer.items():
+                    next_label = add_label(next_state >> shift, next_state & ((1 << shift) - 1), parent)
+                    jumps.add(next_label)
+                    frontier.append(next_entry | next_label)
+                    stats['pushed'] += 1
+                frontier.sort()
                 
-                next_time = current_time + travel_time
-                next_state = (next_station, next_mask)
+                horizon = frontier[0] >> (time_bits + label_bits) if frontier else INFINITY
+                while found and found[0] >> (time_bits + label_bits) <= horizon:
+                    entry = heapq.heappop(found)
+                    stats['tours'] += 1
+                    tour = complete(entry & label_mask_bits, (entry >> label_bits) & time_mask_bits)
+                    if tour is not None:
+                        yield tour
+        
+        update_stats()
+    
+    def boundary_stations(self) -> List[str]:
+        """Stations with a direct connection to or from a station of the other region."""
+        west_ids = {self.canton_to_id[c] for c in self.west_cantons}
+        east_ids = {self.canton_to_id[c] for c in self.east_cantons}
+        
+        boundary = set()
+        for from_st, to_st in self.connections:
+            from_id = self.canton_to_id[self.station_to_canton[from_st]]
+            to_id = self.canton_to_id[self.station_to_canton[to_st]]
+            if (from_id in west_ids and to_id in east_ids) or (from_id in east_ids and to_id in west_ids):
+                boundary.add(from_st)
+                boundary.add(to_st)
+        return sorted(boundary)
+    
+    def reversed_csr(self) -> Tuple[List[int], List[int], List[int]]:
+        """Offsets, targets and weights (as int lists) of the graph with every connection reversed."""
+        station_count = len(self.station_list)
+        sources = np.repeat(np.arange(station_count, dtype=np.int32), np.diff(self.csr_offsets))
+        order = np.argsort(self.csr_targets, kind='stable')
+        offsets = np.zeros(station_count + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(self.csr_targets, minlength=station_count))
+        return offsets.tolist(), sources[order].tolist(), self.csr_weights[order].tolist()
+    
+    def completion_costs(self, region: Set[str], candidates: List[str]) -> Dict[str, Dict]:
+        """
+        Best time to visit all cantons in `region` starting from each candidate station,
+        found in one pass: such a walk, reversed, is a walk of the reversed graph ending
+        at the candidate, so a single A* over the reversed graph started from every
+        station at once settles the candidates in order of completion time.
+        Returns station -> solution in the format of find_top_k_paths; candidates that
+        cannot complete the region are left out.
+        """
+        region_mask = sum(1 << self.canton_to_id[c] for c in region if c in self.canton_to_id)
+        region_bit = (self.station_canton_bit & region_mask).tolist()
+        offsets, targets, weights = self.reversed_csr()
+        shift = len(self.cantons)
+        station_count = len(self.station_list)
+        distance = self.station_distance
+        candidate_ids = {self.station_index[st] for st in candidates if st in self.station_index}
+        if not candidate_ids:
+            return {}
+        
+        # Bound tables of the reversed graph: time from each region canton to a station
+        # (farthest first), time from the nearest candidate, and the cheapest connection
+        # leaving each canton (entering it in the reversed graph)
+        time_from_canton = [[INFINITY] * len(self.cantons) for _ in range(station_count)]
+        for other, row in enumerate(distance):
+            canton_id = self.station_canton_id[other]
+            for station, minutes in enumerate(row):
+                if minutes < time_from_canton[station][canton_id]:
+                    time_from_canton[station][canton_id] = minutes
+        farthest_first = [
+            sorted(((t, 1 << c) for c, t in enumerate(times) if region_mask >> c & 1), reverse=True)
+            for times in time_from_canton
+        ]
+        from_candidate = [min(distance[c][station] for c in candidate_ids) for station in range(station_count)]
+        min_exit_time = [INFINITY] * len(self.cantons)
+        for (from_st, to_st), minutes in self.connections.items():
+            canton_id = self.canton_to_id[self.station_to_canton[from_st]]
+            if minutes < min_exit_time[canton_id]:
+                min_exit_time[canton_id] = minutes
+        exit_sum_cache = {}
+        
+        def bound(station: int, unvisited: int) -> int:
+            if not unvisited:
+                return from_candidate[station]
+            exit_sum = exit_sum_cache.get(unvisited)
+            if exit_sum is None:
+                exit_sum = sum(t for c, t in enumerate(min_exit_time) if unvisited >> c & 1)
+                exit_sum_cache[unvisited] = exit_sum
+            farthest = next(t for t, bit in farthest_first[station] if unvisited & bit)
+            return max(exit_sum, farthest, from_candidate[station])
+        
+        label_station = array('i')
+        label_mask = array('q')
+        label_parent = array('i')
+        
+        def add_label(station: int, mask: int, parent: int) -> int:
+            label_station.append(station)
+            label_mask.append(mask)
+            label_parent.append(parent)
+            return len(label_station) - 1
+        
+        # Same packed (time + bound, time, label) heap entries as find_top_k_paths
+        pq = []
+        label_bits = 32
+        time_bits = 20
+        label_mask_bits = (1 << label_bits) - 1
+        time_mask_bits = (1 << time_bits) - 1
+        best_time = {}
+        results = {}
+        stats = {'expanded': 0, 'pushed': 0}
+        search_start = datetime.now()
+        
+        # Every station is a possible end of the forward walk, i.e. a source here
+        for station in range(station_count):
+            mask = region_bit[station]
+            priority = bound(station, region_mask & ~mask)
+            if priority >= INFINITY:
+                continue
+            best_time[(station << shift) | mask] = 0
+            heapq.heappush(pq, (priority << (time_bits + label_bits)) | add_label(station, mask, -1))
+            stats['pushed'] += 1
+        
+        while pq:
+            entry = heapq.heappop(pq)
+            label = entry & label_mask_bits
+            current_time = (entry >> label_bits) & time_mask_bits
+            current_station = label_station[label]
+            current_mask = label_mask[label]
+            
+            if best_time[(current_station << shift) | current_mask] < current_time:
+                continue
+            
+            if current_mask == region_mask and current_station in candidate_ids:
+                start_station = self.station_list[current_station]
+                if start_station not in results:
+                    # Parent pointers run back to the source, which is the forward end
+                    path = []
+                    walk = label
+                    while walk != -1:
+                        path.append(self.station_list[label_station[walk]])
+                        walk = label_parent[walk]
+                    results[start_station] = {
+                        'stations': path,
+                        'cantons': [self.station_to_canton[st] for st in path],
+                        'time': current_time,
+                        'end_station': path[-1]
+                    }
+                    if len(results) == len(candidate_ids):
+                        break
+            
+            stats['expanded'] += 1
+            for edge in range(offsets[current_station], offsets[current_station + 1]):
+                next_station = targets[edge]
+                next_mask = current_mask | region_bit[next_station]
+                next_time = current_time + weights[edge]
+                next_state = (next_station << shift) | next_mask
                 
-                if next_state not in best_time or best_time[next_state] > next_time:
+                if best_time.get(next_state, INFINITY) > next_time:
                     best_time[next_state] = next_time
-                    next_cantons_visited = bin(next_mask & region_mask).count('1')
-                    next_priority = -next_cantons_visited * 10000 + next_time
-                    heapq.heappush(pq, (next_priority, next_time, next_station, 
-                                       next_mask, path + [next_station]))
+                    next_priority = next_time + bound(next_station, region_mask & ~next_mask)
+                    if next_priority >= INFINITY:
+                        continue
+                    next_label = add_label(next_station, next_mask, label)
+                    heapq.heappush(pq, (((next_priority << time_bits) | next_time) << label_bits) | next_label)
+                    stats['pushed'] += 1
         
-        # Sort by time
-        complete_solutions.sort(key=lambda x: x['time'])
+        stats['labels'] = len(label_station)
+        stats['seconds'] = round((datetime.now() - search_start).total_seconds(), 2)
+        self.last_search_stats = stats
+        print(f"  Search stats: {stats['expanded']} expanded, {stats['pushed']} pushed, {stats['seconds']}s")
         
-        # Group by end station and keep only the best time for each
-        best_by_end = {}
-        for sol in complete_solutions:
-            end = sol['end_station']
-            if end not in best_by_end or sol['time'] < best_by_end[end]['time']:
-                best_by_end[end] = sol
+        return results
+    
+    def find_best_split_points(self, candidates: Optional[List[str]] = None) -> List[Dict]:
+        """
+        West and East completion times from every candidate split station (by default
+        all boundary stations), with one completion_costs pass per region.
+        Returns one entry per candidate that completes both regions, best total first.
+        """
+        candidates = candidates if candidates is not None else self.boundary_stations()
+        print(f"Evaluating {len(candidates)} candidate split points")
+        print("West completions:")
+        west = self.completion_costs(self.west_cantons, candidates)
+        print("East completions:")
+        east = self.completion_costs(self.east_cantons, candidates)
         
-        # Get top K unique end stations
-        unique_solutions = sorted(best_by_end.values(), key=lambda x: x['time'])
+        splits = []
+        for station in candidates:
+            if station in west and station in east:
+                splits.append({
+                    'split_point': station,
+                    'canton': self.station_to_canton[station],
+                    'west_time': west[station]['time'],
+                    'east_time': east[station]['time'],
+                    'total_time': west[station]['time'] + east[station]['time'],
+                    'west_end': west[station]['end_station'],
+                    'east_end': east[station]['end_station']
+                })
+        splits.sort(key=lambda x: x['total_time'])
+        return splits
+    
+    def run_searches_parallel(self, k: int = 3, workers: int = 6,
+                              searches: Optional[List[Tuple[str, str]]] = None) -> Dict[Tuple[str, str], List[Dict]]:
+        """
+        Run the West and East searches of every split point (or the given
+        (split point, region) searches) in a process pool.
+        Returns (split point, 'west' | 'east') -> solutions.
+        """
+        if searches is None:
+            searches = [(split_point, region_name) for split_point in self.split_points
+                        for region_name in ('west', 'east')]
+        jobs = [(region_name, split_point) for split_point, region_name in searches]
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        
+        results = {}
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 mp_context=multiprocessing.get_context(start_method),
+                                 initializer=_init_search_worker, initargs=(self,)) as executor:
+            futures = {
+                executor.submit(_run_search_worker, region_name, split_point, k): (region_name, split_point)
+                for region_name, split_point in jobs
+            }
+            for future in as_completed(futures):
+                region_name, split_point = futures[future]
+                solutions, stats = future.result()
+                results[(split_point, region_name)] = solutions
+                print(f"  {region_name.title()} from {split_point}: {stats['expanded']} expanded, "
+                      f"{stats['pushed']} pushed, {stats['seconds']}s")
         
-        return unique_solutions[:k]
+        return results
     
-    def find_all_combinations(self):
-        """Find all combinations of split points with top 3 east and west solutions."""
+    def find_all_combinations(self, workers: int = 1,
+                              known_solutions: Optional[Dict[Tuple[str, str], List[Dict]]] = None):
+        """
+        Find all combinations of split points with top 3 east and west solutions.
+        With workers > 1 the region searches run in a process pool first.
+        Searches already in `known_solutions` ((split point, region) -> solutions)
+        are not run again; all solutions are left in self.region_solutions.
+        """
         print("Finding all combinations of Swiss canton tours")
         print("="*80)
         print(f"West region ({len(self.west_cantons)} cantons): {', '.join(sorted(self.west_cantons))}")
@@ -166,6 +886,16 @@ class SwissCantonRegionalPathFinder:
         
         all_combinations = []
         
+        solutions = dict(known_solutions or {})
+        missing = [(split_point, region_name) for split_point in self.split_points
+                   for region_name in ('west', 'east') if (split_point, region_name) not in solutions]
+        if workers > 1 and missing:
+            print(f"\nRunning {len(missing)} region searches on {workers} worker processes...")
+            search_start = datetime.now()
+            solutions.update(self.run_searches_parallel(k=3, workers=workers, searches=missing))
+            print(f"All searches finished in {(datetime.now() - search_start).total_seconds():.2f}s")
+        self.region_solutions = solutions
+        
         # For each split point
         for split_point in self.split_points:
             print(f"\n{'='*60}")
@@ -174,14 +904,18 @@ class SwissCantonRegionalPathFinder:
             
             # Find top 3 west solutions
             print(f"Finding top 3 west solutions from {split_point}...")
-            west_solutions = self.find_top_k_paths(self.west_cantons, split_point, k=3)
+            if (split_point, 'west') not in solutions:
+                solutions[(split_point, 'west')] = self.find_top_k_paths(self.west_cantons, split_point, k=3)
+            west_solutions = solutions[(split_point, 'west')]
             print(f"Found {len(west_solutions)} west solutions")
             for i, sol in enumerate(west_solutions):
                 print(f"  West #{i+1}: {sol['time']} min, ends at {sol['end_station']}")
             
             # Find top 3 east solutions
             print(f"Finding top 3 east solutions from {split_point}...")
-            east_solutions = self.find_top_k_paths(self.east_cantons, split_point, k=3)
+            if (split_point, 'east') not in solutions:
+                solutions[(split_point, 'east')] = self.find_top_k_paths(self.east_cantons, split_point, k=3)
+            east_solutions = solutions[(split_point, 'east')]
             print(f"Found {len(east_solutions)} east solutions")
             for i, sol in enumerate(east_solutions):
                 print(f"  East #{i+1}: {sol['time']} min, ends at {sol['end_station']}")
@@ -271,12 +1005,42 @@ class SwissCantonRegionalPathFinder:
                     print(f"  {sp}: {best['total_time']} minutes (Rank #{best['rank']})")
 
 def main():
+    parser = argparse.ArgumentParser(description="Top 27 West/East canton route combinations")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json",
+                        help="step2 connection times: the JSON, or the compact .npy matrix")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--workers", type=int, default=min(6, os.cpu_count() or 1),
+                        help="Worker processes for the region searches (1 runs them in this process)")
+    parser.add_argument("--discover-splits", type=int, default=0, metavar="N",
+                        help="Rank every region boundary station as a split point and use the best N")
+    parser.add_argument("--min-edit-distance", type=int, default=0, metavar="N",
+                        help="Keep only region solutions at least N station edits apart from each better one")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Memory per region search; beyond it the search continues as a beam search")
+    parser.add_argument("--beam-width", type=int, default=10000, help="Open list width of the beam search")
+    args = parser.parse_args()
+    
     print("Swiss Canton Path Finder - Top 27 Route Combinations")
     print("Finding best 3 west × best 3 east × 3 split points = 27 total routes")
     print("=" * 80)
     
-    finder = SwissCantonRegionalPathFinder('output_step2/swiss_canton_connection_times.json')
-    finder.find_all_combinations()
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    finder.min_edit_distance = args.min_edit_distance
+    if args.memory_budget is not None:
+        finder.memory_budget = int(args.memory_budget * 2 ** 20)
+    finder.beam_width = args.beam_width
+    
+    if args.discover_splits > 0:
+        splits = finder.find_best_split_points()
+        print(f"\n{'Split Point':^20} | {'Canton':^18} | {'West':>5} | {'East':>5} | {'Total':>5}")
+        print("-" * 65)
+        for split in splits:
+            print(f"{split['split_point'][:20]:^20} | {split['canton'][:18]:^18} | {split['west_time']:>5} | "
+                  f"{split['east_time']:>5} | {split['total_time']:>5}")
+        finder.split_points = [split['split_point'] for split in splits[:args.discover_splits]]
+        print()
+    
+    finder.find_all_combinations(args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
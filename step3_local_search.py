@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Local Search Tour Improver
+Improves any canton tour with 2-opt, Or-opt and station substitution moves over
+the order in which the cantons are first entered, evaluated in O(1) from the
+all-pairs shortest times, and runs multi-start iterated local search across a
+process pool under a time budget.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from step3_find_shortest_routes import DEFAULT_GRAPH_FILE, SwissCantonRegionalPathFinder, shortest_path
+
+# Improver used by worker processes, inherited on fork or pickled once per worker
+_worker_improver = None
+
+
+def _init_search_worker(improver: 'LocalSearchImprover'):
+    global _worker_improver
+    _worker_improver = improver
+
+
+def _run_search_job(tour: Optional[List[int]], seconds: float, seed: int) -> Tuple[List[int], int, Dict]:
+    """Run one iterated local search in a worker, from `tour` or from a random tour when None."""
+    rng = random.Random(seed)
+    if tour is None:
+        tour = _worker_improver.random_tour(rng)
+    return _worker_improver.iterated_local_search(tour, seconds, rng)
+
+
+class LocalSearchImprover:
+    def __init__(self, finder: SwissCantonRegionalPathFinder):
+        """
+        A tour is the list of station ids where it first enters each canton, in order;
+        consecutive stations are joined by shortest paths, so its time is the sum of
+        the shortest times between them. Every walk through all cantons maps to such
+        a tour that is no longer, and the best one is the optimal walk.
+        """
+        self.finder = finder
+        self.station_canton = finder.station_canton_id
+        self.canton_stations = [[] for _ in finder.cantons]
+        for station, canton in enumerate(self.station_canton):
+            self.canton_stations[canton].append(station)
+
+        # A virtual depot at both ends, 0 minutes to and from every station, makes
+        # the open tour a cycle so the moves need no special case at the ends
+        self.depot = len(finder.station_list)
+        self.distance = [row + [0] for row in finder.station_distance] + [[0] * (self.depot + 1)]
+
+    def tour_from_walk(self, stations: List[str]) -> List[int]:
+        """Station ids where `stations` first enters each canton, in order."""
+        finder = self.finder
+        seen = set()
+        tour = []
+        for station in stations:
+            station_id = finder.station_index[station]
+            if self.station_canton[station_id] not in seen:
+                seen.add(self.station_canton[station_id])
+                tour.append(station_id)
+        if len(seen) != len(finder.cantons):
+            raise ValueError(f"Walk covers {len(seen)} of {len(finder.cantons)} cantons")
+        return tour
+
+    def random_tour(self, rng: random.Random) -> List[int]:
+        """Random canton order with a random station per canton."""
+        order = list(range(len(self.canton_stations)))
+        rng.shuffle(order)
+        return [rng.choice(self.canton_stations[canton]) for canton in order]
+
+    def tour_time(self, tour: List[int]) -> int:
+        distance = self.distance
+        return sum(distance[a][b] for a, b in zip(tour, tour[1:]))
+
+    def expand(self, tour: List[int]) -> List[str]:
+        """Full station walk of a tour, following the shortest paths between its stations."""
+        predecessor = self.finder.station_predecessor
+        station_ids = tour[:1]
+        for a, b in zip(tour, tour[1:]):
+            station_ids.extend(shortest_path(predecessor, a, b)[1:])
+        return [self.finder.station_list[s] for s in station_ids]
+
+    def substitute(self, seq: List[int]) -> bool:
+        """Replace one station by another of its canton, first improvement."""
+        distance = self.distance
+        for i in range(1, len(seq) - 1):
+            p, s, q = seq[i - 1], seq[i], seq[i + 1]
+            current = distance[p][s] + distance[s][q]
+            for u in self.canton_stations[self.station_canton[s]]:
+                if distance[p][u] + distance[u][q] < current:
+                    seq[i] = u
+                    return True
+        return False
+
+    def or_opt(self, seq: List[int]) -> bool:
+        """Move a run of 1 to 3 stations elsewhere in the tour, first improvement."""
+        distance = self.distance
+        last = len(seq) - 1
+        for length in (1, 2, 3):
+            for i in range(1, last - length + 1):
+                j = i + length - 1
+                p, a, b, q = seq[i - 1], seq[i], seq[j], seq[j + 1]
+                gain = distance[p][a] + distance[b][q] - distance[p][q]
+                for k in range(last):
+                    if i - 1 <= k <= j:
+                        continue
+                    x, y = seq[k], seq[k + 1]
+                    if distance[x][a] + distance[b][y] - distance[x][y] < gain:
+                        segment = seq[i:j + 1]
+                        del seq[i:j + 1]
+                        insert_at = k + 1 if k < i else k + 1 - length
+                        seq[insert_at:insert_at] = segment
+                        return True
+        return False
+
+    def two_opt(self, seq: List[int]) -> bool:
+        """
+        Reverse a run of stations, first improvement. The times are asymmetric, so
+        the reversed run's time comes from prefix sums of the backward times.
+        """
+        distance = self.distance
+        forward = [0]
+        backward = [0]
+        for a, b in zip(seq, seq[1:]):
+            forward.append(forward[-1] + distance[a][b])
+            backward.append(backward[-1] + distance[b][a])
+
+        last = len(seq) - 1
+        for i in range(1, last - 1):
+            p, a = seq[i - 1], seq[i]
+            for j in range(i + 1, last):
+                b, q = seq[j], seq[j + 1]
+                before = distance[p][a] + forward[j] - forward[i] + distance[b][q]
+                after = distance[p][b] + backward[j] - backward[i] + distance[a][q]
+                if after < before:
+                    seq[i:j + 1] = seq[i:j + 1][::-1]
+                    return True
+        return False
+
+    def local_search(self, tour: List[int], moves: Optional[Dict] = None) -> List[int]:
+        """Apply improving moves, cheapest neighbourhood first, until none is left."""
+        seq = [self.depot] + tour + [self.depot]
+        neighbourhoods = [('substitute', self.substitute), ('or_opt', self.or_opt), ('two_opt', self.two_opt)]
+        improved = True
+        while improved:
+            improved = False
+            for name, move in neighbourhoods:
+                if move(seq):
+                    if moves is not None:
+                        moves[name] = moves.get(name, 0) + 1
+                    improved = True
+                    break
+        return seq[1:-1]
+
+    def perturb(self, tour: List[int], rng: random.Random) -> List[int]:
+        """Double bridge (swap two adjacent runs) plus one random station substitution."""
+        a, b, c = sorted(rng.sample(range(1, len(tour)), 3))
+        tour = tour[:a] + tour[b:c] + tour[a:b] + tour[c:]
+        i = rng.randrange(len(tour))
+        tour[i] = rng.choice(self.canton_stations[self.station_canton[tour[i]]])
+        return tour
+
+    def iterated_local_search(self, tour: List[int], seconds: float,
+                              rng: random.Random) -> Tuple[List[int], int, Dict]:
+        """
+        Local search from `tour`, then perturb and search again until `seconds` run
+        out, moving on from any tour that is no worse. Returns the best tour, its
+        time and the search stats.
+        """
+        deadline = time.monotonic() + seconds
+        moves = {}
+        current = self.local_search(tour, moves)
+        current_time = self.tour_time(current)
+        best, best_time = current, current_time
+        stats = {'initial_time': self.tour_time(tour), 'rounds': 0, 'moves': moves}
+
+        while time.monotonic() < deadline:
+            candidate = self.local_search(self.perturb(current, rng), moves)
+            candidate_time = self.tour_time(candidate)
+            if candidate_time <= current_time:
+                current, current_time = candidate, candidate_time
+                if candidate_time < best_time:
+                    best, best_time = candidate, candidate_time
+            stats['rounds'] += 1
+        return best, best_time, stats
+
+    def improve(self, tour: Optional[List[int]] = None, seconds: float = 10.0, workers: int = 1,
+                seed: int = 0) -> Dict:
+        """
+        One iterated local search per worker for `seconds`: the first from `tour`
+        (if given), the others from random tours. Returns the best tour found.
+        """
+        start = datetime.now()
+        starts = [tour] + [None] * (workers - 1) if tour is not None else [None] * workers
+        jobs = [(start_tour, seconds, seed + i) for i, start_tour in enumerate(starts)]
+
+        if workers <= 1:
+            _init_search_worker(self)
+            results = [_run_search_job(*jobs[0])]
+        else:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method),
+                                     initializer=_init_search_worker, initargs=(self,)) as executor:
+                results = list(executor.map(_run_search_job, *zip(*jobs)))
+
+        best_tour, best_time, _ = min(results, key=lambda result: result[1])
+        stats = {
+            'starts': len(results),
+            'start_times': [result[2]['initial_time'] for result in results],
+            'final_times': [result[1] for result in results],
+            'rounds': sum(result[2]['rounds'] for result in results),
+            'moves': {},
+            'seconds': round((datetime.now() - start).total_seconds(), 2)
+        }
+        for _, _, run_stats in results:
+            for name, count in run_stats['moves'].items():
+                stats['moves'][name] = stats['moves'].get(name, 0) + count
+        self.last_search_stats = stats
+
+        stations = self.expand(best_tour)
+        return {
+            'stations': stations,
+            'cantons': [self.finder.station_to_canton[st] for st in stations],
+            'time': best_time,
+            'visit_order': [self.finder.station_list[s] for s in best_tour],
+            'start_station': stations[0],
+            'end_station': stations[-1],
+            'stats': stats
+        }
+
+
+def load_walk(path: str, rank: int) -> List[str]:
+    """Station walk from a step3 ranking file (its `rank`-th combined_path) or a solver result."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if 'rankings' in data:
+        return data['rankings'][rank - 1]['combined_path']
+    return data['stations']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Improve a canton tour by parallel local search")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--tour", default="output_step3/top_27_canton_routes.json",
+                        help="Tour to improve: step3 rankings or a solver result with 'stations'")
+    parser.add_argument("--no-tour", action="store_true", help="Start from random tours only")
+    parser.add_argument("--rank", type=int, default=1, help="Ranking to improve when --tour holds step3 rankings")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Time budget per worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.no_tour and not os.path.exists(args.tour):
+        parser.error(f"tour file '{args.tour}' not found (--no-tour starts from random tours only)")
+
+    print("Local Search Tour Improver")
+    print("=" * 80)
+
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    improver = LocalSearchImprover(finder)
+
+    tour = None
+    if args.no_tour:
+        print("\nStarting from random tours only")
+    else:
+        walk = load_walk(args.tour, args.rank)
+        tour = improver.tour_from_walk(walk)
+        print(f"\nStarting from '{args.tour}': {len(walk)} stations, {improver.tour_time(tour)} minutes")
+
+    result = improver.improve(tour, args.seconds, args.workers, args.seed)
+    stats = improver.last_search_stats
+    print(f"Starts: {stats['starts']}, rounds: {stats['rounds']}, moves: {stats['moves']}, time: {stats['seconds']}s")
+    for i, (before, after) in enumerate(zip(stats['start_times'], stats['final_times'])):
+        print(f"  Start {i + 1}: {before} -> {after} min")
+
+    print(f"\nBest tour: {result['time']} minutes ({result['time'] // 60}h {result['time'] % 60}min)")
+    print(f"  {result['start_station']} -> {result['end_station']} ({len(result['stations'])} stations)")
+    print(f"  {' -> '.join(result['stations'])}")
+
+    result['timestamp'] = datetime.now().isoformat()
+    with open('improved_canton_tour.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print("\nSaved to 'improved_canton_tour.json'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Region Decomposition Tour Solver
+Solves the canton tour for an ordered partition of the cantons into k regions:
+each region is covered by its own search between candidate boundary stations,
+the searches run in parallel, and a DP over the boundary choices stitches the
+region walks into the best tour that visits the regions one after the other.
+"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from step3_find_shortest_routes import DEFAULT_GRAPH_FILE, INFINITY, SwissCantonRegionalPathFinder
+
+# Built-in partitions; each returns the regions in the order they are toured
+PARTITIONS = {
+    'west-east': lambda finder: [finder.west_cantons, finder.east_cantons],
+    'east-west': lambda finder: [finder.east_cantons, finder.west_cantons],
+}
+
+# Solver used by worker processes, inherited on fork or pickled once per worker
+_worker_solver = None
+
+
+def _init_region_worker(solver: 'RegionDecompositionSolver'):
+    global _worker_solver
+    _worker_solver = solver
+
+
+def _run_region_job(region_index: int, entry: Optional[int]) -> Tuple[int, Optional[int], Dict, Dict]:
+    """Run one region search in a worker; returns the job key, the walks and the search stats."""
+    walks = _worker_solver.cover_region(region_index, entry)
+    return region_index, entry, walks, _worker_solver.last_search_stats
+
+
+class RegionDecompositionSolver:
+    def __init__(self, finder: SwissCantonRegionalPathFinder, regions: List[Set[str]],
+                 portals: Optional[List[str]] = None):
+        """
+        Set up the solver for `regions`, an ordered partition of the cantons. A region
+        walk may end only at a station of the region, and at one of `portals` if given;
+        the next region's walk starts there. A region walk cannot count the cantons of
+        later regions it passes through, so without portals the decomposition is exact
+        only for tours that visit each region in one contiguous block, in this order.
+        """
+        self.finder = finder
+        self.regions = [set(region) for region in regions]
+
+        covered = [canton for region in self.regions for canton in region]
+        if sorted(covered) != sorted(finder.cantons):
+            raise ValueError("Regions must partition the cantons, each canton in exactly one region")
+
+        self.region_masks = [sum(1 << finder.canton_to_id[c] for c in region) for region in self.regions]
+        self.station_bits = finder.station_canton_bit.tolist()
+        self.offsets = finder.csr_offsets.tolist()
+        self.targets = finder.csr_targets.tolist()
+        self.weights = finder.csr_weights.tolist()
+
+        portal_ids = None if portals is None else {finder.station_index[st] for st in portals}
+        # Stations where the walk of each region may end (None: anywhere, for the last region)
+        self.exits = []
+        for i, mask in enumerate(self.region_masks):
+            if i == len(self.regions) - 1:
+                self.exits.append(None)
+                continue
+            stations = {s for s, bit in enumerate(self.station_bits) if bit & mask}
+            self.exits.append(stations if portal_ids is None else stations & portal_ids)
+
+    def boundary_stations(self) -> List[str]:
+        """Stations with a direct connection to or from a station of another region."""
+        region_of = {}
+        for i, region in enumerate(self.regions):
+            for canton in region:
+                region_of[canton] = i
+
+        finder = self.finder
+        boundary = set()
+        for from_st, to_st in finder.connections:
+            if region_of[finder.station_to_canton[from_st]] != region_of[finder.station_to_canton[to_st]]:
+                boundary.add(from_st)
+                boundary.add(to_st)
+        return sorted(boundary)
+
+    def cover_region(self, region_index: int, entry: Optional[int]) -> Dict[int, Tuple[int, List[int]]]:
+        """
+        Shortest walks covering region `region_index` from station id `entry` (from any
+        station when None) to each of its exits, or to the first station where the
+        region is complete if it has no exit restriction.
+        Returns exit station id -> (time, station ids of the walk).
+        """
+        finder = self.finder
+        region_mask = self.region_masks[region_index]
+        goals = self.exits[region_index]
+        shift = len(finder.cantons)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        region_bit = [bit & region_mask for bit in self.station_bits]
+        remaining_time_bound = finder.remaining_time_bound
+
+        # Time to the nearest exit, added to the finder's consistent bound
+        if goals is None:
+            to_goal = [0] * len(region_bit)
+        else:
+            distance = finder.station_distance
+            to_goal = [min((row[g] for g in goals), default=INFINITY) for row in distance]
+
+        def bound(station: int, unvisited: int) -> int:
+            return max(remaining_time_bound(station, unvisited), to_goal[station])
+
+        label_station = array('i')
+        label_mask = array('q')
+        label_parent = array('i')
+
+        def add_label(station: int, mask: int, parent: int) -> int:
+            label_station.append(station)
+            label_mask.append(mask)
+            label_parent.append(parent)
+            return len(label_station) - 1
+
+        pq = []
+        best_time = {}
+        walks = {}
+        stats = {'expanded': 0, 'pushed': 0}
+        search_start = datetime.now()
+
+        sources = range(len(region_bit)) if entry is None else [entry]
+        for station in sources:
+            mask = region_bit[station]
+            priority = bound(station, region_mask & ~mask)
+            if priority >= INFINITY:
+                continue
+            best_time[(station << shift) | mask] = 0
+            heapq.heappush(pq, (priority, 0, add_label(station, mask, -1)))
+            stats['pushed'] += 1
+
+        goal_count = 1 if goals is None else len(goals)
+        while pq:
+            _, current_time, label = heapq.heappop(pq)
+            current_station = label_station[label]
+            current_mask = label_mask[label]
+            if best_time[(current_station << shift) | current_mask] < current_time:
+                continue
+
+            if current_mask == region_mask and (goals is None or current_station in goals) \
+                    and current_station not in walks:
+                path = []
+                walk = label
+                while walk != -1:
+                    path.append(label_station[walk])
+                    walk = label_parent[walk]
+                walks[current_station] = (current_time, path[::-1])
+                if len(walks) == goal_count:
+                    break
+
+            stats['expanded'] += 1
+            for edge in range(offsets[current_station], offsets[current_station + 1]):
+                next_station = targets[edge]
+                next_mask = current_mask | region_bit[next_station]
+                next_time = current_time + weights[edge]
+                next_state = (next_station << shift) | next_mask
+                if best_time.get(next_state, INFINITY) > next_time:
+                    best_time[next_state] = next_time
+                    next_priority = next_time + bound(next_station, region_mask & ~next_mask)
+                    if next_priority >= INFINITY:
+                        continue
+                    heapq.heappush(pq, (next_priority, next_time, add_label(next_station, next_mask, label)))
+                    stats['pushed'] += 1
+
+        stats['seconds'] = round((datetime.now() - search_start).total_seconds(), 2)
+        self.last_search_stats = stats
+        return walks
+
+    def solve(self, workers: int = 1) -> Optional[Dict]:
+        """
+        Cover every region from each of its possible entries (the previous region's
+        exits; anywhere for the first region), in a process pool when workers > 1,
+        then stitch the walks with a DP over the exit chosen in each region.
+        """
+        start = datetime.now()
+        jobs = [(0, None)]
+        for i in range(1, len(self.regions)):
+            jobs.extend((i, entry) for entry in sorted(self.exits[i - 1]))
+
+        # (region, entry) -> {exit: (time, walk)}
+        tables = {}
+        stats = {'searches': len(jobs), 'expanded': 0, 'pushed': 0}
+
+        def collect(region_index, entry, walks, search_stats):
+            tables[(region_index, entry)] = walks
+            stats['expanded'] += search_stats['expanded']
+            stats['pushed'] += search_stats['pushed']
+
+        if workers <= 1:
+            for region_index, entry in jobs:
+                collect(region_index, entry, self.cover_region(region_index, entry), self.last_search_stats)
+        else:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                     mp_context=multiprocessing.get_context(start_method),
+                                     initializer=_init_region_worker, initargs=(self,)) as executor:
+                futures = [executor.submit(_run_region_job, region_index, entry) for region_index, entry in jobs]
+                for future in as_completed(futures):
+                    collect(*future.result())
+
+        # best[exit] = (time of the tour so far, entry it came from) per region
+        best = [{station: (time, None) for station, (time, _) in tables[(0, None)].items()}]
+        for i in range(1, len(self.regions)):
+            region_best = {}
+            for entry, (time_so_far, _) in best[-1].items():
+                for station, (time, _) in tables[(i, entry)].items():
+                    if station not in region_best or time_so_far + time < region_best[station][0]:
+                        region_best[station] = (time_so_far + time, entry)
+            best.append(region_best)
+
+        stats['seconds'] = round((datetime.now() - start).total_seconds(), 2)
+        self.last_search_stats = stats
+        if not best[-1]:
+            return None
+
+        # Walk the DP choices back from the best final exit
+        station = min(best[-1], key=lambda s: best[-1][s][0])
+        total_time = best[-1][station][0]
+        walks = []
+        for i in range(len(self.regions) - 1, -1, -1):
+            entry = best[i][station][1]
+            walks.append(tables[(i, entry)][station])
+            station = entry
+        walks.reverse()
+
+        station_ids = walks[0][1]
+        for _, walk in walks[1:]:
+            station_ids = station_ids + walk[1:]
+        stations = [self.finder.station_list[s] for s in station_ids]
+
+        return {
+            'stations': stations,
+            'cantons': [self.finder.station_to_canton[st] for st in stations],
+            'time': total_time,
+            'region_times': [time for time, _ in walks],
+            'region_ends': [self.finder.station_list[walk[-1]] for _, walk in walks],
+            'start_station': stations[0],
+            'end_station': stations[-1],
+            'stats': stats
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canton tour over an ordered partition into regions")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--partition", default="west-east",
+                        help=f"Built-in partition ({', '.join(PARTITIONS)}) or a JSON file with a list of canton lists")
+    parser.add_argument("--portals", choices=["all", "boundary"], default="all",
+                        help="Stations where a region walk may end: any of its stations, or only region boundary stations")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print("Region Decomposition Tour Solver")
+    print("=" * 80)
+
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    if args.partition in PARTITIONS:
+        regions = PARTITIONS[args.partition](finder)
+    else:
+        with open(args.partition, 'r', encoding='utf-8') as f:
+            regions = json.load(f)
+
+    solver = RegionDecompositionSolver(finder, regions)
+    if args.portals == "boundary":
+        solver = RegionDecompositionSolver(finder, regions, solver.boundary_stations())
+    print(f"\n{len(solver.regions)} regions: {', '.join(str(len(region)) for region in solver.regions)} cantons")
+
+    result = solver.solve(args.workers)
+    stats = solver.last_search_stats
+    print(f"Searches: {stats['searches']}, expanded: {stats['expanded']}, pushed: {stats['pushed']}, "
+          f"time: {stats['seconds']}s")
+
+    if result is None:
+        print("\nNo tour completes the regions in this order")
+        return
+
+    print(f"\nBest tour: {result['time']} minutes ({result['time'] // 60}h {result['time'] % 60}min)")
+    for i, (time, end) in enumerate(zip(result['region_times'], result['region_ends'])):
+        print(f"  Region {i + 1}: {time} min, ends at {end}")
+    print(f"  {' -> '.join(result['stations'])}")
+
+
+if __name__ == "__main__":
+    main()
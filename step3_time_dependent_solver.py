@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Time-Dependent Canton Tour Solver
+Searches the tour on recorded departures instead of the step2 static minimums:
+every edge is a departure list, states are (station, visited canton mask) with
+a Pareto front of (first departure, arrival) labels, and A* returns the
+shortest tour (or the earliest arrival) for a chosen start window directly.
+"""
+
+import argparse
+import heapq
+import json
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from step3_exact_solver import ExactTourSolver
+from step3_find_shortest_routes import DEFAULT_GRAPH_FILE, INFINITY, SwissCantonRegionalPathFinder
+from timetable import ConnectionTimetable, TimetableGraph, minutes_to_time, time_to_minutes
+from transport_api import DEFAULT_CACHE_FILE, ResponseCache
+
+
+class TimeDependentTourSolver:
+    def __init__(self, finder: SwissCantonRegionalPathFinder, graph: TimetableGraph):
+        """
+        Attach the graph's direct departure tables to the finder's CSR edges. Edges
+        without recorded departures are not used. The lower bound is the exact
+        solver's, over the shortest recorded duration of every edge.
+        """
+        self.finder = finder
+        self.graph = graph
+        self.full_mask = (1 << len(finder.cantons)) - 1
+        self.canton_bit = finder.station_canton_bit.tolist()
+        self.offsets = finder.csr_offsets.tolist()
+        self.targets = finder.csr_targets.tolist()
+
+        # Per CSR edge: (departures, best arrival, best departure) or None, and the
+        # first minute its departures are recorded from
+        self.tables = []
+        self.windows = []
+        min_durations = []
+        for from_station in finder.station_list:
+            for to_station, _ in finder.neighbors[from_station]:
+                edge = (graph.station_id.get(from_station), graph.station_id.get(to_station))
+                table = graph.edges.get(edge)
+                self.tables.append(table)
+                self.windows.append(graph.edge_window.get(edge, 0))
+                if table is None:
+                    min_durations.append(INFINITY)
+                else:
+                    departures, best_arr, best_dep = table
+                    min_durations.append(min(arr - dep for dep, arr in zip(best_dep, best_arr)))
+        self.edges_with_departures = sum(table is not None for table in self.tables)
+
+        self.bounds = ExactTourSolver(finder, min_durations)
+
+    def solve(self, window_start: int, window_end: int, objective: str = 'duration',
+              start_stations: Optional[List[str]] = None, upper_bound: Optional[int] = None,
+              region: Optional[Set[str]] = None) -> Optional[Dict]:
+        """
+        Best tour whose first train leaves in [window_start, window_end] (minutes).
+        objective 'duration' minimizes arrival minus first departure; 'arrival'
+        minimizes the arrival time itself. Labels are kept per (station, mask) as a
+        Pareto front of (first departure, arrival): a later start and an earlier
+        arrival both win, and a label is also dropped when the same station was
+        reached as well with one more canton visited. `upper_bound` prunes labels
+        whose bound exceeds it (minutes of the objective). With `region`, only its
+        cantons have to be visited.
+        """
+        search_start = datetime.now()
+        finder = self.finder
+        shift = len(finder.cantons)
+        full_mask = self.full_mask
+        canton_bit = self.canton_bit
+        offsets, targets, tables, windows = self.offsets, self.targets, self.tables, self.windows
+        lower_bound = self.bounds.lower_bound
+        limit = upper_bound if upper_bound is not None else INFINITY
+        # Under 'arrival' every label counts from the window start, so only arrivals compete
+        fixed_start = objective == 'arrival'
+        # Cantons outside the region start out as visited
+        outside = 0 if region is None else sum(1 << c for canton, c in finder.canton_to_id.items()
+                                                if canton not in region)
+
+        label_station = array('i')
+        label_mask = array('q')
+        label_start = array('i')
+        label_arrival = array('i')
+        label_parent = array('i')
+        alive = bytearray()
+        fronts = {}  # station << shift | mask -> label ids of the Pareto front
+
+        stats = {'expanded': 0, 'pushed': 0, 'dominated': 0, 'pruned_by_bound': 0}
+
+        def dominated(key: int, start: int, arrival: int) -> bool:
+            for other in fronts.get(key, ()):
+                if label_start[other] >= start and label_arrival[other] <= arrival:
+                    return True
+            return False
+
+        def add_label(station: int, mask: int, start: int, arrival: int, parent: int) -> int:
+            label_station.append(station)
+            label_mask.append(mask)
+            label_start.append(start)
+            label_arrival.append(arrival)
+            label_parent.append(parent)
+            alive.append(1)
+            return len(alive) - 1
+
+        def push(station: int, mask: int, start: int, arrival: int, parent: int) -> int:
+            """Add a label unless it is pruned or dominated; returns its id, or -1."""
+            f = arrival - start + lower_bound(station, mask)
+            if f > limit:
+                stats['pruned_by_bound'] += 1
+                return -1
+            key = (station << shift) | mask
+            if dominated(key, start, arrival):
+                stats['dominated'] += 1
+                return -1
+
+            # Drop the labels the new one dominates from the front
+            kept = []
+            for other in fronts.get(key, ()):
+                if start >= label_start[other] and arrival <= label_arrival[other]:
+                    alive[other] = 0
+                else:
+                    kept.append(other)
+            label = add_label(station, mask, start, arrival, parent)
+            kept.append(label)
+            fronts[key] = kept
+
+            heapq.heappush(pq, (f, -bin(mask).count('1'), label))
+            stats['pushed'] += 1
+            return label
+
+        pq = []
+        # First departure of every first-leg label, which under 'arrival' is not its start
+        first_departure = {}
+        names = start_stations if start_stations is not None else finder.station_list
+        for name in names:
+            station = finder.station_index[name]
+            mask = canton_bit[station] | outside
+            root = add_label(station, mask, window_start, window_start, -1)
+            # First legs: every distinct earliest-arrival journey leaving inside the
+            # window, from the first minute the edge's departures are recorded
+            for edge in range(offsets[station], offsets[station + 1]):
+                table = tables[edge]
+                if table is None or window_end < windows[edge]:
+                    continue
+                departures, best_arr, best_dep = table
+                next_station = targets[edge]
+                journeys = set()
+                for i in range(bisect_left(departures, max(window_start, windows[edge])), len(departures)):
+                    if best_dep[i] > window_end:
+                        break
+                    journeys.add((best_dep[i], best_arr[i]))
+                for departure, arrival in sorted(journeys):
+                    start = window_start if fixed_start else departure
+                    label = push(next_station, mask | canton_bit[next_station], start, arrival, root)
+                    if label != -1:
+                        first_departure[label] = departure
+
+        goal = None
+        while pq:
+            f, _, label = heapq.heappop(pq)
+            if not alive[label]:
+                continue
+            station = label_station[label]
+            mask = label_mask[label]
+            start = label_start[label]
+            arrival = label_arrival[label]
+
+            if mask == full_mask:
+                goal = label
+                break
+
+            # Same station reached as well with one more canton visited
+            unvisited = full_mask & ~mask
+            key = (station << shift) | mask
+            superseded = False
+            while unvisited:
+                bit = unvisited & -unvisited
+                unvisited ^= bit
+                if dominated(key | bit, start, arrival):
+                    superseded = True
+                    break
+            if superseded:
+                stats['dominated'] += 1
+                continue
+
+            stats['expanded'] += 1
+            for edge in range(offsets[station], offsets[station + 1]):
+                table = tables[edge]
+                # Before the recorded window the earliest departure is unknown
+                if table is None or arrival < windows[edge]:
+                    continue
+                departures, best_arr, _ = table
+                i = bisect_left(departures, arrival)
+                if i == len(departures):
+                    continue
+                next_station = targets[edge]
+                push(next_station, mask | canton_bit[next_station], start, best_arr[i], label)
+
+        stats['labels'] = len(alive)
+        stats['seconds'] = round((datetime.now() - search_start).total_seconds(), 2)
+        self.last_search_stats = stats
+        if goal is None:
+            return None
+
+        labels = []
+        label = goal
+        while label != -1:
+            labels.append(label)
+            label = label_parent[label]
+        labels.reverse()
+        stations = [finder.station_list[label_station[label]] for label in labels]
+
+        # Re-time the legs from the first departure that was chosen
+        legs = self.graph.evaluate_route(stations, first_departure[labels[1]])
+        if legs is None:
+            return None
+        return {
+            'stations': stations,
+            'cantons': [finder.station_to_canton[st] for st in stations],
+            'departure': minutes_to_time(legs[0][0]),
+            'arrival': minutes_to_time(legs[-1][1]),
+            'time': legs[-1][1] - legs[0][0],
+            'legs': [
+                {'from': a, 'to': b, 'departure': minutes_to_time(dep), 'arrival': minutes_to_time(arr)}
+                for (a, b), (dep, arr) in zip(zip(stations, stations[1:]), legs)
+            ],
+            'stats': stats
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canton tour on recorded departure times")
+    parser.add_argument("--input", default="output_step2/swiss_canton_connection_times.json")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_FILE, help="Binary graph file, rebuilt when --input changed")
+    parser.add_argument("--timetable", default="output_step2/swiss_canton_connection_timetable.json",
+                        help="Departure sidecar written by step2")
+    parser.add_argument("--cache", default=None,
+                        help=f"Also use the journeys of cached API responses (e.g. {DEFAULT_CACHE_FILE})")
+    parser.add_argument("--window-start", default="06:00", help="Earliest first departure (HH:MM)")
+    parser.add_argument("--window-end", default="09:00", help="Latest first departure (HH:MM)")
+    parser.add_argument("--objective", choices=["duration", "arrival"], default="duration")
+    parser.add_argument("--start", action="append", help="Restrict start station (repeatable)")
+    parser.add_argument("--upper-bound", type=int, default=None,
+                        help="Prune labels whose bound exceeds this many minutes (e.g. a step4 route)")
+    parser.add_argument("--region", choices=["all", "west", "east"], default="all",
+                        help="Cantons to visit: all 26 or one region of the step3 split")
+    args = parser.parse_args()
+
+    print("Time-Dependent Canton Tour Solver")
+    print("=" * 80)
+
+    timetable = ConnectionTimetable.load(args.timetable)
+    graph = TimetableGraph(timetable.date)
+    graph.add_timetable(timetable)
+    if args.cache:
+        cache = ResponseCache(args.cache)
+        print(f"Added {graph.add_cached_responses(cache)} cached responses")
+        cache.close()
+    graph.finalize()
+
+    finder = SwissCantonRegionalPathFinder(args.input, args.graph)
+    solver = TimeDependentTourSolver(finder, graph)
+    print(f"Edges with recorded departures: {solver.edges_with_departures} of {len(solver.tables)}")
+
+    region = {'all': None, 'west': finder.west_cantons, 'east': finder.east_cantons}[args.region]
+    result = solver.solve(time_to_minutes(args.window_start), time_to_minutes(args.window_end),
+                          args.objective, args.start, args.upper_bound, region)
+    stats = solver.last_search_stats
+    print(f"\nExpanded: {stats['expanded']}, pushed: {stats['pushed']}, dominated: {stats['dominated']}, "
+          f"pruned by bound: {stats['pruned_by_bound']}, labels: {stats['labels']}, time: {stats['seconds']}s")
+
+    if result is None:
+        print(f"\nNo tour starting between {args.window_start} and {args.window_end}")
+        return
+
+    print(f"\nBest tour ({args.objective}): {result['departure']} -> {result['arrival']}, "
+          f"{result['time']} minutes ({result['time'] // 60}h {result['time'] % 60}min)")
+    for leg in result['legs']:
+        print(f"  {leg['departure']} {leg['from']} -> {leg['arrival']} {leg['to']}")
+
+    result['timestamp'] = datetime.now().isoformat()
+    with open('time_dependent_canton_tour.json', 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print("\nSaved to 'time_dependent_canton_tour.json'")
+
+
+if __name__ == "__main__":
+    main()
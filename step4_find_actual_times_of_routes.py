@@ -4,25 +4,61 @@ SBB Route Time Calculator
 Calculates actual train times for all 54 routes (27 paths in both directions)
 """
 
-import requests
+import argparse
 import json
+import os
 from datetime import datetime, timedelta
 import time
 import pandas as pd
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import re
+from transport_api import DEFAULT_CACHE_FILE, CacheMissError, ResponseCache, TransportClient
+from timetable import ConnectionTimetable, TimetableGraph, minutes_to_time, time_to_minutes
+from gtfs_import import load_gtfs_timetable
+from journal import Journal, fingerprint
+
+# Legs the API does not return that are taken at a fixed time: (from, to) -> (departure, arrival)
+FIXED_LEGS = {("S. Vittore, Zona industriale", "Bellinzona"): ("04:37", "05:07")}
+
+# One record per finished route, read back to resume an interrupted run
+DEFAULT_JOURNAL_FILE = "sbb_routes_journal.jsonl"
 
 class SBBRouteCalculator:
-    def __init__(self, data_file: str):
+    def __init__(self, data_file: str, client: Optional[TransportClient] = None,
+                 timetable: Optional[ConnectionTimetable] = None,
+                 graph: Optional[TimetableGraph] = None):
         """Initialize with route data from JSON file"""
         with open(data_file, 'r') as f:
             self.data = json.load(f)
         
+        self.client = client if client is not None else TransportClient()
         self.api_url = "https://transport.opendata.ch/v1/connections"
         self.date = "2025-06-17"  # Tuesday
         self.start_time = "04:00"
         self.results = []
         
+        # Departure lists recorded by step2, only usable for the same service date
+        self.timetable = timetable if timetable is not None and timetable.date == self.date else None
+        self.local_lookups = 0
+        self.live_queries = 0
+        
+        # Offline engine: when set, every leg is answered from the local graph
+        self.graph = graph if graph is not None and graph.date == self.date else None
+        
+        # What journal records are made with: the leg engine (main sets 'gtfs') and a
+        # hash of the routes and of the timetable data answering the legs
+        self.engine = "api" if self.graph is None else "local"
+        self.inputs = '-'.join([fingerprint([data_file])] +
+                               [source.digest() for source in (self.timetable, self.graph) if source is not None])
+        
+        # Successful legs by (from, to, time): after a prefix shared with an earlier
+        # route the walk is at the same station at the same time, so its next leg
+        # is taken from here instead of being evaluated again
+        self.memoize_legs = True
+        self.leg_memo = {}
+        self.legs_requested = 0
+        self.legs_from_memo = 0
+        
     def fix_combined_path(self, ranking: Dict) -> List[str]:
         """Correctly combine west_path (inverted) with east_path at split point"""
         west_path = ranking['west_path'].copy()
@@ -68,7 +104,33 @@ class SBBRouteCalculator:
         """Query SBB API for connection time between two stations"""
         if start_time is None:
             start_time = self.start_time
-            
+        
+        if self.graph is not None:
+            self.local_lookups += 1
+            leg = self.graph.leg(from_station, to_station, time_to_minutes(start_time))
+            if leg is None:
+                return {'success': False, 'error': 'No connection in local timetable'}
+            departure, arrival = leg
+            return {
+                'departure': minutes_to_time(departure),
+                'arrival': minutes_to_time(arrival),
+                'duration': arrival - departure,
+                'success': True
+            }
+        
+        if self.timetable is not None:
+            local = self.timetable.lookup(from_station, to_station, time_to_minutes(start_time))
+            if local is not None:
+                self.local_lookups += 1
+                departure, arrival = local
+                return {
+                    'departure': minutes_to_time(departure),
+                    'arrival': minutes_to_time(arrival),
+                    'duration': arrival - departure,
+                    'success': True
+                }
+        
+        self.live_queries += 1
         params = {
             'from': from_station,
             'to': to_station,
@@ -78,9 +140,7 @@ class SBBRouteCalculator:
         }
         
         try:
-            response = requests.get(self.api_url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            data = self.client.get_connections(params, self.api_url)
             
             if data['connections'] and len(data['connections']) > 0:
                 conn = data['connections'][0]
@@ -103,9 +163,28 @@ class SBBRouteCalculator:
             else:
                 return {'success': False, 'error': 'No connections found'}
                 
+        except CacheMissError:
+            raise
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def memo_leg(self, from_station: str, to_station: str, current_time: str) -> Dict:
+        """
+        Connection from one station to the next at `current_time`, evaluated once per
+        (from, to, time). Failed legs are not memoized, so they are asked again.
+        """
+        self.legs_requested += 1
+        key = (from_station, to_station, current_time)
+        conn = self.leg_memo.get(key) if self.memoize_legs else None
+        if conn is not None:
+            self.legs_from_memo += 1
+            return conn
+        
+        conn = self.get_connection_time(from_station, to_station, current_time)
+        if conn['success'] and self.memoize_legs:
+            self.leg_memo[key] = conn
+        return conn
+    
     def calculate_route_time(self, stations: List[str], route_name: str, 
                            direction: str) -> Dict:
         """Calculate total time for a route through multiple stations"""
@@ -129,20 +208,22 @@ class SBBRouteCalculator:
             from_station = stations[i]
             to_station = stations[i + 1]
 
-            if i == 0 and from_station == "S. Vittore, Zona industriale" and to_station == "Bellinzona":
-                results['start_time'] = "04:37"
-                results['total_duration'] = 30
-                current_time = "05:07"
+            if i == 0 and (from_station, to_station) in FIXED_LEGS:
+                departure, arrival = FIXED_LEGS[(from_station, to_station)]
+                duration = time_to_minutes(arrival) - time_to_minutes(departure)
+                results['start_time'] = departure
+                results['total_duration'] = duration
+                current_time = arrival
                 results['segments'].append({
-                    'from': "S. Vittore, Zona industriale",
-                    'to': "Bellinzona",
-                    'departure':  "04:37",
-                    'arrival': "05:07",
-                    'duration': 30
+                    'from': from_station,
+                    'to': to_station,
+                    'departure': departure,
+                    'arrival': arrival,
+                    'duration': duration
                 })
                 continue
         
-            conn = self.get_connection_time(from_station, to_station, current_time)     
+            conn = self.memo_leg(from_station, to_station, current_time)
 
             if conn['success']:
                 if i==0:
@@ -186,50 +267,219 @@ class SBBRouteCalculator:
         
         return results
     
-    def process_all_routes(self):
-        """Process all 54 routes (27 paths × 2 directions)"""
+    def leg_minutes(self, from_station: str, to_station: str, after: int,
+                    first: bool = False) -> Optional[Tuple[int, int]]:
+        """
+        (departure, arrival) in minutes from midnight of self.date (past 1440 after midnight).
+        FIXED_LEGS are only taken as the first leg of a route, as in calculate_route_time.
+        """
+        fixed = FIXED_LEGS.get((from_station, to_station)) if first else None
+        if fixed is not None and time_to_minutes(fixed[0]) >= after:
+            return time_to_minutes(fixed[0]), time_to_minutes(fixed[1])
+        
+        conn = self.get_connection_time(from_station, to_station, minutes_to_time(after))
+        if not conn['success']:
+            return None
+        departure = time_to_minutes(conn['departure']) + after // 1440 * 1440
+        if departure < after:
+            departure += 1440
+        return departure, departure + conn['duration']
+    
+    def route_profile(self, stations: List[str], window_start: int, window_end: int,
+                      step: int = 1) -> Dict:
+        """
+        Arrival at the end of a route for every start minute in [window_start, window_end].
+        A start at t takes the same journey as every start up to that journey's first
+        departure, so only the distinct first departures are evaluated; and the arrival
+        from (leg, time) is memoized, so a later journey that catches up with an earlier
+        one stops there.
+        """
+        arrival_from = {}  # (leg index, time) -> arrival at the last station, None if stranded
+        stats = {'legs': 0, 'reused': 0}
+        
+        def arrive(i: int, t: int) -> Optional[int]:
+            visited = []
+            result = t
+            while i < len(stations) - 1:
+                if (i, t) in arrival_from:
+                    stats['reused'] += 1
+                    result = arrival_from[(i, t)]
+                    break
+                visited.append((i, t))
+                stats['legs'] += 1
+                leg = self.leg_minutes(stations[i], stations[i + 1], t)
+                if leg is None:
+                    result = None
+                    break
+                i, t = i + 1, leg[1]
+                result = t
+            for key in visited:
+                arrival_from[key] = result
+            return result
+        
+        journeys = []
+        t = window_start
+        while t <= window_end:
+            stats['legs'] += 1
+            first = self.leg_minutes(stations[0], stations[1], t, first=True)
+            if first is None or first[0] > window_end:
+                break
+            arrival = arrive(1, first[1])
+            if arrival is not None:
+                journeys.append((first[0], arrival))
+            t = first[0] + 1
+        
+        # Arrival for each start minute: the first journey leaving at or after it
+        curve = []
+        j = 0
+        for start in range(window_start, window_end + 1, step):
+            while j < len(journeys) and journeys[j][0] < start:
+                j += 1
+            if j == len(journeys):
+                break
+            curve.append({'start': minutes_to_time(start), 'arrival': minutes_to_time(journeys[j][1]),
+                          'wait': journeys[j][0] - start, 'duration': journeys[j][1] - journeys[j][0]})
+        
+        profile = {
+            'stations': stations,
+            'journeys': [
+                {'departure': minutes_to_time(dep), 'arrival': minutes_to_time(arr), 'duration': arr - dep}
+                for dep, arr in journeys
+            ],
+            'curve': curve,
+            'legs_evaluated': stats['legs'],
+            'legs_reused': stats['reused']
+        }
+        if journeys:
+            best = min(journeys, key=lambda j: (j[1] - j[0], j[1]))
+            profile['best_departure'] = minutes_to_time(best[0])
+            profile['best_arrival'] = minutes_to_time(best[1])
+            profile['best_duration'] = best[1] - best[0]
+            profile['earliest_arrival'] = minutes_to_time(min(arr for _, arr in journeys))
+        return profile
+    
+    def sweep_all_routes(self, window_start: str, window_end: str, step: int = 1) -> List[Dict]:
+        """Start-time profiles of all 54 routes (27 paths × 2 directions)."""
+        sorted_rankings = sorted(self.data['rankings'], key=lambda x: x['total_time'])
+        profiles = []
+        
+        for ranking in sorted_rankings:
+            fixed_path = self.fix_combined_path(ranking)
+            route_name = f"Route_{ranking['rank']}_Split_{ranking['split_point']}"
+            for direction, stations in [("forward", fixed_path), ("reverse", fixed_path[::-1])]:
+                profile = self.route_profile(stations, time_to_minutes(window_start),
+                                             time_to_minutes(window_end), step)
+                profile['route_name'] = f"{route_name}_{direction.title()}"
+                profile['direction'] = direction
+                profile['original_rank'] = ranking['rank']
+                profile['split_point'] = ranking['split_point']
+                profile['original_time'] = ranking['total_time']
+                profiles.append(profile)
+                
+                print(f"{profile['route_name']}: {len(profile['journeys'])} journeys, "
+                      f"{profile['legs_evaluated']} legs evaluated, {profile['legs_reused']} reused", end="")
+                if profile['journeys']:
+                    print(f", best {profile['best_departure']}-{profile['best_arrival']} "
+                          f"({profile['best_duration']} min)")
+                else:
+                    print(", no journey in window")
+        
+        output = {
+            'metadata': {
+                'date': self.date,
+                'window_start': window_start,
+                'window_end': window_end,
+                'step': step,
+                'timestamp': datetime.now().isoformat()
+            },
+            'profiles': profiles
+        }
+        with open('sbb_route_profiles.json', 'w') as f:
+            json.dump(output, f, indent=2)
+        print("\nProfiles saved to sbb_route_profiles.json")
+        
+        summary = [
+            {
+                'Route': p['route_name'],
+                'Original Time': p['original_time'],
+                'Journeys': len(p['journeys']),
+                'Best Departure': p['best_departure'],
+                'Best Arrival': p['best_arrival'],
+                'Best Duration': p['best_duration'],
+                'Earliest Arrival': p['earliest_arrival']
+            }
+            for p in profiles if p['journeys']
+        ]
+        if summary:
+            df = pd.DataFrame(summary).sort_values('Best Duration')
+            print("\n" + "="*100)
+            print("START-TIME SWEEP SUMMARY")
+            print("="*100)
+            print(df.to_string(index=False))
+        
+        return profiles
+    
+    def process_all_routes(self, journal: Optional[Journal] = None):
+        """
+        Process all 54 routes (27 paths × 2 directions). With a journal, every finished
+        route is appended to it, routes it already holds a successful result for (same
+        date, start time, engine and inputs) are skipped, and the results are rebuilt
+        from it at the end.
+        """
+        run = {'date': self.date, 'start': self.start_time, 'engine': self.engine, 'inputs': self.inputs}
+        
+        def same_run(record: Dict) -> bool:
+            return all(record.get(field) == value for field, value in run.items())
+        
+        done = {}
+        if journal is not None:
+            for record in journal.records():
+                if same_run(record) and record['result']['success']:
+                    done[record['key']] = record['result']
+        
         # Sort by original total_time to start with shortest
         sorted_rankings = sorted(self.data['rankings'], 
                                key=lambda x: x['total_time'])
         
+        order = []
         for idx, ranking in enumerate(sorted_rankings):
             # Fix the combined path
             fixed_path = self.fix_combined_path(ranking)
-            
-            # Process forward direction
             route_name = f"Route_{ranking['rank']}_Split_{ranking['split_point']}"
             
-            # Forward direction
-            forward_result = self.calculate_route_time(
-                fixed_path, 
-                f"{route_name}_Forward",
-                "forward"
-            )
-            forward_result['original_rank'] = ranking['rank']
-            forward_result['split_point'] = ranking['split_point']
-            forward_result['original_time'] = ranking['total_time']
-            self.results.append(forward_result)
-            
-            # Save intermediate results
-            self.save_results(f"sbb_routes_progress_{idx+1}.json")
-            
-            # Reverse direction
-            reverse_result = self.calculate_route_time(
-                fixed_path[::-1],
-                f"{route_name}_Reverse",
-                "reverse"
-            )
-            reverse_result['original_rank'] = ranking['rank']
-            reverse_result['split_point'] = ranking['split_point']
-            reverse_result['original_time'] = ranking['total_time']
-            self.results.append(reverse_result)
-            
-            # Save intermediate results
-            self.save_results(f"sbb_routes_progress_{idx+1}.json")
+            for direction, stations in [("forward", fixed_path), ("reverse", fixed_path[::-1])]:
+                key = '|'.join(stations)
+                metadata = {
+                    'route_name': f"{route_name}_{direction.title()}",
+                    'direction': direction,
+                    'original_rank': ranking['rank'],
+                    'split_point': ranking['split_point'],
+                    'original_time': ranking['total_time']
+                }
+                order.append((key, metadata))
+                
+                if key in done:
+                    print(f"\nSkipping {metadata['route_name']}: already in the journal")
+                    self.results.append(dict(done[key], **metadata))
+                    continue
+                
+                result = self.calculate_route_time(stations, metadata['route_name'], direction)
+                result.update(metadata)
+                self.results.append(result)
+                if journal is not None:
+                    journal.append(dict(run, key=key, result=result))
             
             # Print summary table every 5 routes
             if (idx + 1) % 5 == 0:
                 self.print_summary_table()
+        
+        if journal is not None:
+            journal.sync()
+            latest = {}
+            for record in journal.records():
+                if same_run(record):
+                    latest[record['key']] = record['result']
+            self.results = [dict(latest[key], **metadata) for key, metadata in order]
     
     def save_results(self, filename: str):
         """Save results to JSON file"""
@@ -292,17 +542,76 @@ class SBBRouteCalculator:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Calculate actual SBB timetable times for the step3 routes")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Response cache file (SQLite)")
+    parser.add_argument("--no-cache", action="store_true", help="Always query the API")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Cache entry lifetime in hours")
+    parser.add_argument("--offline", action="store_true", help="Serve queries from the cache only")
+    parser.add_argument("--timetable", default="output_step2/swiss_canton_connection_timetable.json",
+                        help="Departure/arrival sidecar written by step2")
+    parser.add_argument("--engine", choices=["api", "local", "gtfs"], default="api",
+                        help="'local' answers every leg offline from the timetable sidecar and cached responses, "
+                             "'gtfs' from a timetable imported with gtfs_import.py")
+    parser.add_argument("--gtfs-timetable", default="gtfs_timetable", help="Directory written by gtfs_import.py")
+    parser.add_argument("--no-leg-memo", action="store_true",
+                        help="Evaluate every leg of every route, even after a prefix shared with an earlier route")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_FILE,
+                        help="Route journal (JSON Lines); routes already in it are not timed again")
+    parser.add_argument("--fresh", action="store_true", help="Discard the journal and time every route")
+    parser.add_argument("--sweep", metavar="HH:MM-HH:MM", default=None,
+                        help="Evaluate every route for each start time in this window (e.g. 04:00-10:00)")
+    parser.add_argument("--sweep-step", type=int, default=1, help="Minutes between start times in the sweep curve")
+    args = parser.parse_args()
+    
+    cache = None
+    if not args.no_cache:
+        ttl = args.cache_ttl * 3600 if args.cache_ttl is not None else None
+        cache = ResponseCache(args.cache, ttl=ttl)
+    client = TransportClient(cache=cache, offline=args.offline)
+    
+    timetable = ConnectionTimetable.load(args.timetable) if os.path.exists(args.timetable) else None
+    
+    graph = None
+    if args.engine == "local":
+        graph = TimetableGraph("2025-06-17")
+        if timetable is not None:
+            graph.add_timetable(timetable)
+        if cache is not None:
+            graph.add_cached_responses(cache)
+        graph.finalize()
+        print(f"Local timetable graph: {len(graph.stations)} stations, {len(graph.conn_dep)} connections")
+    elif args.engine == "gtfs":
+        graph = load_gtfs_timetable(args.gtfs_timetable)
+        print(f"GTFS timetable for {graph.date}: {len(graph.stations)} stops, {len(graph.conn_dep)} connections")
+    
     # Load route data
-    calculator = SBBRouteCalculator('output_step3/top_27_canton_routes.json')
+    calculator = SBBRouteCalculator('output_step3/top_27_canton_routes.json', client, timetable, graph)
+    calculator.memoize_legs = not args.no_leg_memo
+    calculator.engine = args.engine
     
     print("SBB Route Time Calculator")
     print(f"Date: {calculator.date} (Tuesday)")
+    
+    if args.sweep:
+        window_start, window_end = args.sweep.split("-")
+        print(f"Start-time sweep: {window_start} to {window_end}, every {args.sweep_step} min")
+        print("-" * 50)
+        calculator.sweep_all_routes(window_start, window_end, args.sweep_step)
+        print(f"\nLegs answered locally: {calculator.local_lookups}, "
+              f"via the connections endpoint: {calculator.live_queries}")
+        print(f"API requests: {client.request_count}")
+        return
+    
     print(f"Start time: {calculator.start_time}")
     print(f"Total routes to process: 54 (27 paths × 2 directions)")
     print("-" * 50)
     
     # Process all routes
-    calculator.process_all_routes()
+    if args.fresh and os.path.exists(args.journal):
+        os.remove(args.journal)
+    journal = Journal(args.journal)
+    calculator.process_all_routes(journal)
+    journal.close()
     
     # Save final results
     calculator.save_results('sbb_routes_final.json')
@@ -310,6 +619,14 @@ def main():
     # Print final summary
     calculator.print_summary_table()
     
+    evaluated = calculator.local_lookups + calculator.live_queries
+    print(f"\nLegs in all routes: {calculator.legs_requested}, evaluated: {evaluated} "
+          f"({calculator.legs_from_memo} from the leg memo)")
+    print(f"Legs answered from the step2 timetable: {calculator.local_lookups}, "
+          f"via the connections endpoint: {calculator.live_queries}")
+    print(f"API requests: {client.request_count}")
+    if cache is not None:
+        print(f"Cache hits: {cache.hits}, misses: {cache.misses}")
     print("\nProcessing complete!")
 
 
@@ -0,0 +1,64 @@
+import os
+
+from gtfs_import import import_gtfs, load_gtfs_timetable
+
+FEED = os.path.join(os.path.dirname(__file__), "fixtures", "gtfs_small.zip")
+
+
+def test_import_fixture_feed(tmp_path):
+    # Tuesday: WD runs, WD2 is removed and EXTRA added by calendar_dates, WE does not run
+    metadata = import_gtfs(FEED, "2025-06-17", str(tmp_path))
+
+    assert metadata['trips'] == 3
+    assert metadata['unknown_stop_rows'] == 1
+    # The platform is collapsed onto its parent station
+    assert metadata['stops'] == ["Bern", "Olten", "Zürich HB"]
+
+    graph = load_gtfs_timetable(str(tmp_path))
+    connections = sorted(
+        (int(dep), int(arr), graph.stations[int(src)], graph.stations[int(dst)])
+        for dep, arr, src, dst in zip(graph.conn_dep, graph.conn_arr, graph.conn_from, graph.conn_to)
+    )
+    assert connections == [
+        (482, 508, "Bern", "Olten"),
+        (509, 540, "Olten", "Zürich HB"),
+        (510, 535, "Olten", "Zürich HB"),
+        # The row at the unknown stop is skipped, its neighbours are joined
+        (570, 610, "Zürich HB", "Olten"),
+    ]
+
+
+def test_earliest_arrival_on_fixture_feed(tmp_path):
+    import_gtfs(FEED, "2025-06-17", str(tmp_path))
+    graph = load_gtfs_timetable(str(tmp_path))
+
+    # Changing at Olten to the EXTRA trip beats staying on T1 (09:00)
+    assert graph.earliest_journey("Bern", "Zürich HB", 480) == (482, 535)
+    assert graph.earliest_arrival("Bern", "Zürich HB", 483) is None
+    assert graph.earliest_arrival("Zürich HB", "Olten", 541) == 610
+
+
+def test_weekend_service(tmp_path):
+    metadata = import_gtfs(FEED, "2025-06-21", str(tmp_path))
+    graph = load_gtfs_timetable(str(tmp_path))
+
+    assert metadata['trips'] == 1
+    assert graph.earliest_journey("Bern", "Zürich HB", 0) == (480, 520)
+
+
+def test_legs_use_profile_tables(tmp_path, monkeypatch):
+    import_gtfs(FEED, "2025-06-17", str(tmp_path))
+    graph = load_gtfs_timetable(str(tmp_path))
+    stations = ["Bern", "Olten", "Zürich HB"]
+    expected = {(a, b, minute): graph.earliest_journey(a, b, minute)
+                for a in stations for b in stations if a != b for minute in range(470, 620, 3)}
+
+    def no_scan(*args):
+        raise AssertionError("leg() ran a Connection Scan")
+
+    monkeypatch.setattr(graph, "earliest_journey", no_scan)
+    for (a, b, minute), journey in expected.items():
+        assert graph.leg(a, b, minute) == journey
+    # One profile scan per target fills the tables of every canton station pair with journeys
+    assert graph.profiled == {graph.station_id[name] for name in stations}
+    assert (graph.station_id["Bern"], graph.station_id["Zürich HB"]) in graph.edges
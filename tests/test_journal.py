@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from journal import Journal, fingerprint
+from step4_find_actual_times_of_routes import SBBRouteCalculator
+from timetable import ConnectionTimetable
+
+
+class OfflineClient:
+    """Every leg is in the timetable; a query means the test went wrong."""
+
+    def get_connections(self, params, url=None):
+        raise AssertionError(f"unexpected query {params['from']} -> {params['to']}")
+
+
+def test_reopen_cuts_an_interrupted_record(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, batch_size=2)
+    journal.append({'n': 1})
+    # Not synced yet, but visible to the run writing it
+    assert list(journal.records()) == [{'n': 1}]
+    journal.append({'n': 2})
+    journal.close()
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"n": 3')
+    assert Journal.read(path) == [{'n': 1}, {'n': 2}]
+
+    journal = Journal(path)
+    journal.append({'n': 4})
+    journal.close()
+    assert Journal.read(path) == [{'n': 1}, {'n': 2}, {'n': 4}]
+    assert Journal.read(str(tmp_path / "missing.jsonl")) == []
+
+
+def test_fingerprint_follows_file_contents(tmp_path):
+    path = tmp_path / "routes.json"
+    path.write_text("a")
+    first = fingerprint([str(path)])
+    assert fingerprint([str(path)]) == first
+
+    path.write_text("b")
+    assert fingerprint([str(path)]) != first
+    assert fingerprint([str(tmp_path / "missing.json")]) != fingerprint([str(path)])
+
+
+@pytest.fixture
+def calculator(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    routes_file = tmp_path / "routes.json"
+    routes_file.write_text(json.dumps({'rankings': [
+        {'rank': 1, 'split_point': 'B', 'west_path': ['B', 'A'], 'east_path': ['B', 'C'], 'total_time': 60}
+    ]}))
+    timetable = ConnectionTimetable("2025-06-17", "04:00")
+    for from_station, to_station in [("A", "B"), ("B", "A"), ("B", "C"), ("C", "B")]:
+        timetable.add_pair(from_station, to_station, [(minute, minute + 30) for minute in range(300, 600, 60)])
+    return SBBRouteCalculator(str(routes_file), OfflineClient(), timetable)
+
+
+def timed_routes(calculator, path):
+    """Route names timed (not taken from the journal) by one resumed run."""
+    timed = []
+    calculate = calculator.calculate_route_time
+
+    def recording(stations, route_name, direction):
+        timed.append(route_name)
+        result = calculate(stations, route_name, direction)
+        assert result['success']
+        return result
+
+    calculator.calculate_route_time = recording
+    calculator.results = []
+    journal = Journal(path)
+    try:
+        calculator.process_all_routes(journal)
+    finally:
+        journal.close()
+        del calculator.calculate_route_time
+    return timed
+
+
+def test_resume_only_reuses_records_of_the_same_run(calculator, tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    assert len(timed_routes(calculator, path)) == 2
+    assert timed_routes(calculator, path) == []
+    first_results = calculator.results
+
+    calculator.start_time = "05:30"
+    assert len(timed_routes(calculator, path)) == 2
+    assert calculator.results != first_results
+
+    calculator.engine = "gtfs"
+    assert len(timed_routes(calculator, path)) == 2
+
+    # Back to the first run: its records are still there
+    calculator.start_time = "04:00"
+    calculator.engine = "api"
+    assert timed_routes(calculator, path) == []
+    assert calculator.results == first_results
+
+    calculator.inputs = "other"
+    assert len(timed_routes(calculator, path)) == 2
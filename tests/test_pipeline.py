@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from pipeline import IncrementalPipeline
+from step2_find_shortest_distances import station_pair_jobs
+from step4_find_actual_times_of_routes import SBBRouteCalculator
+from timetable import ConnectionTimetable
+
+
+class FakeClient:
+    """Answers every query with one 30 minute connection, except for the pairs it is told about."""
+
+    def __init__(self, failing=(), without_connection=()):
+        self.failing = set(failing)
+        self.without_connection = set(without_connection)
+        self.queries = []
+
+    def get_connections(self, params, url=None):
+        pair = (params['from'], params['to'])
+        self.queries.append(pair)
+        if pair in self.failing:
+            raise RuntimeError("connection reset")
+        if pair in self.without_connection:
+            return {'connections': []}
+        return {'connections': [{
+            'duration': '00d00:30:00',
+            'from': {'departure': '2025-06-17T08:05:00+0200'},
+            'to': {'arrival': '2025-06-17T08:35:00+0200'}
+        }]}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "output_step2").mkdir()
+    return tmp_path
+
+
+def test_step2_retries_failed_fetches_only(workdir):
+    jobs = station_pair_jobs()
+    failing, without_connection = jobs[:3], jobs[3:6]
+    pipeline = IncrementalPipeline(str(workdir / "state.json"))
+
+    first = FakeClient(failing, without_connection)
+    pipeline.update_step2(first, 1, set(), {})
+    assert sorted(first.queries) == sorted(jobs)
+
+    # Only the failed fetches are asked again, not the pairs without a connection
+    second = FakeClient((), without_connection)
+    pipeline.update_step2(second, 1, set(), {})
+    assert sorted(second.queries) == sorted(failing)
+
+    third = FakeClient((), without_connection)
+    pipeline.update_step2(third, 1, set(), {})
+    assert third.queries == []
+
+
+def test_step4_retimes_routes_made_with_other_inputs(workdir):
+    routes_file = workdir / "routes.json"
+    routes_file.write_text(json.dumps({'rankings': [
+        {'rank': 1, 'split_point': 'B', 'west_path': ['B', 'A'], 'east_path': ['B', 'C'], 'total_time': 60}
+    ]}))
+    timetable = ConnectionTimetable("2025-06-17", "04:00")
+    for from_station, to_station in [("A", "B"), ("B", "A"), ("B", "C"), ("C", "B")]:
+        timetable.add_pair(from_station, to_station, [(300, 330), (360, 390)])
+
+    def retimed(calculator):
+        pipeline.update_step4(calculator, set())
+        return pipeline.report['step4']['retimed_routes']
+
+    pipeline = IncrementalPipeline(str(workdir / "state.json"))
+    calculator = SBBRouteCalculator(str(routes_file), FakeClient(), timetable)
+    assert len(retimed(calculator)) == 2
+    assert retimed(calculator) == []
+
+    calculator.start_time = "05:30"
+    assert len(retimed(calculator)) == 2
+
+    calculator.engine = "gtfs"
+    assert len(retimed(calculator)) == 2
+
+    # New departures on one leg only re-time the route using that leg
+    timetable.add_pair("A", "B", [(300, 320), (360, 380)])
+    assert retimed(calculator) == ["Route_1_Split_B_Forward"]
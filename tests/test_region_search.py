@@ -0,0 +1,35 @@
+import os
+from itertools import islice
+
+import pytest
+
+from step3_find_shortest_routes import SwissCantonRegionalPathFinder
+
+INPUT_FILE = os.path.join(os.path.dirname(__file__), "..", "output_step2", "swiss_canton_connection_times.json")
+
+
+@pytest.fixture(scope="module")
+def finder(tmp_path_factory):
+    return SwissCantonRegionalPathFinder(INPUT_FILE, str(tmp_path_factory.mktemp("graph") / "graph.npz"))
+
+
+def region_tours(finder, budget, count=8):
+    finder.memory_budget = budget
+    try:
+        return list(islice(finder.iter_region_tours(finder.west_cantons, "Olten"), count))
+    finally:
+        finder.memory_budget = None
+
+
+def test_beam_search_yields_distinct_tours_in_time_order(finder):
+    exact = region_tours(finder, None)
+    beam = region_tours(finder, 1 << 16)
+    assert finder.last_search_stats['beam']
+
+    paths = [tuple(tour['stations']) for tour in beam]
+    times = [tour['time'] for tour in beam]
+    assert len(set(paths)) == len(paths) == len(exact)
+    assert times == sorted(times)
+    assert beam[0] == exact[0]
+    # The k-th distinct beam tour can be no faster than the k-th best tour
+    assert all(b['time'] >= e['time'] for b, e in zip(beam, exact))
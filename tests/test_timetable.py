@@ -0,0 +1,80 @@
+import numpy as np
+
+from timetable import BatchRouteEvaluator, ConnectionTimetable, TimetableGraph
+
+
+def small_graph() -> TimetableGraph:
+    graph = TimetableGraph("2025-06-17")
+    for departure in (480, 510, 540):
+        graph.add_connection("A", "B", departure, departure + 20)
+    for departure in (505, 560, 600):
+        graph.add_connection("B", "C", departure, departure + 30)
+    graph.add_connection("C", "A", 700, 760)
+    return graph.finalize()
+
+
+def test_batch_matches_route_arrival():
+    graph = small_graph()
+    routes = [["A", "B"], ["A", "B", "C"], ["A", "B", "C", "A"], ["B", "C"], ["C", "A"], ["A"], ["A", "C"],
+              ["A", "X"]]
+    # Includes start times past the last departure of every edge, and chains
+    # that arrive after the last departure of the next leg
+    starts = np.arange(400, 800, 5)
+
+    departure, arrival = BatchRouteEvaluator(graph).evaluate(routes, starts)
+
+    for r, route in enumerate(routes):
+        ids = [graph.station_id.get(station, -1) for station in route]
+        for s, start in enumerate(starts):
+            expected = graph.route_arrival(ids, int(start))
+            assert arrival[r, s] == (-1 if expected is None else expected)
+            if expected is not None and len(route) > 1:
+                assert departure[r, s] == graph.leg(route[0], route[1], int(start))[0]
+
+
+def test_batch_past_last_departure():
+    graph = TimetableGraph("2025-06-17")
+    graph.add_connection("A", "B", 480, 500)
+    graph.finalize()
+
+    departure, arrival = BatchRouteEvaluator(graph).evaluate([["A", "B"]], [600, 480])
+
+    assert departure.tolist() == [[-1, 480]]
+    assert arrival.tolist() == [[-1, 500]]
+
+
+def test_departures_before_the_query_time_are_unknown():
+    timetable = ConnectionTimetable("2025-06-17", "08:00")
+    timetable.add_pair("A", "B", [(485, 505), (515, 535)])
+    graph = TimetableGraph.from_timetable(timetable)
+    ids = [graph.station_id["A"], graph.station_id["B"]]
+
+    # At 04:00 the first recorded departure is not necessarily the earliest one
+    assert graph.leg("A", "B", 240) is None
+    assert graph.route_arrival(ids, 240) is None
+    assert graph.leg("A", "B", 480) == (485, 505)
+    assert graph.route_arrival(ids, 480) == 505
+
+    departure, arrival = BatchRouteEvaluator(graph).evaluate([["A", "B"]], [240, 480])
+    assert departure.tolist() == [[-1, 485]]
+    assert arrival.tolist() == [[-1, 505]]
+
+
+def test_batch_without_edges():
+    graph = TimetableGraph("2025-06-17").finalize()
+    _, arrival = BatchRouteEvaluator(graph).evaluate([["A", "B"], ["A"]], [480])
+    assert arrival.tolist() == [[-1], [480]]
+
+
+def test_scan_does_not_use_edges_before_their_window():
+    graph = TimetableGraph("2025-06-17")
+    graph.add_connection("A", "B", 300, 330)
+    graph.add_connection("B", "C", 500, 520, recorded_from=480)
+    graph.add_connection("C", "D", 600, 630, recorded_from=480)
+    graph.finalize()
+
+    # No direct A -> C edge: the scan reaches B at 330, before B -> C is recorded
+    assert graph.leg("A", "C", 240) is None
+    assert graph.leg("A", "D", 240) is None
+    assert graph.leg("B", "D", 480) == (500, 630)
+    assert graph.leg("B", "C", 480) == (500, 520)
@@ -0,0 +1,83 @@
+import pytest
+
+import transport_api
+from step2_find_shortest_distances import fetch_connection_details
+from transport_api import CacheMissError, ResponseCache, TransportClient
+
+URL = transport_api.API_URL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(transport_api.time, "time", clock)
+    return clock
+
+
+def query(from_station, time="08:00"):
+    return {'from': from_station, 'to': "Bern", 'time': time, 'date': "2025-06-17"}
+
+
+def test_normalized_queries_share_an_entry(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put(URL, query("Olten", "8:00"), {'connections': []})
+
+    assert cache.get(URL.replace("http:", "https:"), query("Olten", "08:00")) == {'connections': []}
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put(URL, query("Olten"), {'connections': []})
+
+    clock.now += 60
+    assert cache.get(URL, query("Olten")) is not None
+    clock.now += 1
+    assert cache.get(URL, query("Olten")) is None
+    assert list(cache.entries()) == []
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    payload = {'connections': [], 'padding': "x" * 100}
+    size = len(transport_api.json.dumps(payload))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=2 * size)
+
+    cache.put(URL, query("Olten"), payload)
+    clock.now += 1
+    cache.put(URL, query("Aarau"), payload)
+    clock.now += 1
+    # Reading Olten makes Aarau the least recently used entry
+    cache.get(URL, query("Olten"))
+    clock.now += 1
+    cache.put(URL, query("Zug"), payload)
+
+    assert cache.get(URL, query("Aarau")) is None
+    assert cache.get(URL, query("Olten")) is not None
+    assert cache.get(URL, query("Zug")) is not None
+
+
+def test_offline_mode_answers_from_the_cache_only(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put(URL, query("Olten"), {'connections': []})
+    client = TransportClient(cache=cache, offline=True)
+
+    assert client.get_connections(query("Olten")) == {'connections': []}
+    with pytest.raises(CacheMissError):
+        client.get_connections(query("Aarau"))
+    assert client.request_count == 0
+
+    # A cache miss is not reported as a failed fetch to be retried later
+    with pytest.raises(CacheMissError):
+        fetch_connection_details("Aarau", "Bern", client)
+
+    with pytest.raises(ValueError):
+        TransportClient(offline=True)
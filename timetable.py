@@ -0,0 +1,493 @@
+"""
+Local timetable data for station pairs
+Stores the departure/arrival times returned by the connections API in a compact
+columnar sidecar file so later steps can answer time-dependent lookups offline,
+and builds an in-memory time-dependent graph with Connection Scan queries and a
+vectorized batch evaluator for many routes and start times.
+"""
+
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_TIMETABLE_FILE = "swiss_canton_connection_timetable.json"
+
+
+def time_to_minutes(time_str: str) -> int:
+    """Convert 'HH:MM' to minutes since midnight."""
+    hours, minutes = time_str.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def minutes_to_time(minutes: int) -> str:
+    """Convert minutes since midnight to 'HH:MM' (wrapping past midnight)."""
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def api_minutes(datetime_str: str, date: str) -> int:
+    """Convert an API timestamp like '2025-06-17T08:02:00+0200' to minutes since midnight of `date`."""
+    local = datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S%z")
+    days = (local.date() - datetime.strptime(date, "%Y-%m-%d").date()).days
+    return days * 24 * 60 + local.hour * 60 + local.minute
+
+
+def extract_connection_times(data: Dict, date: str) -> List[Tuple[int, int]]:
+    """Extract sorted (departure, arrival) minutes from a connections API payload."""
+    times = []
+    for conn in data.get('connections') or []:
+        departure = conn.get('from', {}).get('departure')
+        arrival = conn.get('to', {}).get('arrival')
+        if departure and arrival:
+            times.append((api_minutes(departure, date), api_minutes(arrival, date)))
+    return sorted(times)
+
+
+class ConnectionTimetable:
+    def __init__(self, date: str, query_time: str):
+        """
+        Departure lists per directed station pair, all in minutes since midnight of `date`.
+        Each list covers the departures the API returned from `query_time` onward.
+        """
+        self.date = date
+        self.query_time = query_time
+        self.query_minute = time_to_minutes(query_time)
+        self.pairs = {}  # (from_station, to_station) -> (departures, arrivals)
+
+    def add_pair(self, from_station: str, to_station: str, times: List[Tuple[int, int]]):
+        """Record the (departure, arrival) list for one direction of a station pair."""
+        times = sorted(times)
+        self.pairs[(from_station, to_station)] = ([dep for dep, _ in times], [arr for _, arr in times])
+
+    def lookup(self, from_station: str, to_station: str, after_minute: int) -> Optional[Tuple[int, int]]:
+        """
+        First recorded departure at or after `after_minute` as (departure, arrival).
+        Returns None when the pair or that time is outside the recorded window, in
+        which case the caller has to ask the API.
+        """
+        pair = self.pairs.get((from_station, to_station))
+        if pair is None or after_minute < self.query_minute:
+            return None
+
+        departures, arrivals = pair
+        i = bisect_left(departures, after_minute)
+        if i == len(departures):
+            return None
+        return departures[i], arrivals[i]
+
+    def digest(self) -> str:
+        """Short hash of the recorded departures, to tell timetables apart."""
+        content = [self.date, self.query_time, sorted([list(pair), times] for pair, times in self.pairs.items())]
+        return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+    def save(self, filename: str = DEFAULT_TIMETABLE_FILE):
+        """Write the timetable as one station dictionary plus flat integer columns."""
+        stations = sorted({station for pair in self.pairs for station in pair})
+        station_id = {station: i for i, station in enumerate(stations)}
+
+        pair_from, pair_to, offsets = [], [], [0]
+        departures, arrivals = [], []
+        for (from_station, to_station), (deps, arrs) in sorted(self.pairs.items()):
+            pair_from.append(station_id[from_station])
+            pair_to.append(station_id[to_station])
+            departures.extend(deps)
+            arrivals.extend(arrs)
+            offsets.append(len(departures))
+
+        output = {
+            'date': self.date,
+            'query_time': self.query_time,
+            'stations': stations,
+            'pair_from': pair_from,
+            'pair_to': pair_to,
+            'offsets': offsets,
+            'departure': departures,
+            'arrival': arrivals
+        }
+
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename: str = DEFAULT_TIMETABLE_FILE) -> 'ConnectionTimetable':
+        """Read a timetable written by `save`."""
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        timetable = cls(data['date'], data['query_time'])
+        stations = data['stations']
+        offsets = data['offsets']
+        for i, (from_id, to_id) in enumerate(zip(data['pair_from'], data['pair_to'])):
+            start, end = offsets[i], offsets[i + 1]
+            timetable.pairs[(stations[from_id], stations[to_id])] = (
+                data['departure'][start:end], data['arrival'][start:end]
+            )
+        return timetable
+
+
+class TimetableGraph:
+    def __init__(self, date: str):
+        """
+        Time-dependent connection graph for one service date.
+        Connections are (departure, arrival) minutes between two stations,
+        optionally tagged with a trip id so a seated passenger stays on board.
+        """
+        self.date = date
+        self.stations = []
+        self.station_id = {}
+        self.pending = []  # (departure, arrival, from_id, to_id, trip) until finalize()
+        self.pending_windows = {}  # (from_id, to_id) -> first recorded minute, None for the whole day
+
+        # Connection Scan columns, sorted by departure
+        self.conn_dep = []
+        self.conn_arr = []
+        self.conn_from = []
+        self.conn_to = []
+        self.conn_trip = []
+
+        # Direct edges for journey connections (trip -1):
+        # (from_id, to_id) -> (departures, best arrival, best departure), where index i holds
+        # the earliest arrival of any journey departing at or after departures[i]
+        self.edges = {}
+        # First minute each direct edge has departures recorded from (API queries only
+        # return departures after their query time); edges missing here are complete
+        self.edge_window = {}
+        # Stations whose edges to each other are filled by a profile scan on first use
+        # (GTFS graphs, where every connection belongs to a trip), and the targets done
+        self.profile_stations = None
+        self.profiled = set()
+
+    def intern(self, station: str) -> int:
+        """Return the integer id of a station, adding it if needed."""
+        if station not in self.station_id:
+            self.station_id[station] = len(self.stations)
+            self.stations.append(station)
+        return self.station_id[station]
+
+    def add_connection(self, from_station: str, to_station: str, departure: int, arrival: int, trip: int = -1,
+                       recorded_from: Optional[int] = None):
+        """
+        Add one connection; call finalize() once all are added. `recorded_from` is the
+        first minute covered by the query the connection came from (None: the whole
+        day is known, as in a GTFS feed); earlier departures of the pair are unknown.
+        """
+        from_id, to_id = self.intern(from_station), self.intern(to_station)
+        self.pending.append((departure, arrival, from_id, to_id, trip))
+        edge = (from_id, to_id)
+        if recorded_from is None or self.pending_windows.get(edge, recorded_from) is None:
+            self.pending_windows[edge] = None
+        else:
+            self.pending_windows[edge] = min(recorded_from, self.pending_windows.get(edge, recorded_from))
+
+    def finalize(self) -> 'TimetableGraph':
+        """Sort the connections and build the per-edge lookup tables."""
+        connections = sorted(set(self.pending))
+        self.pending = []
+
+        self.conn_dep = [c[0] for c in connections]
+        self.conn_arr = [c[1] for c in connections]
+        self.conn_from = [c[2] for c in connections]
+        self.conn_to = [c[3] for c in connections]
+        self.conn_trip = [c[4] for c in connections]
+
+        by_edge = {}
+        for departure, arrival, from_id, to_id, trip in connections:
+            if trip >= 0:
+                continue
+            by_edge.setdefault((from_id, to_id), []).append((departure, arrival))
+
+        self.edges = {}
+        for edge, times in by_edge.items():
+            departures = [dep for dep, _ in times]
+            best_arr = [0] * len(times)
+            best_dep = [0] * len(times)
+            arr_min, dep_min = None, None
+            for i in range(len(times) - 1, -1, -1):
+                dep, arr = times[i]
+                if arr_min is None or arr < arr_min:
+                    arr_min, dep_min = arr, dep
+                best_arr[i] = arr_min
+                best_dep[i] = dep_min
+            self.edges[edge] = (departures, best_arr, best_dep)
+
+        self.edge_window = {edge: start for edge, start in self.pending_windows.items()
+                            if start is not None and edge in self.edges}
+        self.pending_windows = {}
+        return self
+
+    def digest(self) -> str:
+        """Short hash of the stations, connections and recorded windows of a finalized graph."""
+        digest = hashlib.sha256(json.dumps([self.date, self.stations], ensure_ascii=False).encode('utf-8'))
+        for column in (self.conn_dep, self.conn_arr, self.conn_from, self.conn_to, self.conn_trip):
+            digest.update(np.asarray(column, dtype=np.int64).tobytes())
+        digest.update(json.dumps(sorted(self.edge_window.items())).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def recorded(self, edge: Tuple[int, int], after_minute: int) -> bool:
+        """Whether the departures of a direct edge are known from `after_minute` on."""
+        return after_minute >= self.edge_window.get(edge, after_minute)
+
+    @classmethod
+    def from_timetable(cls, timetable: ConnectionTimetable) -> 'TimetableGraph':
+        """Build a graph from the step2 departure sidecar."""
+        graph = cls(timetable.date)
+        graph.add_timetable(timetable)
+        return graph.finalize()
+
+    def add_timetable(self, timetable: ConnectionTimetable):
+        """Add every recorded journey of a ConnectionTimetable as a direct connection."""
+        for (from_station, to_station), (departures, arrivals) in timetable.pairs.items():
+            for departure, arrival in zip(departures, arrivals):
+                self.add_connection(from_station, to_station, departure, arrival,
+                                    recorded_from=timetable.query_minute)
+
+    def add_cached_responses(self, cache) -> int:
+        """Add the journeys of every cached connections query for this date; returns the query count."""
+        count = 0
+        for query, payload in cache.entries():
+            params = query['params']
+            if params.get('date') != self.date or 'from' not in params or 'to' not in params:
+                continue
+            recorded_from = time_to_minutes(params['time'][:5]) if params.get('time') else None
+            for departure, arrival in extract_connection_times(payload, self.date):
+                self.add_connection(params['from'], params['to'], departure, arrival, recorded_from=recorded_from)
+            count += 1
+        return count
+
+    def leg(self, from_station: str, to_station: str, after_minute: int) -> Optional[Tuple[int, int]]:
+        """
+        Earliest-arrival (departure, arrival) from one station to another leaving at
+        or after `after_minute`. Uses the direct edge table when the pair was recorded,
+        otherwise a Connection Scan over the whole graph. Returns None before the
+        first recorded minute of the pair, whose earlier departures are unknown.
+        """
+        from_id = self.station_id.get(from_station)
+        to_id = self.station_id.get(to_station)
+        if from_id is None or to_id is None:
+            return None
+
+        edge = self.edges.get((from_id, to_id))
+        if edge is None and self.profile_stations is not None and from_id != to_id \
+                and from_id in self.profile_stations and to_id in self.profile_stations:
+            if to_id not in self.profiled:
+                self.add_profile_edges(to_id)
+            edge = self.edges.get((from_id, to_id))
+            if edge is None:
+                return None
+        if edge is not None:
+            if not self.recorded((from_id, to_id), after_minute):
+                return None
+            departures, best_arr, best_dep = edge
+            i = bisect_left(departures, after_minute)
+            if i < len(departures):
+                return best_dep[i], best_arr[i]
+            return None
+
+        return self.earliest_journey(from_station, to_station, after_minute)
+
+    def add_profile_edges(self, target_id: int, chunk: int = 1 << 16):
+        """
+        Profile Connection Scan towards one station: one backward pass over the
+        connections gives every station its Pareto (departure, arrival) journeys to
+        `target_id`, which become the direct edge tables from the profile stations.
+        Assumes the whole day is known (no recorded windows), as in a GTFS feed.
+        """
+        infinity = float('inf')
+        profiles = {}  # station -> (negated departures, arrivals), latest departure first
+        trip_arrival = {}  # trip -> earliest arrival at the target staying on board
+
+        for end in range(len(self.conn_dep), 0, -chunk):
+            start = max(0, end - chunk)
+            columns = [np.asarray(column[start:end]).tolist() for column in
+                       (self.conn_dep, self.conn_arr, self.conn_from, self.conn_to, self.conn_trip)]
+            for departure, arrival, from_id, to_id, trip in zip(*(reversed(column) for column in columns)):
+                best = arrival if to_id == target_id else infinity
+                if trip >= 0:
+                    best = min(best, trip_arrival.get(trip, infinity))
+                profile = profiles.get(to_id)
+                if profile is not None:
+                    # Earliest arrival of the journeys leaving the next station at or after `arrival`
+                    i = bisect_right(profile[0], -arrival) - 1
+                    if i >= 0 and profile[1][i] < best:
+                        best = profile[1][i]
+                if best == infinity:
+                    continue
+                if trip >= 0 and best < trip_arrival.get(trip, infinity):
+                    trip_arrival[trip] = best
+                if from_id == target_id:
+                    continue
+
+                negated, arrivals = profiles.setdefault(from_id, ([], []))
+                if arrivals and best >= arrivals[-1]:
+                    continue
+                if negated and negated[-1] == -departure:
+                    arrivals[-1] = best
+                else:
+                    negated.append(-departure)
+                    arrivals.append(best)
+
+        for source_id in self.profile_stations:
+            if source_id in profiles and source_id != target_id:
+                negated, arrivals = profiles[source_id]
+                departures = [-dep for dep in reversed(negated)]
+                self.edges[(source_id, target_id)] = (departures, arrivals[::-1], list(departures))
+        self.profiled.add(target_id)
+
+    def earliest_arrival(self, source: str, target: str, depart_after: int) -> Optional[int]:
+        """Earliest arrival at `target` leaving `source` at or after `depart_after`."""
+        journey = self.earliest_journey(source, target, depart_after)
+        return journey[1] if journey is not None else None
+
+    def earliest_journey(self, source: str, target: str, depart_after: int) -> Optional[Tuple[int, int]]:
+        """
+        Connection Scan Algorithm: (departure from `source`, arrival at `target`) of the
+        earliest-arrival journey leaving at or after `depart_after`. A connection of
+        a recorded edge is only taken by a traveller at its station from the first
+        recorded minute of the edge on, as in leg(); before it the earliest
+        departure is unknown.
+        """
+        source_id = self.station_id.get(source)
+        target_id = self.station_id.get(target)
+        if source_id is None or target_id is None:
+            return None
+        if source_id == target_id:
+            return depart_after, depart_after
+
+        infinity = float('inf')
+        arrival = [infinity] * len(self.stations)
+        arrival[source_id] = depart_after
+        first_departure = [None] * len(self.stations)
+        trip_departure = {}  # trip -> departure from source of the journey that boarded it
+
+        conn_dep, conn_arr = self.conn_dep, self.conn_arr
+        conn_from, conn_to, conn_trip = self.conn_from, self.conn_to, self.conn_trip
+        edge_window = self.edge_window
+
+        for i in range(bisect_left(conn_dep, depart_after), len(conn_dep)):
+            departure = conn_dep[i]
+            if departure >= arrival[target_id]:
+                break
+
+            trip = conn_trip[i]
+            from_id = conn_from[i]
+            to_id = conn_to[i]
+            if trip >= 0 and trip in trip_departure:
+                start = trip_departure[trip]
+            elif arrival[from_id] <= departure and (
+                    not edge_window or arrival[from_id] >= edge_window.get((from_id, to_id), 0)):
+                start = departure if from_id == source_id else first_departure[from_id]
+                if trip >= 0:
+                    trip_departure[trip] = start
+            else:
+                continue
+
+            if conn_arr[i] < arrival[to_id]:
+                arrival[to_id] = conn_arr[i]
+                first_departure[to_id] = start
+
+        if arrival[target_id] == infinity:
+            return None
+        return int(first_departure[target_id]), int(arrival[target_id])
+
+    def evaluate_route(self, stations: List[str], start_minute: int) -> Optional[List[Tuple[int, int]]]:
+        """Chain the legs of a route from `start_minute` (0 min transfers); None if any leg is unreachable."""
+        legs = []
+        current = start_minute
+        for from_station, to_station in zip(stations, stations[1:]):
+            leg = self.leg(from_station, to_station, current)
+            if leg is None:
+                return None
+            legs.append(leg)
+            current = leg[1]
+        return legs
+
+    def route_arrival(self, station_ids: List[int], start_minute: int) -> Optional[int]:
+        """Arrival time of a route given as station ids, using direct edges only (hot path)."""
+        edges = self.edges
+        edge_window = self.edge_window
+        current = start_minute
+        for edge in zip(station_ids, station_ids[1:]):
+            table = edges.get(edge)
+            if table is None or current < edge_window.get(edge, current):
+                return None
+            departures, best_arr, _ = table
+            i = bisect_left(departures, current)
+            if i == len(departures):
+                return None
+            current = best_arr[i]
+        return current
+
+
+class BatchRouteEvaluator:
+    def __init__(self, graph: TimetableGraph):
+        """
+        Direct-edge tables of a finalized graph flattened into NumPy columns: the
+        departures of edge i are stored as i * span + departure, so one sorted array
+        answers the next departure on any edge with a single searchsorted.
+        """
+        self.graph = graph
+        edges = sorted(graph.edges)
+        self.edge_index = {edge: i for i, edge in enumerate(edges)}
+
+        departures = [np.asarray(graph.edges[edge][0], dtype=np.int64) for edge in edges]
+        self.span = max((int(deps[-1]) for deps in departures if len(deps)), default=0) + 1
+        keys = [i * self.span + deps for i, deps in enumerate(departures)]
+        # A sentinel past the last edge keeps every searchsorted position a valid index
+        self.keys = np.concatenate(keys + [np.array([max(len(edges), 1) * self.span], dtype=np.int64)])
+        # A trailing 0 serves the unknown edges (index -1 maps to 0) of an edgeless graph
+        self.edge_end = np.append(np.cumsum([len(deps) for deps in departures], dtype=np.int64), 0)
+        self.best_arrival = np.array([arr for edge in edges for arr in graph.edges[edge][1]] + [0], dtype=np.int64)
+        self.best_departure = np.array([dep for edge in edges for dep in graph.edges[edge][2]] + [0], dtype=np.int64)
+        self.edge_window = np.array([graph.edge_window.get(edge, np.iinfo(np.int64).min) for edge in edges] + [0],
+                                    dtype=np.int64)
+
+    def route_edges(self, stations: List[str]) -> List[int]:
+        """Edge index of every leg of a route, -1 for a leg without a direct edge."""
+        station_id = self.graph.station_id
+        ids = [station_id.get(station, -1) for station in stations]
+        return [self.edge_index.get(edge, -1) for edge in zip(ids, ids[1:])]
+
+    def evaluate(self, routes: List[List[str]], start_minutes) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Time N routes for M start minutes at once, chaining the legs like
+        TimetableGraph.route_arrival (direct edges, 0 min transfers, unknown before
+        an edge's first recorded minute). All routes
+        advance one leg per step, each step a single searchsorted over every
+        (route, start) pair. Returns (departure, arrival) arrays of shape (N, M):
+        the departure of the first leg and the arrival at the last station, -1 for
+        combinations that cannot complete the route.
+        """
+        starts = np.asarray(start_minutes, dtype=np.int64)
+        legs = max((len(stations) - 1 for stations in routes), default=0)
+        # Edge per route and leg; -2 pads routes that have already ended
+        edge_ids = np.full((len(routes), max(legs, 0)), -2, dtype=np.int64)
+        for r, stations in enumerate(routes):
+            route_edges = self.route_edges(stations)
+            edge_ids[r, :len(route_edges)] = route_edges
+
+        current = np.tile(starts, (len(routes), 1))
+        departure = current.copy()
+        reachable = np.ones(current.shape, dtype=bool)
+
+        for leg in range(legs):
+            rows = np.flatnonzero(edge_ids[:, leg] != -2)
+            edge = edge_ids[rows, leg][:, None]
+            known = np.maximum(edge, 0)
+            # Past the last departure of every edge is the same as at span: the key
+            # then stays at or below the sentinel
+            times = np.minimum(current[rows], self.span)
+
+            position = np.searchsorted(self.keys, known * self.span + times)
+            ok = reachable[rows] & (edge >= 0) & (position < self.edge_end[known]) \
+                & (current[rows] >= self.edge_window[known])
+
+            if leg == 0:
+                departure[rows] = np.where(ok, self.best_departure[position], -1)
+            current[rows] = np.where(ok, self.best_arrival[position], -1)
+            reachable[rows] = ok
+
+        return np.where(reachable, departure, -1), np.where(reachable, current, -1)
@@ -0,0 +1,241 @@
+"""
+Shared client for the transport.opendata.ch connections API
+Keeps one pooled keep-alive session, rate limits requests with a token bucket
+and retries transient failures with exponential backoff. Responses can be
+stored in a persistent SQLite cache shared by step2 and step4.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = "http://transport.opendata.ch/v1/connections"
+
+# HTTP status codes worth retrying (rate limited or temporary server trouble)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+DEFAULT_CACHE_FILE = "transport_cache.sqlite"
+
+
+class CacheMissError(Exception):
+    """Raised in offline mode when a query is not in the response cache."""
+
+
+def normalize_query(url: str, params: Dict) -> Dict:
+    """Reduce a request to the parts that determine its response."""
+    normalized = {str(k).strip().lower(): str(v).strip() for k, v in params.items()}
+
+    # '8:00' and '08:00' are the same query
+    if ':' in normalized.get('time', ''):
+        hours, minutes = normalized['time'].split(':', 1)
+        normalized['time'] = f"{int(hours):02d}:{minutes}"
+
+    # http and https hit the same endpoint
+    return {'endpoint': urlparse(url).path, 'params': normalized}
+
+
+def cache_key(url: str, params: Dict) -> str:
+    """Content address of a query: SHA-256 of its normalized form."""
+    query = normalize_query(url, params)
+    return hashlib.sha256(json.dumps(query, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, ttl: Optional[float] = None,
+                 max_bytes: int = 256 * 1024 * 1024):
+        """
+        SQLite-backed response cache keyed on the normalized query.
+        Entries older than `ttl` seconds are treated as missing; once the stored
+        payloads exceed `max_bytes` the least recently used entries are evicted.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+
+    def get(self, url: str, params: Dict) -> Optional[Dict]:
+        """Return the cached payload for a query, or None."""
+        key = cache_key(url, params)
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.db.commit()
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, url: str, params: Dict, response: Dict):
+        """Store a payload and evict least recently used entries over the size budget."""
+        key = cache_key(url, params)
+        query = json.dumps(normalize_query(url, params), sort_keys=True, ensure_ascii=False)
+        payload = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, query, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query, payload, len(payload), now, now)
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def entries(self) -> Iterator[Tuple[Dict, Dict]]:
+        """Iterate over all (normalized query, payload) pairs in the cache."""
+        with self.lock:
+            rows = self.db.execute("SELECT query, response FROM responses").fetchall()
+        for query, response in rows:
+            yield json.loads(query), json.loads(response)
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self.lock:
+            self.db.close()
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second with bursts of `capacity`"""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class TransportClient:
+    def __init__(self, rate: float = 5.0, burst: int = 5, pool_size: int = 8,
+                 timeout: float = 10, max_retries: int = 4, backoff: float = 1.0,
+                 cache: Optional[ResponseCache] = None, offline: bool = False):
+        """
+        Create a pooled session shared by all worker threads.
+        With `offline` set, queries are answered from `cache` only.
+        """
+        if offline and cache is None:
+            raise ValueError("Offline mode needs a response cache")
+
+        self.cache = cache
+        self.offline = offline
+        self.bucket = TokenBucket(rate, burst)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.count_lock = threading.Lock()
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Exponential backoff, honouring a numeric Retry-After header when present."""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def get_connections(self, params: Dict, url: str = API_URL) -> Dict:
+        """Query the connections endpoint and return the decoded JSON payload."""
+        if self.cache is not None:
+            cached = self.cache.get(url, params)
+            if cached is not None:
+                return cached
+            if self.offline:
+                raise CacheMissError(f"Not in cache: {params.get('from')} -> {params.get('to')}")
+
+        data = self._fetch(params, url)
+        if self.cache is not None:
+            self.cache.put(url, params, data)
+        return data
+
+    def _fetch(self, params: Dict, url: str) -> Dict:
+        """Perform the HTTP request with rate limiting and retries."""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = None
+
+            try:
+                with self.count_lock:
+                    self.request_count += 1
+                response = self.session.get(url, params=params, timeout=self.timeout)
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+
+                error = requests.HTTPError(f"{response.status_code} for {response.url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+
+            with self.count_lock:
+                self.retry_count += 1
+            time.sleep(self._retry_delay(attempt, response))